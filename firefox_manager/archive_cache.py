@@ -0,0 +1,191 @@
+# archive_cache.py
+"""
+Size-capped cache of downloaded build archives in downloads/.
+
+Entries are keyed by the resolved URL and the expected checksum, so a rebuilt archive published
+under the same name never matches a stale copy. A hit is validated by size and mtime only (the
+archive was checksummed when it was stored). When the cached bytes exceed the budget, the least
+recently used archives are deleted. The index, the budget and the hit/miss statistics live in
+downloads/cache_index.json.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from atomicfile import atomic_write_json
+
+CACHE_DIR = "downloads"
+INDEX_FILE = "cache_index.json"
+DEFAULT_BUDGET = 2 * 1024 * 1024 * 1024    # bytes of archives kept; 0 disables the cache
+
+_index = None
+_lock = threading.Lock()
+
+
+def cache_key(url, checksum=None):
+    text = url if not checksum else f"{url}\n{checksum[0]}:{checksum[1]}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def entry_path(url, checksum, filename):
+    """Where the archive for (url, checksum) lives once cached. download_file resumes into it."""
+    return os.path.join(CACHE_DIR, f"{cache_key(url, checksum)[:16]}-{filename}")
+
+
+def enabled():
+    with _lock:
+        return _load_index()["budget"] > 0
+
+
+def lookup(url, checksum=None):
+    """Path of a valid cached copy of url, or None. A hit marks the entry as most recently used."""
+    key = cache_key(url, checksum)
+    with _lock:
+        index = _load_index()
+        entry = index["entries"].get(key)
+        path = os.path.join(CACHE_DIR, entry["file"]) if entry else None
+        if entry and not _is_intact(path, entry):
+            # Deleted or rewritten behind our back
+            del index["entries"][key]
+            entry = None
+        if entry is None:
+            index["stats"]["misses"] += 1
+            _save_index()
+            return None
+        entry["last_used"] = time.time()
+        index["stats"]["hits"] += 1
+        index["stats"]["bytes_saved"] += entry["size"]
+        _save_index()
+        return path
+
+
+def contains(url, checksum=None):
+    """Whether a valid cached copy of url exists, without counting a hit or touching its LRU position."""
+    with _lock:
+        entry = _load_index()["entries"].get(cache_key(url, checksum))
+        return entry is not None and _is_intact(os.path.join(CACHE_DIR, entry["file"]), entry)
+
+
+def store(url, checksum, path, filename=None):
+    """
+    Adopt a verified archive into the cache, moving it to its entry path, then evict least
+    recently used entries down to the budget. The new entry itself is never evicted here, so
+    the caller can go on using the returned path. Returns None (and leaves path alone) when the
+    cache is disabled.
+    """
+    key = cache_key(url, checksum)
+    with _lock:
+        index = _load_index()
+        if index["budget"] <= 0:
+            return None
+        final_path = entry_path(url, checksum, filename or os.path.basename(path))
+        if os.path.abspath(path) != os.path.abspath(final_path):
+            os.replace(path, final_path)
+        st = os.stat(final_path)
+        index["entries"][key] = {
+            "url": url,
+            "checksum": list(checksum) if checksum else None,
+            "file": os.path.basename(final_path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "last_used": time.time(),
+        }
+        _evict(index, keep=key)
+        _save_index()
+        return final_path
+
+
+def discard(url, checksum=None):
+    """Drop an entry whose archive turned out to be unusable."""
+    with _lock:
+        index = _load_index()
+        entry = index["entries"].pop(cache_key(url, checksum), None)
+        if entry:
+            _delete(entry)
+            _save_index()
+
+
+def configure(budget):
+    """Set and persist the byte budget, evicting immediately if the cache is now over it."""
+    with _lock:
+        index = _load_index()
+        index["budget"] = max(0, int(budget))
+        _evict(index)
+        _save_index()
+
+
+def clear():
+    with _lock:
+        index = _load_index()
+        for entry in index["entries"].values():
+            _delete(entry)
+        index["entries"] = {}
+        _save_index()
+
+
+def stats():
+    with _lock:
+        index = _load_index()
+        return {
+            "entries": len(index["entries"]),
+            "bytes": sum(e["size"] for e in index["entries"].values()),
+            "budget": index["budget"],
+            **index["stats"],
+        }
+
+
+def _is_intact(path, entry):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime_ns"]
+
+
+def _evict(index, keep=None):
+    entries = index["entries"]
+    total = sum(e["size"] for e in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+        if total <= index["budget"]:
+            break
+        if key == keep:
+            continue
+        if _delete(entries[key]):
+            total -= entries[key]["size"]
+            del entries[key]
+            index["stats"]["evictions"] += 1
+
+
+def _delete(entry):
+    try:
+        os.remove(os.path.join(CACHE_DIR, entry["file"]))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # e.g. still open by an extraction on Windows; try again at the next eviction
+        print(f"Could not evict cached archive {entry['file']}: {e}")
+        return False
+    return True
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(os.path.join(CACHE_DIR, INDEX_FILE), "r", encoding="utf-8") as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+        _index.setdefault("budget", DEFAULT_BUDGET)
+        _index.setdefault("entries", {})
+        stats = _index.setdefault("stats", {})
+        for name in ("hits", "misses", "bytes_saved", "evictions"):
+            stats.setdefault(name, 0)
+    return _index
+
+
+def _save_index():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    index_path = os.path.join(CACHE_DIR, INDEX_FILE)
+    atomic_write_json(index_path, _index)
@@ -0,0 +1,20 @@
+# atomicfile.py
+"""
+Crash-safe writes of the small state files (caches, indexes, settings, manifests). The content
+goes to a temp file beside the target, which is then swapped in with os.replace: readers, and a
+crash halfway through, only ever see the old file or the new one, never a truncated one.
+"""
+import os
+import json
+
+
+def atomic_write_text(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(path, data, **dump_args):
+    """json.dump data to path atomically; dump_args go to json.dumps (e.g. indent)."""
+    atomic_write_text(path, json.dumps(data, **dump_args))
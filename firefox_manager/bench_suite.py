@@ -0,0 +1,532 @@
+# bench_suite.py
+"""
+Offline benchmark suite. Starts a local fake archive (fake_archive.py) and measures build
+resolution, downloads, extraction, install verification, UI cold start, profile provisioning and
+the LAN mirror without touching the network. Every benchmark runs in its own child process so its peak RSS is
+its own.
+
+    python bench_suite.py --output bench.json
+    python bench_suite.py --quick --compare baseline.json --tolerance 0.25
+    python bench_suite.py --only launch --firefox builds/141.0b3-candidates-linux-x86_64-en-US/firefox/firefox
+
+Latencies are reported as p50/p90/p99/mean in milliseconds, transfers and extraction as MB/s.
+With --compare the exit code is 1 when a metric regressed by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from fake_archive import FakeArchive, populate, make_payload, write_archive
+
+VERSIONS = ["141.0b3", "141.0b4", "141.0b5"]
+VERIFY_SIZES = [10, 100, 1000]
+MATRIX_LANGS = ["en-US", "de", "fr", "ja"]   # resolve matrix: VERSIONS x win64/linux x these
+STARTUP_BUILDS = 1000           # records in the database the cold start benchmark paints
+STARTUP_TARGET_MS = 300         # budget from process start to an interactive window
+PROFILE_TEMPLATE_MB = 40        # synthetic template size when no real Firefox is given, about a used profile's
+MIRROR_CLIENTS = 8              # clients asking the mirror for the same archive at once
+
+# Runs in a fresh interpreter per sample, so every import is cold
+_STARTUP_PROBE = """
+import json, time
+start = time.perf_counter()
+import tkinter
+import ui
+result = {"import_ms": (time.perf_counter() - start) * 1000}
+try:
+    app = ui.FirefoxManagerApp()
+except tkinter.TclError:
+    result["interactive_ms"] = None  # no display
+else:
+    app.wait_visibility()
+    # An idle callback runs once the first paint is done and the event loop is free for input
+    app.after_idle(lambda: result.setdefault("interactive_ms", (time.perf_counter() - start) * 1000))
+    while "interactive_ms" not in result:
+        app.update()
+    app._on_close()
+print(json.dumps(result))
+"""
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "samples": len(ordered),
+        "p50_ms": round(pick(50) * 1000, 3),
+        "p90_ms": round(pick(90) * 1000, 3),
+        "p99_ms": round(pick(99) * 1000, 3),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def timed(fn, iterations, setup=None):
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _point_at(base_url):
+    import net
+    net.configure(base_url=base_url)
+
+
+def _reset_resolution_caches():
+    import listing
+    import downloader
+    listing.clear_cache()
+    downloader._resolved.clear()
+
+
+# --- benchmarks, each run inside a child process with cwd set to a scratch directory ---
+
+def bench_resolve(args):
+    import listing
+    import downloader
+    version = f"{VERSIONS[0]}-candidates"
+    results = {}
+
+    results["cold"] = percentiles(timed(lambda: downloader.resolve_build(version, "linux-x86_64", "en-US"),
+                                        args.iterations * 4, setup=_reset_resolution_caches))
+
+    # Listings past their TTL: one conditional request each, answered with 304
+    def revalidate():
+        downloader._resolved.clear()
+        listing.LISTING_TTL = 0
+
+    results["revalidate_304"] = percentiles(timed(lambda: downloader.resolve_build(version, "linux-x86_64", "en-US"),
+                                                  args.iterations * 4, setup=revalidate))
+    listing.LISTING_TTL = 300
+    downloader.resolve_build(version, "linux-x86_64", "en-US")
+    results["warm"] = percentiles(timed(lambda: downloader.resolve_build(version, "linux-x86_64", "en-US"),
+                                        args.iterations * 20))
+
+    # A whole matrix: one build at a time versus all at once with shared listings
+    import resolver
+    matrix = [(f"{v}-candidates", a, l) for v in VERSIONS for a in ("win64", "linux-x86_64") for l in MATRIX_LANGS]
+    results["matrix_sequential"] = percentiles(timed(lambda: [downloader.resolve_build(*b) for b in matrix],
+                                                     args.iterations, setup=_reset_resolution_caches))
+    results["matrix_concurrent"] = percentiles(timed(lambda: resolver.resolve_many(matrix), args.iterations,
+                                                     setup=_reset_resolution_caches))
+    results["matrix_builds"] = len(matrix)
+    return results
+
+
+def bench_download(args):
+    import downloader
+    results = {}
+    version = f"{VERSIONS[0]}-candidates"
+    for arch in ("win64", "linux-x86_64"):
+        url, filename = downloader.resolve_build_url(version, arch, "en-US")
+        size = downloader.resolve_build(version, arch, "en-US")["size"]
+        for connections in (1, downloader.CONNECTIONS):
+            def clean():
+                shutil.rmtree("downloads", ignore_errors=True)
+
+            def run():
+                downloader.download_file(url, os.path.join("downloads", filename), connections=connections,
+                                         expected_checksum=downloader.get_expected_checksum(url))
+
+            os.makedirs("downloads", exist_ok=True)
+            samples = timed(run, args.iterations, setup=lambda: (clean(), os.makedirs("downloads")))
+            stats = percentiles(samples)
+            stats["throughput_mb_s"] = round(size / (1024 * 1024) / (sum(samples) / len(samples)), 2)
+            results[f"{arch}_{connections}conn"] = stats
+    return results
+
+
+def bench_stream_install(args):
+    import downloader
+    import archive_cache
+    results = {}
+    version = f"{VERSIONS[0]}-candidates"
+    # "cold" always goes to the network; "cached" reinstalls from the archive cache
+    for mode, budget in (("cold", 0), ("cached", archive_cache.DEFAULT_BUDGET)):
+        archive_cache.configure(budget)
+        for arch in ("win64", "linux-x86_64"):
+            size = downloader.resolve_build(version, arch, "en-US")["size"]
+            if budget:
+                downloader.stream_build(version, arch, "en-US", "install")
+            samples = timed(lambda: downloader.stream_build(version, arch, "en-US", "install"), args.iterations,
+                            setup=lambda: shutil.rmtree("install", ignore_errors=True))
+            stats = percentiles(samples)
+            stats["throughput_mb_s"] = round(size / (1024 * 1024) / (sum(samples) / len(samples)), 2)
+            results[arch if mode == "cold" else f"{arch}_{mode}"] = stats
+    return results
+
+
+def bench_extract(args):
+    import manager
+    results = {}
+    template_dir = os.path.join(args.root, ".templates")
+    for archive_format, extract in (("zip", manager.extract_zip), ("tar.xz", manager.extract_tar_xz),
+                                    ("tar.bz2", manager.extract_tar_bz2)):
+        archive = os.path.join(template_dir, f"{VERSIONS[0]}.{archive_format}")
+        if not os.path.exists(archive):
+            continue
+        samples = timed(lambda: extract(archive, "extracted"), args.iterations,
+                        setup=lambda: shutil.rmtree("extracted", ignore_errors=True))
+        unpacked = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk("extracted") for f in fs)
+        files = sum(len(fs) for _, _, fs in os.walk("extracted"))
+        stats = percentiles(samples)
+        mean = sum(samples) / len(samples)
+        stats["throughput_mb_s"] = round(unpacked / (1024 * 1024) / mean, 2)
+        stats["files_per_s"] = round(files / mean, 1)
+        results[archive_format] = stats
+    return results
+
+
+def bench_verify(args):
+    import manager
+    import manifest
+    import version_probe
+    results = {}
+    for count in VERIFY_SIZES:
+        manager.DB_FILE = f"verify-{count}.sqlite3"
+        manager.INSTALL_ROOT = f"builds-{count}"
+        for i in range(count):
+            version = f"141.0b{i}"
+            install_path = manager.get_install_folder(version, "linux-x86_64", "en-US")
+            os.makedirs(os.path.join(install_path, "firefox"), exist_ok=True)
+            with open(os.path.join(install_path, "firefox", "application.ini"), "w", encoding="utf-8") as f:
+                f.write(f"[App]\nVersion={version}\n")
+            with open(os.path.join(install_path, "firefox", "firefox"), "w", encoding="utf-8") as f:
+                f.write("#!/bin/sh\n")
+            manager.add_install_record(version, "linux-x86_64", "en-US", install_path)
+
+        def forget_probes():
+            version_probe._cache = {}
+            if os.path.exists(version_probe.CACHE_FILE):
+                os.remove(version_probe.CACHE_FILE)
+
+        cold = percentiles(timed(manager.verify_installs, args.iterations, setup=forget_probes))
+        warm = percentiles(timed(manager.verify_installs, args.iterations))
+        # File-level check of the same builds against their manifests, nothing changed since recording
+        paths = [entry["install_path"] for entry in manager.load_db()]
+        for path in paths:
+            manifest.record(path, "linux-x86_64")
+        files = percentiles(timed(lambda: manifest.verify(paths), args.iterations))
+        results[f"{count}_builds"] = {"cold": cold, "warm": warm, "files": files}
+    return results
+
+
+def bench_startup(args):
+    import manager
+    for i in range(STARTUP_BUILDS):
+        version = f"141.0b{i}-candidates"
+        manager.add_install_record(version, "linux-x86_64", "en-US",
+                                   manager.get_install_folder(version, "linux-x86_64", "en-US"))
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    imports, interactive, process = [], [], []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], capture_output=True, text=True, env=env,
+                              check=True)
+        process.append(time.perf_counter() - start)
+        sample = json.loads(proc.stdout.strip().splitlines()[-1])
+        imports.append(sample["import_ms"] / 1000)
+        if sample["interactive_ms"] is not None:
+            interactive.append(sample["interactive_ms"] / 1000)
+
+    results = {"builds": STARTUP_BUILDS, "import": percentiles(imports), "process": percentiles(process),
+               "target_ms": STARTUP_TARGET_MS}
+    if interactive:
+        results["interactive"] = percentiles(interactive)
+        results["within_target"] = results["interactive"]["p90_ms"] <= STARTUP_TARGET_MS
+    else:
+        results["interactive"] = "skipped: no display"
+    return results
+
+
+def bench_launch(args):
+    """
+    Provisioning a managed profile by cloning the template, and with --firefox, launch-to-ready
+    time (headless, until the remote agent listens) on a fresh profile versus a cloned one.
+    """
+    import profiles
+    install_path = os.path.join("builds", "bench")
+    results = {}
+
+    if args.firefox:
+        profiles.prepare_template(os.path.abspath(args.firefox))
+    else:
+        # Shaped like a used profile: a few large databases and many small cache entries
+        template = profiles.template_path()
+        payload = make_payload(400, PROFILE_TEMPLATE_MB * 1024 * 1024)
+        for rel_path, data in payload:
+            path = os.path.join(template, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+    template_bytes = sum(os.path.getsize(os.path.join(root, name))
+                         for root, _, files in os.walk(profiles.template_path()) for name in files)
+    results["template_mb"] = round(template_bytes / (1024 * 1024), 1)
+    results["clone"] = percentiles(timed(lambda: profiles.reset_profile(install_path), args.iterations))
+
+    if not args.firefox:
+        results["launch"] = "skipped: pass --firefox"
+        return results
+
+    def launch(profile):
+        process, ready = profiles.start_headless(os.path.abspath(args.firefox), profile)
+        profiles.stop(process)
+        return ready
+
+    fresh, cloned, cloned_total = [], [], []
+    for i in range(args.iterations):
+        fresh_path = f"fresh-{i}"
+        profiles._seed(fresh_path)
+        fresh.append(launch(fresh_path))
+
+        start = time.perf_counter()
+        profile = profiles.reset_profile(install_path)
+        clone_s = time.perf_counter() - start
+        cloned.append(launch(profile))
+        cloned_total.append(clone_s + cloned[-1])
+    results["fresh"] = percentiles(fresh)
+    results["cloned"] = percentiles(cloned)
+    results["cloned_including_clone"] = percentiles(cloned_total)
+    return results
+
+
+def bench_mirror(args):
+    """
+    The LAN mirror with the fake archive as its upstream: MIRROR_CLIENTS clients fetching the same
+    archive at once from an empty cache, then again from the cache. The first iteration also
+    checks Range and suffix-Range responses and slash-less directory paths. Any wrong answer
+    fails the benchmark.
+    """
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+    import downloader
+    import mirror
+
+    def check(condition, what):
+        if not condition:
+            raise Exception(f"Mirror check failed: {what}")
+
+    upstream_url, _ = downloader.resolve_build_url(VERSIONS[0] + "-candidates", "win64", "en-US")
+    relpath = upstream_url[len(args.base_url):]
+    expected = requests.get(upstream_url).content
+
+    cold, cached = [], []
+    for i in range(args.iterations):
+        with mirror.Mirror(args.base_url, f"mirror_cache-{i}", host="127.0.0.1", port=0) as m:
+            url = m.base_url + relpath
+
+            def fetch_all():
+                with ThreadPoolExecutor(max_workers=MIRROR_CLIENTS) as pool:
+                    return list(pool.map(lambda _: requests.get(url).content, range(MIRROR_CLIENTS)))
+
+            start = time.perf_counter()
+            bodies = fetch_all()
+            cold.append(time.perf_counter() - start)
+            check(all(body == expected for body in bodies), "a client got the wrong bytes")
+            check(m.stats["upstream_fetches"] == 1,
+                  f"{m.stats['upstream_fetches']} upstream fetches for {MIRROR_CLIENTS} clients")
+
+            start = time.perf_counter()
+            bodies = fetch_all()
+            cached.append(time.perf_counter() - start)
+            check(all(body == expected for body in bodies), "a client got the wrong bytes from the cache")
+            check(m.stats["upstream_fetches"] == 1, "the second pass went upstream")
+
+            if i == 0:
+                _check_mirror_protocol(m, relpath, expected, check)
+
+    return {"clients": MIRROR_CLIENTS, "archive_mb": round(len(expected) / (1024 * 1024), 2),
+            "cold": percentiles(cold), "cached": percentiles(cached)}
+
+
+def _check_mirror_protocol(m, relpath, expected, check):
+    import requests
+    import downloader
+    url = m.base_url + relpath
+    size = len(expected)
+
+    response = requests.get(url, headers={"Range": "bytes=10-99"})
+    check(response.status_code == 206 and response.content == expected[10:100]
+          and response.headers.get("Content-Range") == f"bytes 10-99/{size}", "Range request")
+    response = requests.get(url, headers={"Range": "bytes=-100"})
+    check(response.status_code == 206 and response.content == expected[-100:], "suffix Range request")
+    response = requests.get(url, headers={"Range": f"bytes={size}-"})
+    check(response.status_code == 416, "unsatisfiable Range request")
+    check(requests.get(m.base_url + "no-such-version/file.zip").status_code == 404, "missing file")
+
+    # A version folder without its trailing slash is a redirect, never a cached file, and the
+    # archives under it still download afterwards
+    version_folder = relpath.split("/", 1)[0]
+    for method in (requests.get, requests.head):
+        response = method(m.base_url + version_folder, allow_redirects=False)
+        check(response.status_code == 301 and response.headers.get("Location", "").endswith(version_folder + "/"),
+              f"slash-less directory {method.__name__.upper()}")
+    check(requests.get(m.base_url + version_folder).status_code == 200, "redirected directory listing")
+    check(not os.path.isfile(os.path.join(m.cache_dir, version_folder)), "directory listing cached as a file")
+    linux_url, _ = downloader.resolve_build_url(VERSIONS[0] + "-candidates", "linux-x86_64", "en-US")
+    linux_relpath = linux_url[len(downloader.base_url()):]
+    response = requests.get(m.base_url + linux_relpath)
+    check(response.status_code == 200 and response.content == requests.get(linux_url).content,
+          "archive under a directory that was asked for without its slash")
+
+
+BENCHMARKS = {
+    "resolve": bench_resolve,
+    "download": bench_download,
+    "stream_install": bench_stream_install,
+    "extract": bench_extract,
+    "verify": bench_verify,
+    "startup": bench_startup,
+    "launch": bench_launch,
+    "mirror": bench_mirror,
+}
+
+
+def run_child(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    _point_at(args.base_url)
+    start = time.perf_counter()
+    result = BENCHMARKS[args.child](args)
+    print(json.dumps({"results": result, "wall_s": round(time.perf_counter() - start, 3),
+                      "peak_rss_mb": peak_rss_mb()}))
+    return 0
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of human readable regressions of report against baseline."""
+    regressions = []
+
+    def walk(path, new, old):
+        if isinstance(new, dict) and isinstance(old, dict):
+            for key in new:
+                if key in old:
+                    walk(path + [key], new[key], old[key])
+            return
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)) or not old:
+            return
+        metric = path[-1]
+        if metric.endswith("_ms") and metric != "mean_ms" and new > old * (1 + tolerance):
+            regressions.append(f"{'.'.join(path)}: {old} -> {new}")
+        elif metric.endswith("_per_s") or metric.endswith("_mb_s"):
+            if new < old * (1 - tolerance):
+                regressions.append(f"{'.'.join(path)}: {old} -> {new}")
+
+    walk([], report["benchmarks"], baseline.get("benchmarks", {}))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Firefox Build Manager benchmarks")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run a subset")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--files", type=int, default=200, help="files per synthetic archive")
+    parser.add_argument("--size-mb", type=int, default=32, help="uncompressed size per synthetic archive")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated per-request latency")
+    parser.add_argument("--bandwidth-mbps", type=float, default=None, help="simulated per-connection cap")
+    parser.add_argument("--quick", action="store_true", help="small archives and few iterations, for CI")
+    parser.add_argument("--root", help="reuse a fake archive tree here (default: temporary)")
+    parser.add_argument("--output", help="write the JSON report here (default stdout)")
+    parser.add_argument("--firefox", help="a real Firefox executable, for the launch benchmark")
+    parser.add_argument("--compare", help="baseline report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    # Internal: run one benchmark in this (child) process
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.iterations, args.files, args.size_mb = 3, 50, 4
+
+    if args.child:
+        return run_child(args)
+
+    scratch = tempfile.mkdtemp(prefix="ffbm-bench-")
+    root = args.root or os.path.join(scratch, "archive")
+    try:
+        populate(root, VERSIONS, ["win64", "linux-x86_64"], ["en-US"], builds=2, file_count=args.files,
+                 total_size=args.size_mb * 1024 * 1024)
+        # Older linux builds ship tar.bz2; only the extraction benchmark needs one
+        bz2_template = os.path.join(root, ".templates", f"{VERSIONS[0]}.tar.bz2")
+        if not os.path.exists(bz2_template):
+            write_archive(bz2_template, make_payload(args.files, args.size_mb * 1024 * 1024), "tar.bz2", VERSIONS[0])
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "archive_mb": args.size_mb,
+                "archive_files": args.files,
+                "iterations": args.iterations,
+                "latency_ms": args.latency_ms,
+                "bandwidth_mbps": args.bandwidth_mbps,
+            },
+            "benchmarks": {},
+        }
+        bandwidth = args.bandwidth_mbps * 1024 * 1024 if args.bandwidth_mbps else None
+        with FakeArchive(root, latency=args.latency_ms / 1000, bandwidth=bandwidth) as archive:
+            for name in args.only or list(BENCHMARKS):
+                print(f"Running {name}...", file=sys.stderr)
+                cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--base-url", archive.base_url,
+                       "--workdir", os.path.join(scratch, name), "--root", root,
+                       "--iterations", str(args.iterations)]
+                if args.firefox:
+                    cmd += ["--firefox", os.path.abspath(args.firefox)]
+                proc = subprocess.run(cmd, capture_output=True, text=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+                if proc.returncode != 0:
+                    report["benchmarks"][name] = {"error": proc.stderr.strip().splitlines()[-1:]}
+                    continue
+                # Children may print progress; the report is the last line
+                report["benchmarks"][name] = json.loads(proc.stdout.strip().splitlines()[-1])
+            report["server"] = {"requests": archive.requests, "bytes_sent": archive.bytes_sent}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# build_index.py
+"""
+In-memory search index over installed builds, used by the UI's filter box.
+
+Each build is keyed by a stable row id. Searches match every whitespace separated term against
+version, architecture and language, so "128 win de" finds 128.0b3 win64 de. A term is compared
+against the distinct field values (a few hundred versions, a handful of arches and languages)
+rather than against every build, so filtering thousands of rows stays cheap.
+"""
+from collections import defaultdict
+
+
+def row_id(version, arch, lang):
+    return f"build|{version}|{arch}|{lang}"
+
+
+class BuildIndex:
+    FIELDS = ("version", "arch", "language")
+
+    def __init__(self):
+        self.rows = {}                                  # row id -> (version, arch, language, status)
+        self._postings = {field: defaultdict(set) for field in self.FIELDS}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, rid):
+        return rid in self.rows
+
+    def put(self, rid, values):
+        """Add or replace a row. Returns True if anything changed."""
+        old = self.rows.get(rid)
+        if old == values:
+            return False
+        if old is not None:
+            self._unindex(rid, old)
+        self.rows[rid] = values
+        for field, value in zip(self.FIELDS, values):
+            self._postings[field][value.lower()].add(rid)
+        return True
+
+    def remove(self, rid):
+        old = self.rows.pop(rid, None)
+        if old is not None:
+            self._unindex(rid, old)
+
+    def search(self, query):
+        """Row ids matching every term of query. An empty query matches everything."""
+        result = None
+        for term in query.lower().split():
+            matches = set()
+            for postings in self._postings.values():
+                for value, rids in postings.items():
+                    if term in value:
+                        matches |= rids
+            result = matches if result is None else result & matches
+            if not result:
+                return set()
+        return set(self.rows) if result is None else result
+
+    def _unindex(self, rid, values):
+        for field, value in zip(self.FIELDS, values):
+            postings = self._postings[field]
+            key = value.lower()
+            postings[key].discard(rid)
+            if not postings[key]:
+                del postings[key]
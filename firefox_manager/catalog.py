@@ -0,0 +1,135 @@
+# catalog.py
+"""
+Local catalog of the candidate versions published on the archive, for autocompletion and for
+rejecting typos before anything is downloaded.
+
+The catalog is persisted in CATALOG_FILE, so it is available instantly (and offline) at startup,
+and refreshed from the candidates listing in the background. The listing is fetched with a
+conditional request (see listing.py), so a refresh of an unchanged listing is a single 304.
+
+Versions are kept twice: in version order (142.0b10 after 142.0b9, betas before the release)
+for display, and in lexical order for prefix search by binary search.
+"""
+import re
+import json
+import time
+import bisect
+import threading
+from atomicfile import atomic_write_json
+
+CATALOG_FILE = "version_catalog.json"
+SUFFIX = "-candidates"
+
+_VERSION_RE = re.compile(r"^(\d+)\.(\d+)(?:\.(\d+))?(?:(a|b|rc)(\d+))?(esr)?$")
+_STAGES = {"a": 0, "b": 1, "rc": 2, None: 3}
+
+_versions = None        # version order, oldest first
+_lexical = []           # the same names, sorted as strings
+_updated_at = None
+_lock = threading.Lock()
+
+
+def version_key(version):
+    """
+    Sort key for Firefox versions: 142.0a1 < 142.0b9 < 142.0b10 < 142.0rc1 < 142.0 < 142.0.1.
+    Accepts names with or without the '-candidates' suffix. Unrecognised names sort first.
+    """
+    name = strip_suffix(version)
+    match = _VERSION_RE.match(name)
+    if not match:
+        return (0, name)
+    major, minor, patch, stage, stage_number, esr = match.groups()
+    return (1, int(major), int(minor), int(patch or 0), _STAGES[stage], int(stage_number or 0), bool(esr))
+
+
+def strip_suffix(version):
+    version = version.strip()
+    return version[:-len(SUFFIX)] if version.endswith(SUFFIX) else version
+
+
+def versions():
+    """Every known version, newest first."""
+    with _lock:
+        _load()
+        return list(reversed(_versions))
+
+
+def updated_at():
+    with _lock:
+        _load()
+        return _updated_at
+
+
+def contains(version):
+    name = strip_suffix(version)
+    with _lock:
+        _load()
+        i = bisect.bisect_left(_lexical, name)
+        return i < len(_lexical) and _lexical[i] == name
+
+
+def complete(prefix, limit=20):
+    """Versions starting with prefix, newest first. Locating them is a binary search."""
+    prefix = strip_suffix(prefix)
+    with _lock:
+        _load()
+        lo = bisect.bisect_left(_lexical, prefix)
+        hi = bisect.bisect_left(_lexical, prefix + "\uffff")
+        matches = _lexical[lo:hi]
+    return sorted(matches, key=version_key, reverse=True)[:limit]
+
+
+def refresh(max_age=None):
+    """
+    Bring the catalog up to date with the candidates listing and persist it.
+    Returns (added, removed) version lists.
+    """
+    from scraper import get_available_versions  # loads the HTTP stack; keep it off the startup path
+
+    fresh = {strip_suffix(v) for v in get_available_versions(max_age=max_age)}
+    with _lock:
+        _load()
+        known = set(_lexical)
+        added = sorted(fresh - known, key=version_key)
+        removed = sorted(known - fresh, key=version_key)
+        for name in added:
+            bisect.insort(_lexical, name)
+            _insort_version(name)
+        for name in removed:
+            del _lexical[bisect.bisect_left(_lexical, name)]
+            _versions.remove(name)
+        _save()
+    return added, removed
+
+
+def _insort_version(name):
+    # Binary search on version_key; bisect only takes key= from Python 3.10
+    key = version_key(name)
+    lo, hi = 0, len(_versions)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if version_key(_versions[mid]) <= key:
+            lo = mid + 1
+        else:
+            hi = mid
+    _versions.insert(lo, name)
+
+
+def _load():
+    global _versions, _lexical, _updated_at
+    if _versions is not None:
+        return
+    try:
+        with open(CATALOG_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    _versions = sorted(data.get("versions", []), key=version_key)
+    _lexical = sorted(_versions)
+    _updated_at = data.get("updated_at")
+
+
+def _save():
+    global _updated_at
+    _updated_at = time.time()
+    atomic_write_json(CATALOG_FILE, {"versions": _versions, "updated_at": _updated_at})
@@ -0,0 +1,398 @@
+# cli.py
+"""
+Headless command line front end. Never imports tkinter, so it runs on display-less hosts.
+
+    python cli.py install --versions 141.0b3 141.0b4 --arches win64 linux-x86_64 --langs en-US de
+    python cli.py install --manifest builds.json --jobs 4 --summary summary.json
+    python cli.py trace --last 3
+    python cli.py cache --budget-mb 4096
+    python cli.py dedup
+    python cli.py verify --repair
+    python cli.py mirror --port 8080
+    python cli.py profile 141.0b3 linux-x86_64 en-US --make-template
+    python cli.py profile 141.0b4 linux-x86_64 en-US --reset
+    python cli.py prefetch --enable --arches win64 linux-x86_64 --langs en-US --stage
+    python cli.py --base-url http://mirror-host:8080/pub/firefox/candidates/ install --versions 141.0b3
+
+A manifest is either a list of {"version", "arch", "lang"} objects or a matrix
+{"versions": [...], "arches": [...], "langs": [...]}.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from manager import find_install_record, get_install_folder, get_exec_path, load_db
+import tracing
+import archive_cache
+import dedup
+import catalog
+import prefetch
+import profiles
+import manifest
+import trash
+
+DEFAULT_JOBS = 3
+
+
+def normalize_version(version):
+    version = version.strip()
+    if not version.endswith("-candidates"):
+        version += "-candidates"
+    return version
+
+
+def expand_matrix(versions, arches, langs):
+    return [(normalize_version(v), a, l) for v, a, l in itertools.product(versions, arches, langs)]
+
+
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if isinstance(manifest, dict):
+        return expand_matrix(manifest.get("versions", []), manifest.get("arches", []), manifest.get("langs", []))
+    return [(normalize_version(b["version"]), b["arch"], b.get("lang") or b.get("language")) for b in manifest]
+
+
+def is_installed(version, arch, lang):
+    return find_install_record(version, arch, lang) is not None and \
+        os.path.isdir(get_install_folder(version, arch, lang))
+
+
+def install_one(version, arch, lang, no_update=False, deduplicate=True):
+    """Install one build and return its summary record. Never raises."""
+    result = {"version": version, "arch": arch, "language": lang}
+    if is_installed(version, arch, lang):
+        result.update(status="skipped", install_path=get_install_folder(version, arch, lang), seconds=0.0)
+        return result
+
+    # Deferred so commands that never download (trace, cache, dedup) don't load the HTTP stack
+    from installer import install_build
+
+    start = time.perf_counter()
+    try:
+        result["install_path"] = install_build(version, arch, lang, no_update=no_update, deduplicate=deduplicate)
+        result["status"] = "installed"
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def plan(builds):
+    """
+    Resolve every build that isn't installed yet, all at once (see resolver.py). Returns
+    {build: error message} for the builds that can't be resolved. The others are left in the
+    resolution cache, so their installs start downloading straight away.
+    """
+    from resolver import resolve_many
+    pending = [b for b in builds if not is_installed(*b)]
+    if not pending:
+        return {}
+    return {build: str(result) for build, result in resolve_many(pending).items() if isinstance(result, Exception)}
+
+
+def install_many(builds, jobs=DEFAULT_JOBS, no_update=False, log=None, deduplicate=True):
+    """Install every (version, arch, lang) in builds with at most 'jobs' in flight. Returns the summary."""
+    # The same combination listed twice would race on its own install folder
+    builds = list(dict.fromkeys(builds))
+    start = time.perf_counter()
+    unresolved = plan(builds)
+    for (v, a, l), error in unresolved.items():
+        if log:
+            log(f"[failed] {v} {a} {l}: could not resolve: {error}")
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(install_one, v, a, l, no_update, deduplicate) for v, a, l in builds
+                   if (v, a, l) not in unresolved]
+        for future in as_completed(futures):
+            result = future.result()
+            if log:
+                log(f"[{result['status']}] {result['version']} {result['arch']} {result['language']} "
+                    f"({result['seconds']}s){': ' + result['error'] if 'error' in result else ''}")
+    results = [future.result() for future in futures]
+    results += [{"version": v, "arch": a, "language": l, "status": "failed", "error": f"could not resolve: {error}",
+                 "seconds": 0.0} for (v, a, l), error in unresolved.items()]
+
+    counts = {status: sum(1 for r in results if r["status"] == status) for status in ("installed", "skipped", "failed")}
+    return {"builds": results, "total_seconds": round(time.perf_counter() - start, 3), **counts}
+
+
+def cmd_install(args):
+    builds = []
+    if args.manifest:
+        builds += load_manifest(args.manifest)
+    if args.versions:
+        builds += expand_matrix(args.versions, args.arches, args.langs)
+    if not builds:
+        print("Nothing to install: give --manifest or --versions", file=sys.stderr)
+        return 2
+
+    # Fail fast on typos rather than one failed download per build
+    try:
+        catalog.refresh()
+    except Exception as e:
+        print(f"Could not refresh the version catalog ({e}), using the cached one", file=sys.stderr)
+    unknown = sorted({v for v, _, _ in builds if catalog.versions() and not catalog.contains(v)})
+    if unknown:
+        print(f"Unknown version(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    summary = install_many(builds, jobs=args.jobs, no_update=args.no_update,
+                           log=lambda line: print(line, file=sys.stderr), deduplicate=not args.no_dedup)
+    _write_summary(summary, args.summary)
+    return 1 if summary["failed"] else 0
+
+
+def _write_summary(summary, path):
+    text = json.dumps(summary, indent=2)
+    if path and path != "-":
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+def cmd_trace(args):
+    if not tracing.TRACE_LOG or not os.path.exists(tracing.TRACE_LOG):
+        print("No traces recorded yet.", file=sys.stderr)
+        return 1
+    with open(tracing.TRACE_LOG, "r", encoding="utf-8") as f:
+        lines = f.readlines()[-args.last:] if args.last > 0 else []
+    for line in lines:
+        operation = json.loads(line)
+        if args.name and operation["name"] != args.name:
+            continue
+        print(operation["started_at"])
+        print(tracing.format_breakdown(operation))
+        print()
+    return 0
+
+
+def cmd_cache(args):
+    if args.clear:
+        archive_cache.clear()
+    if args.budget_mb is not None:
+        archive_cache.configure(args.budget_mb * 1024 * 1024)
+    print(json.dumps(archive_cache.stats(), indent=2))
+    return 0
+
+
+def cmd_dedup(args):
+    """Deduplicate builds installed before deduplication existed (or with --no-dedup)."""
+    saved = 0
+    for entry in load_db():
+        install_path = get_install_folder(entry["version"], entry["arch"], entry["language"])
+        if not os.path.isdir(install_path):
+            continue
+        result = dedup.dedup_install(install_path)
+        saved += result["bytes_saved"]
+        print(f"{entry['version']} {entry['arch']} {entry['language']}: linked {result['linked']} of "
+              f"{result['files']} file(s), {result['bytes_saved'] / (1024 * 1024):.1f} MB saved", file=sys.stderr)
+    freed = dedup.collect_garbage()
+    print(json.dumps({"bytes_saved_now": saved, "bytes_freed": freed, **dedup.stats()}, indent=2))
+    return 0
+
+
+def cmd_verify(args):
+    """Check installed builds against their manifests and optionally repair them."""
+    entries = [e for e in load_db() if os.path.isdir(e["install_path"])]
+    if args.record:
+        for entry in entries:
+            if manifest.load(entry["install_path"]) is None:
+                print(f"Recording manifest of {entry['install_path']}", file=sys.stderr)
+                manifest.record(entry["install_path"], entry["arch"], archive=_current_archive(entry))
+
+    start = time.perf_counter()
+    reports = manifest.verify([e["install_path"] for e in entries], workers=args.jobs)
+    summary = {"builds": len(reports), "seconds": round(time.perf_counter() - start, 3),
+               "files_checked": sum(r["checked"] for r in reports.values() if r),
+               "files_rehashed": sum(r["rehashed"] for r in reports.values() if r),
+               "unrecorded": sorted(path for path, r in reports.items() if r is None), "damaged": {}}
+    for install_path, report in reports.items():
+        if report is None or report["ok"]:
+            continue
+        print(f"{install_path}: {len(report['missing'])} missing, {len(report['damaged'])} damaged", file=sys.stderr)
+        if args.repair:
+            try:
+                result = manifest.repair(install_path, report)
+            except Exception as e:
+                result = {"repaired": [], "failed": report["missing"] + report["damaged"], "error": str(e)}
+            print(f"  repaired {len(result['repaired'])}, failed {len(result['failed'])}", file=sys.stderr)
+            report.update(result)
+            if not result["failed"]:
+                continue
+        summary["damaged"][install_path] = report
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["damaged"] else 0
+
+
+def _current_archive(entry):
+    """Best guess at the archive of a build recorded after the fact: the build's latest archive today."""
+    from downloader import resolve_build, get_expected_checksum
+    try:
+        url = resolve_build(entry["version"], entry["arch"], entry["language"])["url"]
+        return {"url": url, "checksum": get_expected_checksum(url)}
+    except Exception as e:
+        print(f"  could not resolve its archive ({e}); it can be verified but not repaired", file=sys.stderr)
+        return None
+
+
+def cmd_versions(args):
+    if not args.offline:
+        catalog.refresh()
+    names = catalog.complete(args.prefix) if args.prefix else catalog.versions()
+    print("\n".join(names[:args.limit] if args.limit else names))
+    return 0
+
+
+def cmd_profile(args):
+    if args.version:
+        install_path = get_install_folder(normalize_version(args.version), args.arch, args.lang)
+        if args.make_template:
+            firefox_path = get_exec_path(install_path, args.arch)
+            if not os.path.isfile(firefox_path):
+                print(f"Not installed: {firefox_path}", file=sys.stderr)
+                return 1
+            print(f"Preparing the profile template with {firefox_path}...", file=sys.stderr)
+            profiles.prepare_template(firefox_path)
+        if args.reset:
+            profiles.reset_profile(install_path)
+        print(json.dumps({"profile": profiles.profile_path(install_path), "template": profiles.has_template()},
+                         indent=2))
+        return 0
+    names = sorted(os.listdir(profiles.PROFILE_ROOT)) if os.path.isdir(profiles.PROFILE_ROOT) else []
+    print(json.dumps({"template": profiles.has_template(),
+                      "profiles": [n for n in names if n != profiles.TEMPLATE_NAME and not n.endswith(".tmp")
+                                   and n != trash.TRASH_NAME]},
+                     indent=2))
+    return 0
+
+
+def cmd_mirror(args):
+    import mirror
+    # Options left out fall back to mirror.py's own defaults
+    argv = []
+    for option, value in (("--upstream", args.upstream), ("--cache-dir", args.cache_dir), ("--host", args.host),
+                          ("--port", args.port)):
+        if value is not None:
+            argv += [option, str(value)]
+    return mirror.main(argv)
+
+
+def cmd_prefetch(args):
+    enabled = True if args.enable else False if args.disable else None
+    prefetch.configure(
+        enabled=enabled, arches=args.arches, langs=args.langs, stage=args.stage,
+        interval=args.interval_min * 60 if args.interval_min is not None else None,
+        disk_budget=args.budget_mb * 1024 * 1024 if args.budget_mb is not None else None,
+        max_rate=int(args.max_rate_mb * 1024 * 1024) if args.max_rate_mb is not None else None)
+    if args.once or args.watch:
+        try:
+            while True:
+                prefetch.poll(log=lambda line: print(line, file=sys.stderr))
+                if not args.watch:
+                    break
+                time.sleep(prefetch.load_settings()["interval"])
+        except KeyboardInterrupt:
+            pass
+    print(json.dumps(prefetch.status(), indent=2))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Firefox Build Manager (headless)")
+    parser.add_argument("--base-url", help="candidates tree to use, e.g. a LAN mirror (default $FFBM_BASE_URL "
+                                           "or archive.mozilla.org)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    install = commands.add_parser("install", help="install a version x arch x language matrix or a manifest")
+    install.add_argument("--manifest", help="JSON manifest of builds to install")
+    install.add_argument("--versions", nargs="+", help="e.g. 141.0b3 141.0b4")
+    install.add_argument("--arches", nargs="+", default=["linux-x86_64"], help="default: linux-x86_64")
+    install.add_argument("--langs", nargs="+", default=["en-US"], help="default: en-US")
+    install.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help=f"parallel installs (default {DEFAULT_JOBS})")
+    install.add_argument("--no-update", action="store_true", help="disable updates in the installed builds")
+    install.add_argument("--no-dedup", action="store_true", help="don't link files shared with other builds")
+    install.add_argument("--summary", default="-", help="where to write the JSON summary (default stdout)")
+    install.set_defaults(func=cmd_install)
+
+    trace = commands.add_parser("trace", help="show the per-phase timing of recent operations")
+    trace.add_argument("--last", type=int, default=5, help="number of operations to show (default 5)")
+    trace.add_argument("--name", help="only show operations with this name, e.g. install")
+    trace.set_defaults(func=cmd_trace)
+
+    verify = commands.add_parser("verify", help="check installed builds against their file manifests")
+    verify.add_argument("--repair", action="store_true", help="restore damaged files from the build's archive")
+    verify.add_argument("--record", action="store_true",
+                        help="first record manifests for builds that have none (e.g. installed before manifests)")
+    verify.add_argument("--jobs", type=int, default=None, help="hashing threads (default: one per core)")
+    verify.set_defaults(func=cmd_verify)
+
+    versions = commands.add_parser("versions", help="list known candidate versions, newest first")
+    versions.add_argument("prefix", nargs="?", help="only versions starting with this, e.g. 142.0b")
+    versions.add_argument("--limit", type=int, default=0, help="show at most this many")
+    versions.add_argument("--offline", action="store_true", help="use the local catalog without refreshing it")
+    versions.set_defaults(func=cmd_versions)
+
+    cache = commands.add_parser("cache", help="show archive cache statistics, change its size or empty it")
+    cache.add_argument("--budget-mb", type=int, help="maximum size of the archive cache, 0 disables it")
+    cache.add_argument("--clear", action="store_true", help="delete every cached archive")
+    cache.set_defaults(func=cmd_cache)
+
+    dedup_cmd = commands.add_parser("dedup", help="link files shared between installed builds and free unused objects")
+    dedup_cmd.set_defaults(func=cmd_dedup)
+
+    profile = commands.add_parser("profile", help="list managed profiles, prepare the template or reset a profile")
+    profile.add_argument("version", nargs="?", help="build whose profile to act on, e.g. 141.0b3")
+    profile.add_argument("arch", nargs="?", default="linux-x86_64")
+    profile.add_argument("lang", nargs="?", default="en-US")
+    profile.add_argument("--make-template", action="store_true",
+                         help="prepare the profile template by starting this build headless")
+    profile.add_argument("--reset", action="store_true", help="replace the build's profile with a fresh clone")
+    profile.set_defaults(func=cmd_profile)
+
+    prefetch_cmd = commands.add_parser("prefetch", help="configure or run the prefetcher of new candidate builds")
+    switch = prefetch_cmd.add_mutually_exclusive_group()
+    switch.add_argument("--enable", action="store_true", help="prefetch in the background while ui.py runs")
+    switch.add_argument("--disable", action="store_true")
+    prefetch_cmd.add_argument("--arches", nargs="+", help="architectures to prefetch")
+    prefetch_cmd.add_argument("--langs", nargs="+", help="languages to prefetch")
+    prefetch_cmd.add_argument("--interval-min", type=int, help="minutes between checks of the archive")
+    prefetch_cmd.add_argument("--budget-mb", type=int, help="most disk space prefetched builds may take")
+    prefetch_cmd.add_argument("--max-rate-mb", type=float, help="download rate cap in MB/s, 0 for none")
+    prefetch_cmd.add_argument("--stage", action=argparse.BooleanOptionalAction, default=None,
+                              help="also extract prefetched builds, so installing one is a rename")
+    run = prefetch_cmd.add_mutually_exclusive_group()
+    run.add_argument("--once", action="store_true", help="check the archive now and prefetch what is new")
+    run.add_argument("--watch", action="store_true", help="keep checking every interval until interrupted")
+    prefetch_cmd.set_defaults(func=cmd_prefetch)
+
+    mirror_cmd = commands.add_parser("mirror", help="serve a LAN caching mirror of the candidates tree")
+    # Defaults live in mirror.py, which isn't imported until the command runs (it loads the HTTP stack)
+    mirror_cmd.add_argument("--upstream", help="default: archive.mozilla.org")
+    mirror_cmd.add_argument("--cache-dir", help="default: mirror_cache")
+    mirror_cmd.add_argument("--host", help="default: 0.0.0.0")
+    mirror_cmd.add_argument("--port", type=int, help="default: 8080")
+    mirror_cmd.set_defaults(func=cmd_mirror)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.base_url:
+        import net
+        net.configure(base_url=args.base_url)
+    try:
+        return args.func(args)
+    finally:
+        # Finish deleting what the command moved to the trash (profiles, unused dedup objects)
+        trash.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
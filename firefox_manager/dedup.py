@@ -0,0 +1,256 @@
+# dedup.py
+"""
+Content-addressed deduplication of files across installed builds.
+
+After a build is extracted, every regular file of at least MIN_SIZE bytes is hashed. The first
+copy of some content becomes the object objects/<aa>/<digest>-<mode>; later identical files are
+replaced by a reflink (copy-on-write clone, where the filesystem supports it) or a hardlink to
+that object. Neighbouring candidates share most of their files, so a second beta of the same
+release costs little more than the files that actually changed.
+
+objects/refs.sqlite3 records which install folder file references which object and how many
+references each object has, so removing a build only frees the objects nobody else uses.
+
+Hardlinked files share one inode: a program writing into one of them in place changes it for
+every build. Firefox's updater replaces files instead of rewriting them, and the files this
+program patches (channel-prefs.js) are below MIN_SIZE, so in practice this does not happen.
+LINK_MODE = "reflink" avoids the question entirely on filesystems that support it.
+"""
+import os
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import trash
+
+OBJECT_DIR = "objects"
+INDEX_FILE = "refs.sqlite3"
+MIN_SIZE = 16 * 1024      # smaller files would cost more in index rows than they save
+HASH_WORKERS = 4
+LINK_MODE = "auto"        # "auto" (reflink, else hardlink), "reflink" or "hardlink"
+CHUNK_SIZE = 1024 * 1024
+
+_FICLONE = 0x40049409     # Linux ioctl behind cp --reflink
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    install_path TEXT NOT NULL,
+    relpath TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (install_path, relpath)
+);
+CREATE INDEX IF NOT EXISTS refs_by_name ON refs (name);
+"""
+
+_local = threading.local()
+# Serialises linking against freeing, so an object is never deleted while a file is being linked to it
+_lock = threading.Lock()
+
+
+def dedup_install(install_path):
+    """
+    Move the files of one install folder into the object store. Safe to run again on the same
+    folder; files already linked are skipped without rehashing. A file that can't be linked
+    (e.g. objects/ on another filesystem, or a link count limit) keeps its plain copy.
+    Returns {"files", "linked", "bytes_saved", "failed"}.
+    """
+    install_path = os.path.normpath(install_path)
+    known = {row[0] for row in _connect().execute("SELECT relpath FROM refs WHERE install_path = ?",
+                                                  (install_path,))}
+    candidates = []
+    for root, _, files in os.walk(install_path):
+        for name in files:
+            path = os.path.join(root, name)
+            relpath = os.path.relpath(path, install_path)
+            if relpath in known or os.path.islink(path):
+                continue
+            st = os.stat(path)
+            if st.st_size >= MIN_SIZE:
+                candidates.append((path, relpath, st))
+
+    summary = {"files": len(candidates), "linked": 0, "bytes_saved": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        for (path, relpath, st), digest in zip(candidates, pool.map(lambda c: _try_hash(c[0]), candidates)):
+            # Deduplication only saves space; a file it can't handle never fails the install
+            try:
+                if digest is None:
+                    raise OSError("could not be read")
+                name = f"{digest}-{st.st_mode & 0o777:o}"
+                if _adopt(install_path, path, relpath, name, st.st_size):
+                    summary["linked"] += 1
+                    summary["bytes_saved"] += st.st_size
+            except OSError as e:
+                print(f"Could not deduplicate {path}: {e}")
+                summary["failed"] += 1
+    return summary
+
+
+def release_install(install_path):
+    """
+    Drop every reference held by an install folder (call it once the folder is deleted or about to
+    be) and delete the objects no other build uses. Returns the number of bytes freed. The objects
+    are only moved into objects/.trash here, so this returns quickly; trash.py deletes them.
+    """
+    install_path = os.path.normpath(install_path)
+    conn = _connect()
+    freed = 0
+    with _lock:
+        with conn:
+            names = [row[0] for row in conn.execute("SELECT name FROM refs WHERE install_path = ?", (install_path,))]
+            conn.execute("DELETE FROM refs WHERE install_path = ?", (install_path,))
+            conn.executemany("UPDATE objects SET refs = refs - 1 WHERE name = ?", [(n,) for n in names])
+            orphans = conn.execute("SELECT name, size FROM objects WHERE refs <= 0").fetchall()
+            conn.execute("DELETE FROM objects WHERE refs <= 0")
+        for name, size in orphans:
+            try:
+                trash.move_to_trash(_object_path(name), OBJECT_DIR)
+                freed += size
+            except FileNotFoundError:
+                pass
+    return freed
+
+
+def move_install(old_path, new_path):
+    """Follow an install folder that was renamed (e.g. a build that updated itself)."""
+    with _connect() as conn:
+        conn.execute("UPDATE refs SET install_path = ? WHERE install_path = ?",
+                     (os.path.normpath(new_path), os.path.normpath(old_path)))
+
+
+def digests(install_path):
+    """relpath -> SHA-256 of the files of an install folder that are in the object store."""
+    return {relpath: name.split("-", 1)[0] for relpath, name in _object_names(install_path).items()}
+
+
+def restore_objects(install_path, relpaths):
+    """
+    After files of an install folder were restored, replace the objects they were linked to whose
+    content no longer matches their digest (damaged through a hardlink) with the restored copies,
+    so later installs don't link to the damage. Returns the number of objects restored.
+    """
+    install_path = os.path.normpath(install_path)
+    names = _object_names(install_path)
+    restored = 0
+    with _lock:
+        for relpath in relpaths:
+            name = names.get(relpath)
+            object_path = _object_path(name) if name else None
+            if not object_path or not os.path.exists(object_path):
+                continue
+            digest = name.split("-", 1)[0]
+            if _hash_file(object_path) != digest and _hash_file(os.path.join(install_path, relpath)) == digest:
+                tmp_path = object_path + ".restore"
+                _link(os.path.join(install_path, relpath), tmp_path)
+                os.replace(tmp_path, object_path)
+                restored += 1
+    return restored
+
+
+def collect_garbage():
+    """Release the references of install folders that no longer exist. Returns the bytes freed."""
+    paths = [row[0] for row in _connect().execute("SELECT DISTINCT install_path FROM refs")]
+    return sum(release_install(path) for path in paths if not os.path.isdir(path))
+
+
+def stats():
+    conn = _connect()
+    objects, stored = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+    # Every reference beyond an object's first is a copy that would otherwise be on disk
+    saved = conn.execute("SELECT COALESCE(SUM(size * (refs - 1)), 0) FROM objects").fetchone()[0]
+    installs = conn.execute("SELECT COUNT(DISTINCT install_path) FROM refs").fetchone()[0]
+    return {"objects": objects, "object_bytes": stored, "bytes_saved": saved, "installs": installs}
+
+
+def _adopt(install_path, path, relpath, name, size):
+    """Link path to object name (creating the object from path if it is new) and count the reference."""
+    object_path = _object_path(name)
+    conn = _connect()
+    with _lock:
+        linked = False
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            _link(path, object_path)
+        elif not os.path.samefile(path, object_path):
+            tmp_path = path + ".dedup"
+            _link(object_path, tmp_path)
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                os.remove(tmp_path)
+                raise
+            linked = True
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO objects (name, size, refs) VALUES (?, ?, 0)", (name, size))
+            inserted = conn.execute("INSERT OR IGNORE INTO refs (install_path, relpath, name) VALUES (?, ?, ?)",
+                                    (install_path, relpath, name)).rowcount
+            if inserted:
+                conn.execute("UPDATE objects SET refs = refs + 1 WHERE name = ?", (name,))
+    return linked
+
+
+def _link(src, dst):
+    if LINK_MODE in ("auto", "reflink"):
+        try:
+            reflink(src, dst)
+            return
+        except OSError:
+            if LINK_MODE == "reflink":
+                raise
+    os.link(src, dst)
+
+
+def reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    os.chmod(dst, os.stat(src).st_mode & 0o777)
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _try_hash(path):
+    try:
+        return _hash_file(path)
+    except OSError:
+        return None
+
+
+def _object_names(install_path):
+    rows = _connect().execute("SELECT relpath, name FROM refs WHERE install_path = ?",
+                              (os.path.normpath(install_path),))
+    return dict(rows.fetchall())
+
+
+def _object_path(name):
+    return os.path.join(OBJECT_DIR, name[:2], name)
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(OBJECT_DIR, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(OBJECT_DIR, INDEX_FILE), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
@@ -0,0 +1,105 @@
+# diskspace.py
+"""
+Free-space planning for installs, so a build never fills the disk halfway through and leaves a
+broken folder behind.
+
+Before an install starts, reserve() works out what it will write: the archive (Content-Length,
+unless it is already in the archive cache) into downloads/ and about EXTRACTED_RATIO times that
+into builds/. It checks both against the free space of their filesystems (counted once when
+they are the same filesystem), keeping SAFETY_MARGIN free. Space reserved by installs still
+running is subtracted too, so parallel jobs can't each see the same free space and overcommit it.
+
+preallocate() then claims the archive's blocks up front where the OS supports it, so running
+out of space shows up before the transfer rather than in the middle of it.
+"""
+import os
+import errno
+import shutil
+import threading
+from contextlib import contextmanager
+
+EXTRACTED_RATIO = 3                     # an extracted build takes about this many times its archive
+SAFETY_MARGIN = 256 * 1024 * 1024       # bytes always left free
+
+_reserved = {}      # st_dev -> bytes promised to installs in progress
+_lock = threading.Lock()
+
+
+class InsufficientSpace(Exception):
+    pass
+
+
+def estimate(archive_size, archive_cached=False, staged=False):
+    """(download bytes, extract bytes) an install of an archive of archive_size will write."""
+    size = archive_size or 0
+    if staged:
+        return 0, 0
+    return (0 if archive_cached else size), size * EXTRACTED_RATIO
+
+
+@contextmanager
+def reserve(needs):
+    """
+    Check and hold {directory: bytes} for the duration of the block. Raises InsufficientSpace,
+    naming the directory that is short, when any filesystem can't take what is asked of it.
+    """
+    per_device = {}
+    for directory, amount in needs.items():
+        if amount <= 0:
+            continue
+        device, _ = _device(directory)
+        names, total = per_device.get(device, ([], 0))
+        per_device[device] = (names + [directory], total + amount)
+
+    with _lock:
+        for device, (names, amount) in per_device.items():
+            free = _free(names[0]) - _reserved.get(device, 0) - SAFETY_MARGIN
+            if amount > free:
+                raise InsufficientSpace(
+                    f"Not enough disk space: {_mb(amount)} needed in {' and '.join(names)}, "
+                    f"{_mb(max(free, 0))} available")
+        for device, (_, amount) in per_device.items():
+            _reserved[device] = _reserved.get(device, 0) + amount
+    try:
+        yield
+    finally:
+        with _lock:
+            for device, (_, amount) in per_device.items():
+                _reserved[device] -= amount
+
+
+def preallocate(f, size):
+    """
+    Claim size bytes of disk for the open file f. posix_fallocate reserves real blocks, so a full
+    disk fails here with ENOSPC; elsewhere the file is only extended (which may be sparse).
+    """
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as e:
+            # The filesystem can't do it; anything else (ENOSPC) is real
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    f.truncate(size)
+
+
+def _device(directory):
+    path = _existing_parent(directory)
+    return os.stat(path).st_dev, path
+
+
+def _free(directory):
+    return shutil.disk_usage(_existing_parent(directory)).free
+
+
+def _existing_parent(directory):
+    # downloads/ or builds/ may not exist yet; their parent's filesystem is where they'll go
+    path = os.path.abspath(directory)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def _mb(amount):
+    return f"{amount / (1024 * 1024):.0f} MB"
@@ -1,86 +1,688 @@
 import os
+import re
+import json
+import hashlib
+import time
+import queue
+import shutil
+import threading
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
 import requests
-from bs4 import BeautifulSoup
+from net import get_session, timeout, base_url
+from listing import get_links, parse_build_folders
+from manager import extract_zip, extract_tar_stream
+from tracing import span, traced, current_span
+import archive_cache
+from atomicfile import atomic_write_json
+import diskspace
+
+CONNECTIONS = 4                       # parallel Range connections per download
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024    # don't split below this, the handshakes would cost more than they save
+CHUNK_SIZE = 256 * 1024
+RETRIES = 3                           # reconnect attempts per segment after a dropped transfer
+STATE_SAVE_INTERVAL = 1.0             # seconds between checkpoints of the .part.json state file
+HASH_STEP = 16 * 1024 * 1024          # most bytes hashed per progress tick, so progress keeps flowing
+CHECKSUM_CACHE_DIR = "checksums"      # parsed SHA512SUMS/SHA256SUMS manifests, one JSON file per build
+PIPE_DEPTH = 64                       # chunks buffered between the network and the extractor in stream_build
+RESOLVE_TTL = 600                     # seconds a resolved (version, arch, lang) is reused
+MISSING_CHECKSUM_TTL = 300            # seconds before a manifest that was missing (404) is asked for again
+
+_checksum_manifests = {}
+_checksum_missing = {}                # manifest url -> when it was found missing
+_checksum_warned = {}                 # build folder url -> when a missing manifest was reported
+_checksum_lock = threading.Lock()
+_resolved = {}
+_resolve_lock = threading.Lock()
 
-BASE_URL = "https://archive.mozilla.org/pub/firefox/candidates/"
 
 def get_latest_build(version):
     """Return the latest build folder (e.g. build1, build2) for a given version"""
-    url = f"{BASE_URL}{version}/"
-    res = requests.get(url)
-    if res.status_code != 200:
+    url = f"{base_url()}{version}/"
+    try:
+        links = get_links(url)
+    except Exception:
         raise Exception(f"Failed to access version folder: {url}")
 
-    soup = BeautifulSoup(res.text, "html.parser")
-    builds = []
-
-    for a in soup.find_all("a"):
-        href = a.get("href", "")
-        # href can be absolute path like /pub/firefox/candidates/141.0b3-candidates/build1/
-        if href.endswith("/") and "/build" in href:
-            folder_name = href.strip("/").split("/")[-1]
-            if folder_name.startswith("build"):
-                try:
-                    num = int(folder_name.replace("build", ""))
-                    builds.append((num, folder_name))
-                except ValueError:
-                    continue
-
+    # hrefs can be absolute paths like /pub/firefox/candidates/141.0b3-candidates/build1/
+    builds = parse_build_folders(links)
     if not builds:
         raise Exception(f"No build folders (like build1/) found at:\n{url}")
 
-    builds.sort()
     return builds[-1][1]
 
 
-def download_build(version, arch, lang, dest_folder="builds", progress_callback=None):
+@traced("resolve")
+def resolve_build(version, arch, lang):
     """
-    Downloads the Firefox build zip file for given version, arch and lang.
-    Supports progress_callback(percent) to report download progress (0-100).
+    Resolve a build to {"build", "url", "filename", "format", "size"}.
+    Results are cached for RESOLVE_TTL seconds, so the build-folder lookup and the xz/bz2
+    HEAD probing happen once per build however many times it is planned or downloaded.
+    To resolve many builds at once, see resolver.resolve_many.
     """
-    build = get_latest_build(version)
+    cached = cached_resolution(version, arch, lang)
+    if cached:
+        current_span().set(cached=True)
+        return cached
+
+    with span("build_folder"):
+        build = get_latest_build(version)
     if not build:
         raise Exception("No build folder found")
 
-    clean_version = version.replace("-candidates", "")
+    folder_url = build_folder_url(version, build, arch, lang)
+    candidates = candidate_filenames(version, arch)
+    filename, size = candidates[-1], None
+    with span("head_probe") as probe:
+        for name in candidates:
+            probe.add("requests", 1)
+            status, length = probe_file(folder_url + name)
+            if status == 200:
+                filename, size = name, length
+                break
+
+    return remember_resolution(version, arch, lang, build, folder_url, filename, size)
+
+
+def build_folder_url(version, build, arch, lang):
+    return f"{base_url()}{version}/{build}/{arch}/{lang}/"
 
+
+def candidate_filenames(version, arch):
+    """Archive names a build may be published under, preferred first."""
+    clean_version = version.replace("-candidates", "")
     if arch.startswith("win"):
-        filename = f"firefox-{clean_version}.zip"
+        return [f"firefox-{clean_version}.zip"]
     elif arch == "mac":
-        filename = f"Firefox {clean_version}.dmg"
+        return [f"Firefox {clean_version}.dmg"]
     elif arch.startswith("linux"):
         # Newer builds use .tar.xz, older ones use .tar.bz2.
         # We check for the .xz version first and fall back to .bz2.
-        filename_xz = f"firefox-{clean_version}.tar.xz"
-        url_xz = f"{BASE_URL}{version}/{build}/{arch}/{lang}/{filename_xz}"
+        return [f"firefox-{clean_version}.tar.xz", f"firefox-{clean_version}.tar.bz2"]
+    raise ValueError("Unknown architecture")
 
-        res_head = requests.head(url_xz)
-        if res_head.status_code == 200:
-            filename = filename_xz
-        else:
-            filename = f"firefox-{clean_version}.tar.bz2"
+
+def probe_file(url):
+    """HEAD url; returns (status, size or None)."""
+    res_head = get_session().head(url, timeout=timeout(), allow_redirects=True)
+    return res_head.status_code, int(res_head.headers.get("content-length", 0)) or None
+
+
+def cached_resolution(version, arch, lang):
+    """The cached resolution of a build if it is younger than RESOLVE_TTL, else None."""
+    with _resolve_lock:
+        cached = _resolved.get((base_url(), version, arch, lang))
+    if cached and time.monotonic() - cached[0] < RESOLVE_TTL:
+        return dict(cached[1])
+    return None
+
+
+def remember_resolution(version, arch, lang, build, folder_url, filename, size):
+    resolved = {
+        "build": build,
+        "url": folder_url + filename,
+        "filename": filename,
+        "format": _archive_format(filename),
+        "size": size,
+    }
+    with _resolve_lock:
+        _resolved[(base_url(), version, arch, lang)] = (time.monotonic(), resolved)
+    return dict(resolved)
+
+
+def forget_resolved(version=None):
+    """Drop cached resolutions (of one version, or all), e.g. once a new buildN folder is seen."""
+    with _resolve_lock:
+        for key in [k for k in _resolved if version is None or k[1] == version]:
+            del _resolved[key]
+
+
+def resolve_build_url(version, arch, lang):
+    """Return (url, filename) of the build archive for given version, arch and lang."""
+    resolved = resolve_build(version, arch, lang)
+    return resolved["url"], resolved["filename"]
+
+
+def _archive_format(filename):
+    for suffix in (".tar.xz", ".tar.bz2", ".zip", ".dmg"):
+        if filename.endswith(suffix):
+            return suffix[1:]
+    return None
+
+
+def download_build(version, arch, lang, dest_folder=None, progress_callback=None, max_rate=None):
+    """
+    Downloads the Firefox build archive for given version, arch and lang and returns its path.
+    By default the archive goes through the archive cache in downloads/, and a cached copy is
+    returned without any transfer. An explicit dest_folder bypasses the cache.
+    Supports progress_callback(percent) to report download progress (0-100), and max_rate to
+    cap the transfer at that many bytes per second.
+    """
+    url, filename = resolve_build_url(version, arch, lang)
+    expected = get_expected_checksum(url)
+
+    if dest_folder is None:
+        cached = archive_cache.lookup(url, expected)
+        if cached:
+            if progress_callback:
+                progress_callback(100)
+            return cached
+        dest_path = archive_cache.entry_path(url, expected, filename)
     else:
-        raise ValueError("Unknown architecture")
+        dest_path = os.path.join(dest_folder, filename)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
 
-    url = f"{BASE_URL}{version}/{build}/{arch}/{lang}/{filename}"
+    download_file(url, dest_path, progress_callback=progress_callback, expected_checksum=expected, max_rate=max_rate)
+    if dest_folder is None:
+        return archive_cache.store(url, expected, dest_path, filename) or dest_path
+    return dest_path
 
-    os.makedirs(dest_folder, exist_ok=True)
-    dest_path = os.path.join(dest_folder, filename)
 
-    response = requests.get(url, stream=True)
+@traced("stream_install")
+def stream_build(version, arch, lang, target_folder, progress_callback=None):
+    """
+    Downloads the build and extracts it into target_folder. tar.xz/tar.bz2 bodies are fed
+    straight into a streaming tar reader while a background thread keeps pulling from the
+    network, so download and decompression overlap; the body is hashed as it streams and a
+    checksum mismatch removes the extracted files. Zip can't be extracted before its central
+    directory (at the end) has arrived, so there is nothing to overlap: it is fetched with
+    download_file instead (parallel Range segments, resumable, verified) and extracted after.
+    The verified archive is kept in the archive cache, and a cache hit is extracted locally
+    with no transfer at all.
+    Returns target_folder, or None when the archive format can't be streamed (e.g. dmg).
+    """
+    url, filename = resolve_build_url(version, arch, lang)
+    if filename.endswith(".tar.xz"):
+        compression = "xz"
+    elif filename.endswith(".tar.bz2"):
+        compression = "bz2"
+    elif filename.endswith(".zip"):
+        compression = None
+    else:
+        return None
+
+    expected = get_expected_checksum(url)
+    cached = archive_cache.lookup(url, expected)
+    if cached:
+        try:
+            return _extract_cached(cached, target_folder, compression, progress_callback)
+        except Exception as e:
+            print(f"Cached archive {cached} is unusable ({e}), downloading it again")
+            archive_cache.discard(url, expected)
+
+    if compression is None:
+        zip_path = archive_cache.entry_path(url, expected, filename)
+        os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+        download_file(url, zip_path, progress_callback=progress_callback, expected_checksum=expected)
+        stored = archive_cache.store(url, expected, zip_path, filename)
+        try:
+            _extract_archive(stored or zip_path, target_folder, None)
+        finally:
+            if not stored:
+                _remove_if_exists(zip_path)
+        return target_folder
+
+    response = get_session().get(url, stream=True, timeout=timeout())
     if response.status_code != 200:
+        response.close()
         raise Exception(f"Failed to download. HTTP {response.status_code}")
 
+    hasher = hashlib.new(expected[0]) if expected else None
+
+    # The archive is written next to its cache entry while it streams, then adopted by the cache
+    spool_path = archive_cache.entry_path(url, expected, filename) + ".spool"
+    os.makedirs(os.path.dirname(spool_path), exist_ok=True)
+    created = not os.path.isdir(target_folder)
+    os.makedirs(target_folder, exist_ok=True)
+    reader = _PipeReader(response, progress_callback, hasher)
+    length = int(response.headers.get("content-length", 0))
+    try:
+        with open(spool_path, "wb") as spool:
+            if archive_cache.enabled():
+                if length:
+                    diskspace.preallocate(spool, length)
+                reader.sink = spool
+            extract_tar_stream(reader, target_folder, compression)
+            # The tar reader stops at the end-of-archive marker; hash the trailing padding too
+            while reader.read(CHUNK_SIZE):
+                pass
+            # Drop any preallocated tail the body didn't fill (e.g. a short Content-Length)
+            spool.truncate(spool.tell())
+        # The files are already in place, so a bad checksum rolls the extraction back
+        if hasher:
+            _verify_checksum(hasher, expected, url)
+    except BaseException:
+        reader.close()
+        _remove_if_exists(spool_path)
+        # Don't leave a half-extracted build behind to be picked up as installed
+        if created:
+            shutil.rmtree(target_folder, ignore_errors=True)
+        raise
+    reader.close()
+    if not archive_cache.store(url, expected, spool_path, filename):
+        _remove_if_exists(spool_path)
+    current_span().set(bytes=reader.downloaded)
+    return target_folder
+
+
+def _extract_cached(archive_path, target_folder, compression, progress_callback=None):
+    _extract_archive(archive_path, target_folder, compression)
+    current_span().set(cached=True)
+    if progress_callback:
+        progress_callback(100)
+    return target_folder
+
+
+def _extract_archive(archive_path, target_folder, compression):
+    """Extract a local archive, removing target_folder again if it was created and extraction fails."""
+    created = not os.path.isdir(target_folder)
+    os.makedirs(target_folder, exist_ok=True)
+    try:
+        if compression:
+            with open(archive_path, "rb") as f:
+                extract_tar_stream(f, target_folder, compression)
+        else:
+            extract_zip(archive_path, target_folder)
+    except BaseException:
+        if created:
+            shutil.rmtree(target_folder, ignore_errors=True)
+        raise
+
+
+class _PipeReader:
+    """
+    File-like view over a streamed response body. A feeder thread reads ahead into a bounded
+    queue so the network keeps flowing while the consumer decompresses; progress is reported
+    from read(), i.e. on the consumer's thread. Consumed chunks are also copied to sink, if set.
+    """
+
+    def __init__(self, response, progress_callback=None, hasher=None, sink=None):
+        self.response = response
+        self.progress_callback = progress_callback
+        self.hasher = hasher
+        self.sink = sink
+        self.total_size = int(response.headers.get("content-length", 0))
+        self.downloaded = 0
+        self.queue = queue.Queue(maxsize=PIPE_DEPTH)
+        self.buffer = b""
+        self.pos = 0
+        self.eof = False
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+
+    def _feed(self):
+        try:
+            for chunk in self.response.iter_content(chunk_size=CHUNK_SIZE):
+                if self.closed.is_set():
+                    return
+                if chunk:
+                    self._put(chunk)
+            self._put(None)
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(self, size=-1):
+        parts = []
+        wanted = size
+        while size < 0 or wanted > 0:
+            if self.pos >= len(self.buffer) and not self._next_chunk():
+                break
+            end = len(self.buffer) if size < 0 else min(len(self.buffer), self.pos + wanted)
+            parts.append(self.buffer[self.pos:end])
+            wanted -= end - self.pos
+            self.pos = end
+        return b"".join(parts)
+
+    def _next_chunk(self):
+        if self.eof:
+            return False
+        item = self.queue.get()
+        if item is None:
+            self.eof = True
+            return False
+        if isinstance(item, BaseException):
+            raise item
+        self.buffer, self.pos = item, 0
+        self.downloaded += len(item)
+        if self.sink:
+            self.sink.write(item)
+        if self.hasher:
+            self.hasher.update(item)
+        if self.progress_callback and self.total_size > 0:
+            self.progress_callback(self.downloaded / self.total_size * 100)
+        return True
+
+    def close(self):
+        self.closed.set()
+        self.response.close()
+
+
+class _Throttle:
+    """Paces the connections of one download so together they stay under rate bytes per second."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now) + amount / self.rate
+            delay = self.next_time - now
+        # Sleeping instead of reading lets the TCP window close, so the sender slows down too
+        time.sleep(delay)
+
+
+@traced("transfer")
+def download_file(url, dest_path, progress_callback=None, connections=CONNECTIONS, expected_checksum=None,
+                  max_rate=None):
+    """
+    Downloads url to dest_path, splitting it into HTTP Range segments fetched in parallel.
+    Bytes go to a preallocated '<dest_path>.part' file next to a '<dest_path>.part.json'
+    state file, so an interrupted download resumes where it stopped on the next call.
+    Falls back to a single stream when the server does not honour Range requests.
+    expected_checksum is an optional (algorithm, hexdigest); the file is hashed while it
+    downloads and a mismatch deletes it and raises before anyone can extract it.
+    max_rate caps the combined rate of all segments, in bytes per second.
+    """
+    part_path = dest_path + ".part"
+    state_path = part_path + ".json"
+    hasher = hashlib.new(expected_checksum[0]) if expected_checksum else None
+    throttle = _Throttle(max_rate) if max_rate else None
+
+    current_span().set(filename=os.path.basename(dest_path))
+
+    # Ask for the first byte only: a 206 tells us the server supports ranges and the full size
+    probe = get_session().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout())
+    if probe.status_code == 200:
+        # Range ignored, the body is the whole file - stream it as-is
+        current_span().set(mode="single")
+        _download_single(probe, part_path, progress_callback, hasher, throttle)
+        _remove_if_exists(state_path)
+        _finish(part_path, dest_path, hasher, expected_checksum, url)
+        return dest_path
+    probe.close()
+    if probe.status_code != 206:
+        raise Exception(f"Failed to download. HTTP {probe.status_code}")
+
+    total_size = _parse_content_range_total(probe.headers.get("content-range", ""))
+    if total_size is None:
+        raise Exception(f"Server returned an invalid Content-Range for {url}")
+
+    state = _load_state(state_path, url, total_size)
+    if state is None or not os.path.exists(part_path):
+        state = {"url": url, "size": total_size, "segments": _plan_segments(total_size, connections)}
+
+    # Preallocate the whole file so every segment can write at its own offset, and so a full
+    # disk fails now rather than partway through the transfer
+    with open(part_path, "r+b" if os.path.exists(part_path) else "wb") as f:
+        diskspace.preallocate(f, total_size)
+        # posix_fallocate never shrinks; cut off the tail of a stale, longer .part file
+        f.truncate(total_size)
+
+    current_span().set(mode="segmented", connections=len(state["segments"]), bytes=total_size)
+    _download_segmented(url, part_path, state, state_path, progress_callback, hasher, throttle)
+
+    _remove_if_exists(state_path)
+    _finish(part_path, dest_path, hasher, expected_checksum, url)
+    return dest_path
+
+
+def _finish(part_path, dest_path, hasher, expected_checksum, url):
+    if hasher:
+        try:
+            _verify_checksum(hasher, expected_checksum, url)
+        except Exception:
+            os.remove(part_path)
+            raise
+    os.replace(part_path, dest_path)
+
+
+def _verify_checksum(hasher, expected_checksum, url):
+    if hasher.hexdigest() != expected_checksum[1].lower():
+        raise Exception(f"Checksum mismatch ({expected_checksum[0]}) for {url}. The download is corrupt.")
+
+
+def get_expected_checksum(url):
+    """
+    Return (algorithm, hexdigest) for a build archive url from the SHA512SUMS (or SHA256SUMS)
+    manifest of its buildN folder, or None when the build publishes no checksums.
+    Manifests never change once published, so each one is fetched once and cached on disk. The
+    manifest may be published after the archives, so a missing one is only remembered for
+    MISSING_CHECKSUM_TTL seconds.
+    """
+    match = re.match(r"^(.*/build\d+/)(.+)$", url)
+    if not match:
+        return None
+    build_root, rel_path = match.groups()
+    rel_path = unquote(rel_path)
+
+    for manifest_name, algorithm in (("SHA512SUMS", "sha512"), ("SHA256SUMS", "sha256")):
+        sums = _load_checksum_manifest(build_root + manifest_name)
+        if sums and rel_path in sums:
+            return algorithm, sums[rel_path]
+    with _checksum_lock:
+        warned = _checksum_warned.get(build_root)
+        if warned is None or time.monotonic() - warned >= MISSING_CHECKSUM_TTL:
+            _checksum_warned[build_root] = time.monotonic()
+            print(f"No checksum published for {rel_path} in {build_root} (yet); it won't be verified")
+    return None
+
+
+def _load_checksum_manifest(manifest_url):
+    with _checksum_lock:
+        if manifest_url in _checksum_manifests:
+            return _checksum_manifests[manifest_url]
+        missing_since = _checksum_missing.get(manifest_url)
+        if missing_since is not None and time.monotonic() - missing_since < MISSING_CHECKSUM_TTL:
+            return None
+
+    cache_path = os.path.join(CHECKSUM_CACHE_DIR, hashlib.sha1(manifest_url.encode("utf-8")).hexdigest() + ".json")
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            sums = json.load(f)
+    except (OSError, ValueError):
+        sums = None
+
+    if not sums:
+        with span("checksum_manifest"):
+            res = get_session().get(manifest_url, timeout=timeout())
+        if res.status_code != 200:
+            # Not published (yet), or a transient failure: ask again later, never cache it on disk
+            if res.status_code == 404:
+                with _checksum_lock:
+                    _checksum_missing[manifest_url] = time.monotonic()
+            return None
+        # Lines look like "<hexdigest>  linux-x86_64/en-US/firefox-141.0b3.tar.xz"
+        sums = {}
+        for line in res.text.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                sums[parts[1].strip().lstrip("*")] = parts[0]
+        if not sums:
+            return None
+        os.makedirs(CHECKSUM_CACHE_DIR, exist_ok=True)
+        atomic_write_json(cache_path, sums)
+
+    with _checksum_lock:
+        _checksum_manifests[manifest_url] = sums
+        _checksum_missing.pop(manifest_url, None)
+    return sums
+
+
+def _download_single(response, part_path, progress_callback, hasher=None, throttle=None):
     total_size = int(response.headers.get("content-length", 0))
     downloaded = 0
 
-    with open(dest_path, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
+    with open(part_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
             if chunk:
                 f.write(chunk)
+                if hasher:
+                    hasher.update(chunk)
+                if throttle:
+                    throttle.consume(len(chunk))
                 downloaded += len(chunk)
                 if progress_callback and total_size > 0:
                     percent = downloaded / total_size * 100
                     progress_callback(percent)
+    current_span().set(bytes=downloaded)
 
-    return dest_path
+
+def _download_segmented(url, part_path, state, state_path, progress_callback, hasher=None, throttle=None):
+    segments = state["segments"]
+    total_size = state["size"]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def fetch(segment):
+        # Each segment is [start, end, done]; 'done' bytes from 'start' are already on disk
+        attempts = 0
+        # Unbuffered, so bytes counted in 'done' are visible to the hashing reader right away
+        with open(part_path, "r+b", buffering=0) as f:
+            while segment[0] + segment[2] <= segment[1]:
+                if stop.is_set():
+                    return
+                offset = segment[0] + segment[2]
+                done_before = segment[2]
+                try:
+                    res = get_session().get(url, headers={"Range": f"bytes={offset}-{segment[1]}"},
+                                            stream=True, timeout=timeout())
+                    if res.status_code != 206:
+                        raise Exception(f"Range request failed. HTTP {res.status_code}")
+                    f.seek(offset)
+                    for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                        if stop.is_set():
+                            res.close()
+                            return
+                        if chunk:
+                            f.write(chunk)
+                            with lock:
+                                segment[2] += len(chunk)
+                            if throttle:
+                                throttle.consume(len(chunk))
+                except requests.RequestException:
+                    # Connection dropped mid-segment: reconnect from the last written byte
+                    attempts += 1
+                    if attempts > RETRIES:
+                        raise
+                    continue
+                # A response that ended cleanly but short is retried for the rest; one that brought
+                # nothing at all (truncating proxy, wrong Content-Length) counts as a failed attempt
+                if segment[2] == done_before:
+                    attempts += 1
+                    if attempts > RETRIES:
+                        raise Exception(f"Server keeps ending bytes {offset}-{segment[1]} of {url} "
+                                        f"without sending any data")
+
+    # The hash follows the contiguous downloaded prefix of the file, reading it back from the
+    # page cache while later segments are still arriving, so no extra pass is needed at the end
+    hashed = 0
+    hash_file = open(part_path, "rb") if hasher else None
+
+    def advance_hash(limit):
+        nonlocal hashed
+        while hashed < limit:
+            data = hash_file.read(min(CHUNK_SIZE, limit - hashed))
+            if not data:
+                break
+            hasher.update(data)
+            hashed += len(data)
+
+    last_saved = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        futures = [pool.submit(fetch, segment) for segment in segments if segment[2] < segment[1] - segment[0] + 1]
+        pending = set(futures)
+        try:
+            # Report progress and checkpoint the state from this thread, so the callback
+            # never runs on a worker thread (Tk is not thread-safe)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()
+                with lock:
+                    downloaded = sum(segment[2] for segment in segments)
+                    frontier = _contiguous_end(segments)
+                    if time.monotonic() - last_saved >= STATE_SAVE_INTERVAL:
+                        _save_state(state_path, state)
+                        last_saved = time.monotonic()
+                if hasher:
+                    advance_hash(min(frontier, hashed + HASH_STEP))
+                if progress_callback and total_size > 0:
+                    progress_callback(downloaded / total_size * 100)
+            if hasher:
+                advance_hash(total_size)
+        except BaseException:
+            stop.set()
+            wait(futures)
+            with lock:
+                _save_state(state_path, state)
+            raise
+        finally:
+            if hash_file:
+                hash_file.close()
+
+
+def _contiguous_end(segments):
+    """Offset up to which the file has been downloaded without gaps."""
+    end = 0
+    for start, stop, done in segments:
+        if start != end:
+            break
+        end = start + done
+        if done < stop - start + 1:
+            break
+    return end
+
+
+def _plan_segments(total_size, connections):
+    count = max(1, min(connections, total_size // MIN_SEGMENT_SIZE))
+    step = total_size // count
+    segments = []
+    for i in range(count):
+        start = i * step
+        end = total_size - 1 if i == count - 1 else start + step - 1
+        segments.append([start, end, 0])
+    return segments
+
+
+def _parse_content_range_total(content_range):
+    # e.g. "bytes 0-0/123456789"
+    _, _, total = content_range.rpartition("/")
+    try:
+        return int(total)
+    except ValueError:
+        return None
+
+
+def _load_state(state_path, url, total_size):
+    """Return the saved segment state if it belongs to the same url and size, otherwise None."""
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("url") != url or state.get("size") != total_size:
+        return None
+    return state
+
+
+def _save_state(state_path, state):
+    atomic_write_json(state_path, state)
+
+
+def _remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,336 @@
+# fake_archive.py
+"""
+Local stand-in for archive.mozilla.org, used by the benchmarks and for testing without network.
+
+Serves /pub/firefox/candidates/<ver>-candidates/buildN/<arch>/<lang>/ from a directory on disk,
+with HTML listings (absolute hrefs, ETag/Last-Modified, 304 revalidation), HEAD, single-range
+GET and SHA512SUMS manifests. Per-request latency and a per-connection bandwidth cap can be
+simulated so that connection reuse and parallel segments show up in the numbers.
+
+    python fake_archive.py --root /tmp/fake-archive --versions 141.0b3 141.0b4 --port 8080
+"""
+import os
+import re
+import io
+import sys
+import time
+import random
+import hashlib
+import zipfile
+import tarfile
+import argparse
+import threading
+from email.utils import formatdate
+from urllib.parse import unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CANDIDATES_PATH = "/pub/firefox/candidates/"
+DEFAULT_ARCHES = ["win64", "linux-x86_64"]
+DEFAULT_LANGS = ["en-US"]
+
+
+def make_payload(file_count=200, total_size=64 * 1024 * 1024, seed=0):
+    """
+    Returns [(relative_path, bytes)] shaped like a Firefox build: one large library holding
+    ~40% of the bytes (xul.dll/libxul.so) and a long tail of smaller files spread over a few
+    directories. Contents compress roughly 2-3x, like real binaries.
+    """
+    rng = random.Random(seed)
+    blocks = [rng.randbytes(4096) for _ in range(64)]
+
+    def content(size):
+        # Random 4 KiB blocks with a compressible half, picked pseudo-randomly
+        out = bytearray()
+        while len(out) < size:
+            block = blocks[rng.randrange(len(blocks))]
+            out += block[:2048] + bytes(2048)
+        return bytes(out[:size])
+
+    large = int(total_size * 0.4)
+    small = max(1, (total_size - large) // max(1, file_count - 1))
+    files = [("firefox/libxul.so", content(large))]
+    dirs = ["firefox", "firefox/browser", "firefox/browser/features", "firefox/defaults/pref", "firefox/gmp-clearkey/0.1"]
+    for i in range(1, file_count):
+        files.append((f"{dirs[i % len(dirs)]}/file{i}.bin", content(small)))
+    files.append(("firefox/defaults/pref/channel-prefs.js", b'pref("app.update.channel", "beta");\n'))
+    return files
+
+
+def write_archive(path, files, archive_format, version="1.0"):
+    """Write files as a zip, tar.xz or tar.bz2 archive, adding application.ini and the executable."""
+    files = files + [
+        ("firefox/application.ini", f"[App]\nVendor=Mozilla\nName=Firefox\nVersion={version}\n".encode()),
+        ("firefox/firefox", f"#!/bin/sh\necho 'Mozilla Firefox {version}'\n".encode()),
+        ("firefox/firefox.exe", b"MZ fake"),
+    ]
+    if archive_format == "zip":
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            for name, data in files:
+                info = zipfile.ZipInfo(name, date_time=(2025, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = (0o100755 if name.endswith("/firefox") else 0o100644) << 16
+                zf.writestr(info, data)
+    else:
+        compression = archive_format.split(".")[1]
+        options = {"preset": 1} if compression == "xz" else {"compresslevel": 1}
+        with tarfile.open(path, f"w:{compression}", **options) as tf:
+            for name, data in files:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = 0o755 if name.endswith("/firefox") else 0o644
+                info.mtime = 1735689600
+                tf.addfile(info, io.BytesIO(data))
+
+
+def archive_filename(version, arch, archive_format):
+    if arch.startswith("win"):
+        return f"firefox-{version}.zip"
+    if arch == "mac":
+        return f"Firefox {version}.dmg"
+    return f"firefox-{version}.{archive_format}"
+
+
+def populate(root, versions, arches=None, langs=None, builds=1, file_count=200, total_size=64 * 1024 * 1024,
+             linux_format="tar.xz"):
+    """
+    Lay out a candidates tree under root. Each archive format is generated once and hardlinked
+    to every version/build/lang, so large trees are cheap. Already populated trees are reused.
+    """
+    arches = arches or DEFAULT_ARCHES
+    langs = langs or DEFAULT_LANGS
+    payload = None
+    templates = {}
+    template_dir = os.path.join(root, ".templates")
+    os.makedirs(template_dir, exist_ok=True)
+
+    for version in versions:
+        for build in range(1, builds + 1):
+            build_dir = os.path.join(root, CANDIDATES_PATH.strip("/"), f"{version}-candidates", f"build{build}")
+            sums = []
+            for arch in arches:
+                archive_format = "zip" if arch.startswith("win") else linux_format
+                for lang in langs:
+                    filename = archive_filename(version, arch, archive_format)
+                    rel_path = f"{arch}/{lang}/{filename}"
+                    dest = os.path.join(build_dir, arch, lang, filename)
+                    if not os.path.exists(dest):
+                        template = os.path.join(template_dir, f"{version}.{archive_format}")
+                        if not os.path.exists(template):
+                            if payload is None:
+                                payload = make_payload(file_count, total_size)
+                            write_archive(template + ".tmp", payload, archive_format, version)
+                            os.replace(template + ".tmp", template)
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                        try:
+                            os.link(template, dest)
+                        except OSError:
+                            with open(template, "rb") as src, open(dest, "wb") as dst:
+                                dst.write(src.read())
+                    if dest not in templates:
+                        templates[dest] = _file_sha512(dest)
+                    sums.append(f"{templates[dest]}  {rel_path}")
+            with open(os.path.join(build_dir, "SHA512SUMS"), "w", encoding="utf-8") as f:
+                f.write("\n".join(sums) + "\n")
+    return root
+
+
+def _file_sha512(path):
+    h = hashlib.sha512()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real archive
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    archive = None                  # set on the per-server subclass
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head):
+        archive = self.archive
+        archive.count_request(self.command)
+        if archive.latency:
+            time.sleep(archive.latency)
+
+        path = unquote(self.path.split("?", 1)[0])
+        fs_path = os.path.join(archive.root, *[p for p in path.split("/") if p and p != ".."])
+        if not path.startswith("/pub/") or not os.path.exists(fs_path):
+            return self._send_simple(404, b"Not Found", head)
+        if os.path.isdir(fs_path):
+            if not path.endswith("/"):
+                self.send_response(301)
+                self.send_header("Location", path + "/")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            return self._send_listing(path, fs_path, head)
+        return self._send_file(fs_path, head)
+
+    def _send_simple(self, status, body, head):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_listing(self, path, fs_path, head):
+        names = sorted(n for n in os.listdir(fs_path) if not n.startswith("."))
+        rows = [f'<tr><td><a href="{path.rsplit("/", 2)[0]}/">..</a></td></tr>']
+        for name in names:
+            suffix = "/" if os.path.isdir(os.path.join(fs_path, name)) else ""
+            rows.append(f'<tr><td><a href="{path}{name}{suffix}">{name}{suffix}</a></td></tr>')
+        body = (f"<html><head><title>Directory Listing: {path}</title></head><body>"
+                f"<h1>Index of {path}</h1><table>{''.join(rows)}</table></body></html>").encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(os.path.getmtime(fs_path), usegmt=True))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_file(self, fs_path, head):
+        size = os.path.getsize(fs_path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match and self.archive.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        if self.archive.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", formatdate(os.path.getmtime(fs_path), usegmt=True))
+        self.end_headers()
+        if head:
+            return
+
+        remaining = end - start + 1
+        chunk_size = 64 * 1024
+        with open(fs_path, "rb") as f:
+            f.seek(start)
+            began = time.monotonic()
+            sent = 0
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(data)
+                sent += len(data)
+                self.archive.count_bytes(len(data))
+                if self.archive.bandwidth:
+                    # Cap this connection's rate; parallel connections each get the full cap
+                    ahead = sent / self.archive.bandwidth - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+
+class FakeArchive:
+    """
+    Serves a populated root on a local port. latency is seconds added to every request,
+    bandwidth is bytes/second per connection (None for unlimited).
+    """
+
+    def __init__(self, root, host="127.0.0.1", port=0, latency=0.0, bandwidth=None, ranges=True):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        self.requests = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        handler = type("Handler", (_Handler,), {"archive": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{CANDIDATES_PATH}"
+
+    def count_request(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def count_bytes(self, n):
+        with self._lock:
+            self.bytes_sent += n
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake archive.mozilla.org candidates tree")
+    parser.add_argument("--root", required=True, help="directory to populate and serve")
+    parser.add_argument("--versions", nargs="+", default=["141.0b3"])
+    parser.add_argument("--arches", nargs="+", default=DEFAULT_ARCHES)
+    parser.add_argument("--langs", nargs="+", default=DEFAULT_LANGS)
+    parser.add_argument("--builds", type=int, default=1, help="buildN folders per version")
+    parser.add_argument("--files", type=int, default=200, help="files per archive")
+    parser.add_argument("--size-mb", type=int, default=64, help="uncompressed size per archive")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--bandwidth-mbps", type=float, default=None, help="per-connection cap in MB/s")
+    args = parser.parse_args(argv)
+
+    populate(args.root, args.versions, args.arches, args.langs, args.builds, args.files, args.size_mb * 1024 * 1024)
+    archive = FakeArchive(args.root, args.host, args.port, args.latency_ms / 1000,
+                          args.bandwidth_mbps * 1024 * 1024 if args.bandwidth_mbps else None)
+    print(f"Serving {args.root} at {archive.base_url}", file=sys.stderr)
+    try:
+        archive.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
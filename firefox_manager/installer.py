@@ -0,0 +1,96 @@
+# installer.py
+import os
+import shutil
+import platform
+from downloader import download_build, stream_build, resolve_build, get_expected_checksum
+from manager import (INSTALL_ROOT, install_dmg, add_install_record, get_install_folder,
+                     apply_update_channel_modification)
+from tracing import span, traced, current_span
+import archive_cache
+import diskspace
+import dedup
+import prefetch
+import manifest
+
+
+class InstallCancelled(Exception):
+    pass
+
+
+@traced("install")
+def install_build(version, arch, lang, no_update=False, progress_callback=None, phase_callback=None,
+                  cancel_event=None, deduplicate=True):
+    """
+    Downloads, extracts, patches and records one build, returning its install folder.
+    Reports phase_callback(phase) as it moves through the install and progress_callback(percent)
+    for the transfer. Setting cancel_event aborts at the next progress report or phase change
+    with InstallCancelled; an interrupted stream extraction removes its half-written folder. Once the
+    build is extracted the install always runs to completion, so a cancel never leaves a complete
+    folder behind without its record.
+    With deduplicate, files shared with other installed builds are replaced by links (see dedup.py).
+    Safe to call from a worker thread.
+    """
+    def phase(name, cancellable=True):
+        if cancellable and cancel_event is not None and cancel_event.is_set():
+            raise InstallCancelled(f"Cancelled {version} ({arch}, {lang})")
+        if phase_callback:
+            phase_callback(name)
+
+    def report(percent):
+        if cancel_event is not None and cancel_event.is_set():
+            raise InstallCancelled(f"Cancelled {version} ({arch}, {lang})")
+        if progress_callback:
+            progress_callback(percent)
+
+    current_span().set(version=version, arch=arch, lang=lang)
+    install_path = get_install_folder(version, arch, lang)
+
+    # Fail before writing anything if the archive and the extracted build won't fit
+    phase("planning")
+    resolved = resolve_build(version, arch, lang)
+    url = resolved["url"]
+    checksum = get_expected_checksum(url)
+    download_bytes, extract_bytes = diskspace.estimate(resolved["size"],
+                                                       archive_cached=archive_cache.contains(url, checksum),
+                                                       staged=prefetch.is_staged(version, arch, lang, url))
+    with diskspace.reserve({archive_cache.CACHE_DIR: download_bytes, INSTALL_ROOT: extract_bytes}):
+        # A build the prefetcher already extracted just moves into place. Otherwise tar archives
+        # are extracted while they download; zip and dmg are downloaded first. Either way the
+        # archive lands in the archive cache, so reinstalling the build needs no transfer.
+        phase("downloading")
+        if prefetch.take_staged(version, arch, lang, install_path):
+            current_span().set(staged=True)
+            report(100)
+        elif not stream_build(version, arch, lang, install_path, progress_callback=report):
+            zip_path = download_build(version, arch, lang, progress_callback=report)
+
+            if not (zip_path.endswith(".dmg") and platform.system() == "Darwin"):
+                raise Exception(f"Build downloaded but not installed (unsupported format).\nSaved to:\n{zip_path}")
+
+            phase("extracting")
+            created = not os.path.isdir(install_path)
+            os.makedirs(install_path, exist_ok=True)
+            try:
+                install_dmg(zip_path, install_path)
+            except BaseException:
+                # Don't leave a half-copied build behind to be picked up as installed
+                if created:
+                    shutil.rmtree(install_path, ignore_errors=True)
+                raise
+
+        # If "Disable Updates" is checked, modify the channel preferences
+        if no_update:
+            phase("patching", cancellable=False)
+            apply_update_channel_modification(install_path, arch)
+
+        # Still within the reservation: until dedup links them, the files take their full size
+        if deduplicate:
+            phase("deduplicating", cancellable=False)
+            with span("dedup") as s:
+                s.set(**dedup.dedup_install(install_path))
+
+    # Last, so it records the files exactly as they are left (patched, linked)
+    phase("recording", cancellable=False)
+    manifest.record(install_path, arch, archive={"url": url, "checksum": checksum}, no_update=no_update)
+    add_install_record(version, arch, lang, install_path)
+    return install_path
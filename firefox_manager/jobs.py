@@ -0,0 +1,149 @@
+# jobs.py
+import queue
+import threading
+import itertools
+
+DEFAULT_CONCURRENCY = 3
+
+
+class Job:
+    """One queued build install. Fields are written by the worker thread and only read elsewhere."""
+
+    def __init__(self, job_id, version, arch, lang, no_update):
+        self.job_id = job_id
+        self.version = version
+        self.arch = arch
+        self.lang = lang
+        self.no_update = no_update
+        self.state = "queued"       # queued -> running -> done / failed / cancelled
+        self.phase = "queued"
+        self.percent = 0.0
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def key(self):
+        return self.version, self.arch, self.lang
+
+
+class JobScheduler:
+    """
+    Runs install jobs (download/extract, patch, record) on up to 'concurrency' worker threads.
+    Workers never touch the UI: they push (event, job) tuples onto an event queue that the
+    UI drains from the Tk main loop via poll_events(), e.g. on an after() timer.
+    Events are "queued", "phase", "progress", "done", "failed" and "cancelled".
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+        self.concurrency = concurrency
+        self.pending = queue.Queue()
+        self.events = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.workers = []
+        self.ids = itertools.count(1)
+        self.stopping = False
+
+    def submit(self, version, arch, lang, no_update=False):
+        """Queue an install. Returns the existing job if the same build is already queued or running."""
+        with self.lock:
+            for job in self.jobs.values():
+                if job.key == (version, arch, lang) and job.state in ("queued", "running"):
+                    return job
+            job = Job(next(self.ids), version, arch, lang, no_update)
+            self.jobs[job.job_id] = job
+            self._spawn_workers()
+        self.events.put(("queued", job))
+        self.pending.put(job)
+        return job
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job and job.state in ("queued", "running"):
+            job.cancel_event.set()
+            return True
+        return False
+
+    def set_concurrency(self, concurrency):
+        """Takes effect for new workers at once; surplus workers exit after their current job."""
+        with self.lock:
+            self.concurrency = max(1, concurrency)
+            self._spawn_workers()
+
+    def forget_finished(self):
+        with self.lock:
+            for job_id in [j.job_id for j in self.jobs.values() if j.state not in ("queued", "running")]:
+                del self.jobs[job_id]
+
+    def poll_events(self):
+        """Drain and return every event posted since the last call. Call from the UI thread."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def shutdown(self):
+        self.stopping = True
+        for job in list(self.jobs.values()):
+            job.cancel_event.set()
+
+    def _spawn_workers(self):
+        # Called with self.lock held
+        self.workers = [w for w in self.workers if w.is_alive()]
+        while len(self.workers) < self.concurrency:
+            worker = threading.Thread(target=self._work, daemon=True)
+            self.workers.append(worker)
+            worker.start()
+
+    def _work(self):
+        while not self.stopping:
+            with self.lock:
+                alive = [w for w in self.workers if w.is_alive()]
+                if len(alive) > self.concurrency:
+                    self.workers.remove(threading.current_thread())
+                    return
+            try:
+                job = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        # Deferred so the UI can start without loading the HTTP stack (requests, urllib3, ...)
+        from installer import install_build, InstallCancelled
+
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            self.events.put(("cancelled", job))
+            return
+
+        job.state = "running"
+
+        def on_phase(phase):
+            job.phase = phase
+            self.events.put(("phase", job))
+
+        def on_progress(percent):
+            # Coalesce: only post when the visible integer percentage changes
+            if int(percent) != int(job.percent):
+                job.percent = percent
+                self.events.put(("progress", job))
+            job.percent = percent
+
+        try:
+            job.result = install_build(job.version, job.arch, job.lang, no_update=job.no_update,
+                                       progress_callback=on_progress, phase_callback=on_phase,
+                                       cancel_event=job.cancel_event)
+            job.state = "done"
+            job.percent = 100.0
+            self.events.put(("done", job))
+        except InstallCancelled:
+            job.state = "cancelled"
+            self.events.put(("cancelled", job))
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+            self.events.put(("failed", job))
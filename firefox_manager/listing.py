@@ -0,0 +1,120 @@
+# listing.py
+import os
+import json
+import time
+import threading
+from html.parser import HTMLParser
+from atomicfile import atomic_write_json
+from net import get_session, timeout
+
+CACHE_FILE = "listing_cache.json"
+LISTING_TTL = 300          # seconds a cached listing is trusted without asking the server
+
+_cache = None
+_lock = threading.Lock()
+
+
+class _LinkExtractor(HTMLParser):
+    """Collects the href of every <a> tag. Fed in chunks, so no document tree is ever built."""
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            for name, value in attrs:
+                if name == "href" and value:
+                    self.links.append(value)
+                    break
+
+
+def get_links(url, max_age=None):
+    """
+    Returns the hrefs of an archive directory listing.
+    Results are cached on disk with the ETag/Last-Modified of the response. Within max_age seconds
+    (default LISTING_TTL) the cache is returned as-is; after that the listing is revalidated with
+    a conditional request, so an unchanged listing costs one 304 round trip and no parsing.
+    """
+    if max_age is None:
+        max_age = LISTING_TTL
+    with _lock:
+        entry = _load_cache().get(url)
+    if entry and time.time() - entry["fetched_at"] < max_age:
+        return entry["links"]
+
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    res = get_session().get(url, headers=headers, stream=True, timeout=timeout())
+    if res.status_code == 304 and entry:
+        res.close()
+        entry["fetched_at"] = time.time()
+        _store(url, entry)
+        return entry["links"]
+    if res.status_code != 200:
+        res.close()
+        raise Exception(f"Failed to access listing: {url} (HTTP {res.status_code})")
+
+    parser = _LinkExtractor()
+    res.encoding = res.encoding or "utf-8"
+    for text in res.iter_content(chunk_size=64 * 1024, decode_unicode=True):
+        parser.feed(text)
+    parser.close()
+
+    entry = {
+        "links": parser.links,
+        "etag": res.headers.get("etag"),
+        "last_modified": res.headers.get("last-modified"),
+        "fetched_at": time.time(),
+    }
+    _store(url, entry)
+    return entry["links"]
+
+
+def link_names(links):
+    """Strip hrefs down to their last path component, e.g. '/pub/.../141.0b3-candidates/' -> '141.0b3-candidates'."""
+    return [href.rstrip("/").split("/")[-1] for href in links if href.endswith("/")]
+
+
+def parse_build_folders(links):
+    """Return the (number, name) pairs of the buildN folders in a listing, lowest number first."""
+    builds = []
+    for name in link_names(links):
+        if name.startswith("build"):
+            try:
+                builds.append((int(name[len("build"):]), name))
+            except ValueError:
+                continue
+    builds.sort()
+    return builds
+
+
+def clear_cache():
+    global _cache
+    with _lock:
+        _cache = {}
+        if os.path.exists(CACHE_FILE):
+            os.remove(CACHE_FILE)
+
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE, "r", encoding="utf-8") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _store(url, entry):
+    with _lock:
+        cache = _load_cache()
+        cache[url] = entry
+        atomic_write_json(CACHE_FILE, cache)
@@ -1,5 +1,6 @@
 # manager.py
 import os
+import re
 import json
 import zipfile
 import tarfile
@@ -8,25 +9,127 @@ import platform
 import subprocess
 import time
 import shutil
+import heapq
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from version_probe import probe_versions
+import dedup
+import profiles
+import manifest
+from tracing import span, traced, current_span
 
-DB_FILE = "firefox_db.json"
+DB_FILE = "firefox_db.sqlite3"
+LEGACY_DB_FILE = "firefox_db.json"
 INSTALL_ROOT = "builds"
+PARALLEL_ZIP_MIN_MEMBERS = 64   # below this the thread pool costs more than it saves
 
-def extract_zip(zip_path, target_folder):
+# Fields beyond these are kept in the 'extra' JSON column, so new record fields need no schema change
+_COLUMNS = ("version", "arch", "language", "install_path", "installed_at")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS installs (
+    version TEXT NOT NULL,
+    arch TEXT NOT NULL,
+    language TEXT NOT NULL,
+    install_path TEXT NOT NULL,
+    installed_at TEXT NOT NULL,
+    extra TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (version, arch, language)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+_UPSERT = ("INSERT OR REPLACE INTO installs (version, arch, language, install_path, installed_at, extra) "
+           "VALUES (?, ?, ?, ?, ?, ?)")
+
+_local = threading.local()
+
+@traced("extract", format="zip")
+def extract_zip(zip_path, target_folder, workers=None):
+    """
+    Extracts a zip across a pool of worker threads (zlib releases the GIL while inflating).
+    The directory skeleton is created first, then members are spread over the workers by
+    compressed size so no worker ends up with both xul.dll and a long tail of small files.
+    Each worker reads through its own ZipFile handle. Permissions are applied at the end.
+    """
+    workers = workers or os.cpu_count() or 1
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(target_folder)
+        members = zip_ref.infolist()
+        current_span().set(files=len(members), bytes=sum(i.file_size for i in members))
+        if workers == 1 or len(members) < PARALLEL_ZIP_MIN_MEMBERS:
+            zip_ref.extractall(target_folder)
+            return target_folder
+
+    files = []
+    for info in members:
+        dest = _zip_member_path(target_folder, info)
+        if info.is_dir():
+            os.makedirs(dest, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            files.append(info)
+
+    # Largest-first greedy assignment to the least loaded bucket
+    buckets = [[] for _ in range(min(workers, len(files)))]
+    loads = [(0, i) for i in range(len(buckets))]
+    for info in sorted(files, key=lambda i: i.compress_size, reverse=True):
+        load, i = heapq.heappop(loads)
+        buckets[i].append(info)
+        heapq.heappush(loads, (load + info.compress_size, i))
+
+    with ThreadPoolExecutor(max_workers=len(buckets)) as pool:
+        for future in [pool.submit(_extract_zip_members, zip_path, bucket, target_folder) for bucket in buckets]:
+            future.result()
+
+    # Unix permission bits live in the high 16 bits of external_attr (zero for zips made on Windows).
+    # Directories last, deepest first, so a read-only directory can't block writes below it.
+    for info in files + sorted((i for i in members if i.is_dir()), key=lambda i: i.filename.count("/"), reverse=True):
+        mode = (info.external_attr >> 16) & 0o7777
+        if mode:
+            os.chmod(_zip_member_path(target_folder, info), mode)
     return target_folder
 
+def _extract_zip_members(zip_path, members, target_folder):
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in members:
+            with zip_ref.open(info) as src, open(_zip_member_path(target_folder, info), 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def _zip_member_path(target_folder, info):
+    """Sanitised destination of a zip member, the same way ZipFile.extract builds it."""
+    arcname = info.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    return os.path.join(target_folder, arcname)
+
+@traced("extract", format="tar.bz2")
 def extract_tar_bz2(tar_path, target_folder):
     with tarfile.open(tar_path, 'r:bz2') as tar_ref:
         tar_ref.extractall(target_folder)
+        current_span().set(files=len(tar_ref.members))
     return target_folder
 
+@traced("extract", format="tar.xz")
 def extract_tar_xz(tar_path, target_folder):
     with tarfile.open(tar_path, 'r:xz') as tar_ref:
         tar_ref.extractall(target_folder)
+        current_span().set(files=len(tar_ref.members))
+    return target_folder
+
+@traced("extract", streamed=True)
+def extract_tar_stream(fileobj, target_folder, compression):
+    """Extract a tar archive from a non-seekable stream (e.g. a response body) as bytes arrive."""
+    with tarfile.open(fileobj=fileobj, mode=f"r|{compression}") as tar_ref:
+        tar_ref.extractall(target_folder)
+        current_span().set(format=f"tar.{compression}", files=len(tar_ref.members))
     return target_folder
 
+@traced("extract", format="dmg")
 def install_dmg(dmg_path, target_folder):
     """Mounts a DMG, copies the .app to the target, and unmounts."""
     if platform.system() != 'Darwin':
@@ -71,32 +174,288 @@ def install_dmg(dmg_path, target_folder):
 
     return target_folder
 
+def _connect():
+    """
+    Returns this thread's connection to the build database, creating the schema (and
+    importing the legacy JSON database) the first time the file is opened.
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(DB_FILE)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.executescript(_SCHEMA)
+            if conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_migrated'").fetchone() is None:
+                _migrate_legacy_json(conn)
+        connections[DB_FILE] = conn
+    return conn
+
+def _migrate_legacy_json(conn):
+    """One-time import of firefox_db.json. The JSON file is left in place as a backup."""
+    if os.path.exists(LEGACY_DB_FILE):
+        with open(LEGACY_DB_FILE, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        # Later duplicates win, the same way add_install_record used to replace them
+        conn.executemany(_UPSERT, [_entry_to_row(e) for e in entries])
+        print(f"Migrated {len(entries)} build(s) from {LEGACY_DB_FILE} to {DB_FILE}.")
+    conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_json_migrated', ?)", (datetime.now().isoformat(),))
+
+def _entry_to_row(entry):
+    extra = {k: v for k, v in entry.items() if k not in _COLUMNS}
+    return (entry["version"], entry["arch"], entry["language"], entry["install_path"],
+            entry.get("installed_at") or datetime.now().isoformat(), json.dumps(extra))
+
+def _row_to_entry(row):
+    entry = {k: row[k] for k in _COLUMNS}
+    entry.update(json.loads(row["extra"]))
+    return entry
+
 def load_db():
-    if not os.path.exists(DB_FILE):
-        return []
-    with open(DB_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Return every build record, oldest first."""
+    rows = _connect().execute("SELECT * FROM installs ORDER BY rowid").fetchall()
+    return [_row_to_entry(row) for row in rows]
 
 def save_db(entries):
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(entries, f, indent=2)
+    """Replace the whole database with entries in a single transaction."""
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM installs")
+        conn.executemany(_UPSERT, [_entry_to_row(e) for e in entries])
 
-def add_install_record(version, arch, lang, install_path):
-    db = load_db()
+def find_install_record(version, arch, lang):
+    row = _connect().execute("SELECT * FROM installs WHERE version = ? AND arch = ? AND language = ?",
+                             (version, arch, lang)).fetchone()
+    return _row_to_entry(row) if row else None
 
-    # Remove any existing entry with the same version, arch, and language to avoid duplicates
-    db = [e for e in db if not (e["version"] == version and e["arch"] == arch and e["language"] == lang)]
+def find_install_by_path(install_path):
+    row = _connect().execute("SELECT * FROM installs WHERE install_path = ?", (install_path,)).fetchone()
+    return _row_to_entry(row) if row else None
 
+@traced("db_write")
+def add_install_record(version, arch, lang, install_path, **extra):
     entry = {
         "version": version,
         "arch": arch,
         "language": lang,
         "install_path": install_path,
-        "installed_at": datetime.now().isoformat()
+        "installed_at": datetime.now().isoformat(),
+        **extra
     }
 
-    db.append(entry)
-    save_db(db)
+    # REPLACE drops any existing entry with the same version, arch, and language, so the
+    # record moves to the end of the list just like a fresh install
+    conn = _connect()
+    with conn:
+        conn.execute(_UPSERT, _entry_to_row(entry))
+
+@traced("db_write")
+def update_install_record(version, arch, lang, changes):
+    """Update fields of one record in place. Changing 'version' keeps the record's position."""
+    entry = find_install_record(version, arch, lang)
+    if entry is None:
+        return False
+    entry.update(changes)
+    row = _entry_to_row(entry)
+    conn = _connect()
+    with conn:
+        conn.execute("UPDATE OR REPLACE installs SET version = ?, arch = ?, language = ?, install_path = ?, installed_at = ?, "
+                     "extra = ? WHERE version = ? AND arch = ? AND language = ?", row + (version, arch, lang))
+    return True
+
+@traced("db_write")
+def remove_install_record(version, arch, lang):
+    conn = _connect()
+    with conn:
+        conn.execute("DELETE FROM installs WHERE version = ? AND arch = ? AND language = ?", (version, arch, lang))
+
+def get_exec_path(install_path, arch):
+    """Helper to get the platform-specific executable path."""
+    if "win" in arch:
+        return os.path.join(install_path, "firefox", "firefox.exe")
+    elif "mac" in arch:
+        return os.path.join(install_path, "Firefox.app", "Contents", "MacOS", "firefox")
+    else:  # linux
+        return os.path.join(install_path, "firefox", "firefox")
+
+def get_channel_prefs_path(install_path, arch):
+    """Helper to get the platform-specific channel-prefs.js path."""
+    if "win" in arch or "linux" in arch:
+        return os.path.join(install_path, "firefox", "defaults", "pref", "channel-prefs.js")
+    elif "mac" in arch:
+        # On macOS, prefs are inside the app bundle's Resources directory
+        return os.path.join(install_path, "Firefox.app", "Contents", "Resources", "defaults", "pref", "channel-prefs.js")
+    return None
+
+@traced("patch_channel_prefs")
+def apply_update_channel_modification(install_path, arch):
+    """
+    Modifies the channel preference in channel-prefs.js for a new installation.
+    This is triggered when 'Disable Updates' is checked. It inserts '333'
+    into the channel name to effectively break the update URL.
+    e.g., "release" becomes "releas333e", "beta" becomes "bet333a".
+    """
+    prefs_file = get_channel_prefs_path(install_path, arch)
+
+    if not prefs_file or not os.path.exists(prefs_file):
+        print(f"Warning: Could not find channel-prefs.js for modification at {prefs_file}")
+        return
+
+    try:
+        with open(prefs_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+
+        new_lines = []
+        modified = False
+        pattern = re.compile(r'(pref\("app\.update\.channel", ")([^"]+)("\);)')
+
+        for line in lines:
+            match = pattern.search(line)
+            if match:
+                channel = match.group(2)
+                # This check is a safeguard, but unlikely to be needed on a fresh install
+                if '333' in channel:
+                    new_lines.append(line)
+                    continue
+
+                new_channel = f"{channel[:-1]}333{channel[-1]}" if len(channel) > 1 else f"{channel}333"
+                new_lines.append(pattern.sub(rf'\g<1>{new_channel}\g<3>', line))
+                modified = True
+            else:
+                new_lines.append(line)
+
+        if modified:
+            with open(prefs_file, 'w', encoding='utf-8') as f:
+                f.writelines(new_lines)
+            print(f"Successfully modified update channel in {os.path.basename(prefs_file)}.")
+        else:
+            print(f"Warning: Could not find channel preference line to modify in {prefs_file}.")
+    except Exception as e:
+        # Using print instead of messagebox to avoid disrupting the install flow
+        print(f"An error occurred during channel modification: {e}")
+
+def list_install_status(db_entries=None):
+    """
+    (version, arch, language, present) for every record, oldest first. 'present' is the state last
+    recorded by sync_install, so this costs no disk access at all.
+    """
+    if db_entries is None:
+        db_entries = load_db()
+    return [(e["version"], e["arch"], e["language"], not e.get("missing")) for e in db_entries]
+
+@traced("sync")
+def sync_install(install_path, refresh=True):
+    """
+    Bring the record of one install folder in line with the disk: mark it missing when the folder
+    is gone (or present again when it came back), and re-probe its version to follow a build that
+    updated itself. Folders without a record are ignored. Returns True if the record changed.
+    """
+    entry = find_install_by_path(install_path)
+    if entry is None:
+        return False
+    key = (entry["version"], entry["arch"], entry["language"])
+    current_span().set(version=entry["version"])
+
+    present = os.path.isdir(install_path)
+    changed = bool(entry.get("missing")) == present
+    if changed:
+        update_install_record(*key, {"missing": not present})
+    if not present:
+        return changed
+
+    firefox_exec = get_exec_path(install_path, entry["arch"])
+    actual_version = probe_versions([firefox_exec], refresh=refresh)[firefox_exec]
+    if actual_version and actual_version != entry["version"]:
+        changed = _follow_version_update(entry, install_path, actual_version) or changed
+    return changed
+
+def reconcile_installs():
+    """
+    sync_install every record, e.g. once in the background at startup to catch what happened while
+    nothing was watching. Unchanged builds cost a couple of stats thanks to the probe cache.
+    Returns the number of records that changed.
+    """
+    return sum(1 for entry in load_db() if sync_install(entry["install_path"], refresh=False))
+
+def _follow_version_update(entry, current_install_path, actual_version):
+    """Rename the folder and record of a build that updated itself. Returns True on success."""
+    new_install_path = get_install_folder(actual_version, entry["arch"], entry["language"])
+    try:
+        print(f"Updating version for {entry['version']} -> {actual_version}")
+        # Rename the folder to match the new version
+        os.rename(current_install_path, new_install_path)
+    except OSError as e:
+        print(f"Error renaming folder for {entry['version']}: {e}. Skipping update for this entry.")
+        return False
+
+    # The record follows the folder straight away; if it can't, the folder goes back
+    try:
+        update_install_record(entry["version"], entry["arch"], entry["language"],
+                              {"version": actual_version, "install_path": new_install_path, "missing": False})
+    except Exception as e:
+        print(f"Error updating the record of {entry['version']}: {e}. Skipping update for this entry.")
+        os.rename(new_install_path, current_install_path)
+        return False
+
+    # The build is consistent now; what's left is bookkeeping keyed by its folder
+    followers = [
+        lambda: dedup.move_install(current_install_path, new_install_path),
+        lambda: profiles.move_profile(current_install_path, new_install_path),
+        # The update changed the files; the manifest describes the old version
+        lambda: manifest.remove(current_install_path),
+    ]
+    for follow in followers:
+        try:
+            follow()
+        except Exception as e:
+            print(f"Could not move the data of {entry['version']} to {new_install_path}: {e}")
+    return True
+
+
+@traced("verify")
+def verify_installs(db_entries=None):
+    """
+    Drops records whose install folder is gone and follows builds that updated themselves,
+    renaming their folder and record to the new version. Returns (removed_count, updated_count).
+    """
+    if db_entries is None:
+        db_entries = load_db()
+
+    removed_count = 0
+    updated_count = 0
+
+    present = []
+    for entry in db_entries:
+        current_install_path = get_install_folder(entry["version"], entry["arch"], entry["language"])
+
+        if not os.path.isdir(current_install_path):
+            remove_install_record(entry["version"], entry["arch"], entry["language"])
+            dedup.release_install(current_install_path)
+            manifest.remove(current_install_path)
+            removed_count += 1
+            continue
+
+        if entry.get("missing"):
+            update_install_record(entry["version"], entry["arch"], entry["language"], {"missing": False})
+        present.append((entry, current_install_path, get_exec_path(current_install_path, entry["arch"])))
+
+    # Folders exist, check for version updates. Unchanged executables are answered from the probe cache.
+    with span("probe_versions", builds=len(present)):
+        versions = probe_versions([firefox_exec for _, _, firefox_exec in present])
+
+    for entry, current_install_path, firefox_exec in present:
+        actual_version = versions[firefox_exec]
+
+        if actual_version and actual_version != entry["version"]:
+            # Version has changed, we need to rename the folder and update the DB
+            if _follow_version_update(entry, current_install_path, actual_version):
+                updated_count += 1
+
+    current_span().set(builds=len(db_entries), removed=removed_count, updated=updated_count)
+    return removed_count, updated_count
 
 def get_install_folder(version, arch, lang):
     folder_name = f"{version}-{arch}-{lang}"
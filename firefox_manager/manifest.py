@@ -0,0 +1,268 @@
+# manifest.py
+"""
+Per-build file manifests, for integrity checks that cost next to nothing when nothing changed.
+
+At install time every file of the build is recorded in manifests/<install folder name>.json with
+its size, mtime and SHA-256, along with the archive it came from. verify() walks the folder and
+compares stat data with the manifest: only files whose size or mtime changed are hashed again,
+across a thread pool (hashlib releases the GIL on large buffers, so hashing uses every core).
+A fleet of unchanged builds therefore costs one stat per file.
+
+Missing or damaged files are repaired by extracting just those members from the build's archive,
+taken from the archive cache (or downloaded into it), instead of reinstalling the whole build.
+A build that updates itself no longer matches its manifest, so its manifest is dropped when the
+update is detected; record() makes a new one.
+"""
+import os
+import json
+import time
+import hashlib
+import zipfile
+import tarfile
+import posixpath
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+from tracing import span, traced, current_span
+from atomicfile import atomic_write_json
+import dedup
+import manager
+
+MANIFEST_DIR = "manifests"
+HASH_WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 1024 * 1024
+
+
+def manifest_path(install_path):
+    return os.path.join(MANIFEST_DIR, os.path.basename(os.path.normpath(install_path)) + ".json")
+
+
+def load(install_path):
+    try:
+        with open(manifest_path(install_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove(install_path):
+    try:
+        os.remove(manifest_path(install_path))
+    except FileNotFoundError:
+        pass
+
+
+@traced("manifest")
+def record(install_path, arch, archive=None, no_update=False):
+    """
+    Hash every file of an install folder and write its manifest. archive is the
+    {"url", "checksum"} the build was extracted from, needed to repair it later.
+    Files already in the dedup object store are not hashed again.
+    """
+    known = {relpath.replace(os.sep, "/"): digest for relpath, digest in dedup.digests(install_path).items()}
+    files = _scan(install_path)
+    to_hash = [relpath for relpath in files if relpath not in known]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        hashed = dict(zip(to_hash, pool.map(lambda r: _hash_file(os.path.join(install_path, r)), to_hash)))
+    current_span().set(files=len(files), hashed=len(to_hash))
+
+    data = {
+        "install_path": os.path.normpath(install_path),
+        "arch": arch,
+        "archive": archive,
+        "no_update": no_update,
+        "recorded_at": time.time(),
+        "files": {relpath: [size, mtime_ns, known.get(relpath) or hashed[relpath]]
+                  for relpath, (size, mtime_ns) in files.items()},
+    }
+    _save(install_path, data)
+    return data
+
+
+@traced("verify_files")
+def verify(install_paths, workers=None):
+    """
+    Check install folders against their manifests. Returns {install_path: report}, where a report
+    has "missing", "damaged" and "extra" relpaths, the "checked" and "rehashed" file counts and
+    "ok", or is None for a folder without a manifest. Files that were touched but whose content
+    is unchanged get their new stat data recorded, so the next run doesn't hash them again.
+    """
+    workers = workers or HASH_WORKERS
+    # Builds are walked in parallel and their changed files hashed on a second pool, so a build
+    # waiting for its hashes never holds up the walk of the others
+    with ThreadPoolExecutor(max_workers=workers) as walk_pool, \
+            ThreadPoolExecutor(max_workers=workers) as hash_pool:
+        reports = list(walk_pool.map(lambda path: _verify_one(path, hash_pool), install_paths))
+    current_span().set(builds=len(install_paths),
+                       rehashed=sum(r["rehashed"] for r in reports if r),
+                       damaged=sum(1 for r in reports if r and not r["ok"]))
+    return dict(zip(install_paths, reports))
+
+
+def _verify_one(install_path, hash_pool):
+    data = load(install_path)
+    if data is None:
+        return None
+    expected = data["files"]
+    actual = _scan(install_path) if os.path.isdir(install_path) else {}
+
+    missing = sorted(set(expected) - set(actual))
+    extra = sorted(set(actual) - set(expected))
+    changed = [relpath for relpath, stat in actual.items()
+               if relpath in expected and list(stat) != expected[relpath][:2]]
+    digests = hash_pool.map(lambda r: _hash_file(os.path.join(install_path, r)), changed)
+
+    damaged = []
+    for relpath, digest in zip(changed, digests):
+        if digest == expected[relpath][2]:
+            expected[relpath][:2] = actual[relpath]
+        else:
+            damaged.append(relpath)
+    if len(damaged) < len(changed):
+        _save(install_path, data)
+
+    return {"checked": len(actual), "rehashed": len(changed), "missing": missing, "damaged": sorted(damaged),
+            "extra": extra, "ok": not missing and not damaged}
+
+
+@traced("repair")
+def repair(install_path, report=None):
+    """
+    Restore the missing and damaged files of an install folder from its archive. Returns
+    {"repaired": [...], "failed": [...]} relpaths.
+    """
+    data = load(install_path)
+    if data is None:
+        raise Exception(f"No manifest for {install_path}; run verify --record first")
+    if report is None:
+        report = verify([install_path])[install_path]
+    wanted = set(report["missing"]) | set(report["damaged"])
+    if not wanted:
+        return {"repaired": [], "failed": []}
+    if not data.get("archive"):
+        raise Exception(f"The manifest of {install_path} doesn't say which archive it came from; reinstall it")
+
+    with span("fetch_archive"):
+        archive_path, temporary = _archive_for(data["archive"])
+    try:
+        with span("extract_members", files=len(wanted)):
+            extracted = _extract_members(archive_path, install_path, wanted)
+    finally:
+        if temporary:
+            os.remove(archive_path)
+
+    # channel-prefs.js was patched after extraction; patch the restored copy again
+    prefs_path = manager.get_channel_prefs_path(install_path, data["arch"])
+    prefs_relpath = os.path.relpath(prefs_path, install_path).replace(os.sep, "/") if prefs_path else None
+    if data.get("no_update") and prefs_relpath in extracted:
+        manager.apply_update_channel_modification(install_path, data["arch"])
+
+    repaired, failed = [], []
+    for relpath in sorted(wanted):
+        path = os.path.join(install_path, relpath)
+        if relpath in extracted and _hash_file(path) == data["files"][relpath][2]:
+            st = os.stat(path)
+            data["files"][relpath][:2] = [st.st_size, st.st_mtime_ns]
+            repaired.append(relpath)
+        else:
+            failed.append(relpath)
+    _save(install_path, data)
+    dedup.restore_objects(install_path, [relpath.replace("/", os.sep) for relpath in repaired])
+    current_span().set(repaired=len(repaired), failed=len(failed))
+    return {"repaired": repaired, "failed": failed}
+
+
+def _archive_for(archive):
+    """Path of the build's archive, from the cache or downloaded into it, and whether to delete it after."""
+    import archive_cache
+    from downloader import download_file
+
+    url = archive["url"]
+    checksum = tuple(archive["checksum"]) if archive.get("checksum") else None
+    cached = archive_cache.lookup(url, checksum)
+    if cached:
+        return cached, False
+    filename = unquote(url.rsplit("/", 1)[-1])
+    dest_path = archive_cache.entry_path(url, checksum, filename)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    download_file(url, dest_path, expected_checksum=checksum)
+    stored = archive_cache.store(url, checksum, dest_path, filename)
+    return (stored, False) if stored else (dest_path, True)
+
+
+def _extract_members(archive_path, install_path, wanted):
+    """Extract the members named in wanted (relpaths) over their files. Returns the relpaths written."""
+    written = set()
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zip_ref:
+            for info in zip_ref.infolist():
+                relpath = _member_relpath(info.filename)
+                if relpath in wanted and not info.is_dir():
+                    with zip_ref.open(info) as src:
+                        _write_member(src, os.path.join(install_path, relpath), (info.external_attr >> 16) & 0o7777)
+                    written.add(relpath)
+    elif ".tar." in archive_path:
+        compression = archive_path.rsplit(".", 1)[-1]
+        # Read as a stream: the members we need can be anywhere, and tar has no index to seek with
+        with open(archive_path, "rb") as f, tarfile.open(fileobj=f, mode=f"r|{compression}") as tar_ref:
+            for member in tar_ref:
+                relpath = _member_relpath(member.name)
+                if relpath in wanted and member.isfile():
+                    _write_member(tar_ref.extractfile(member), os.path.join(install_path, relpath), member.mode)
+                    written.add(relpath)
+                    if len(written) == len(wanted):
+                        break
+    else:
+        raise Exception(f"Can't repair from {os.path.basename(archive_path)}; reinstall the build instead")
+    return written
+
+
+def _write_member(src, dest, mode):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    # Write beside and swap in: a dedup hardlink at dest must be replaced, not written through
+    tmp_path = dest + ".repair"
+    with open(tmp_path, "wb") as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+    if mode:
+        os.chmod(tmp_path, mode)
+    os.replace(tmp_path, dest)
+
+
+def _member_relpath(name):
+    return posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+def _scan(install_path):
+    """relpath ('/'-separated) -> (size, mtime_ns) of every regular file under install_path."""
+    files = {}
+    stack = [install_path]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    relpath = os.path.relpath(entry.path, install_path).replace(os.sep, "/")
+                    files[relpath] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def _save(install_path, data):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    atomic_write_json(manifest_path(install_path), data)
@@ -0,0 +1,362 @@
+# mirror.py
+"""
+LAN caching mirror of the archive's candidates tree, so a fleet of machines downloads each build
+from the internet once.
+
+    python mirror.py --port 8080 --cache-dir mirror_cache
+    # on every client:
+    FFBM_BASE_URL=http://mirror-host:8080/pub/firefox/candidates/ python ui.py
+
+Paths are the archive's own (/pub/firefox/candidates/...), so a client only swaps the host.
+Directory listings are proxied and kept for LISTING_TTL seconds. Files (archives, SHA512SUMS,
+...) are fetched from upstream on first request and kept in the cache directory. Requests for
+a file that is still being fetched attach to the fetch in progress and stream from it as bytes
+arrive, so any number of clients asking at once cause a single upstream download. Cached files
+are served with Range support, so clients' segmented and resumed downloads work as usual.
+A directory asked for without its trailing slash is redirected to the slash form, as upstream
+does; listings are never written to the file cache.
+"""
+import os
+import re
+import sys
+import time
+import hashlib
+import argparse
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from net import get_session, timeout, DEFAULT_BASE_URL
+
+CACHE_DIR = "mirror_cache"
+MIRROR_PORT = 8080
+LISTING_TTL = 60          # seconds a proxied directory listing is served without asking upstream
+CHUNK_SIZE = 256 * 1024
+PARTIAL_SUFFIX = ".partial"   # marker next to a file whose fetch has not completed
+DIRECTORY = 301               # _Fetch.status of a path that turned out to be a directory
+
+
+class _Fetch:
+    """One upstream download in progress. Readers wait on cond for 'written' to grow."""
+
+    def __init__(self, path):
+        self.path = path
+        self.cond = threading.Condition()
+        self.status = None          # upstream status, set once the response headers are in
+        self.size = None
+        self.written = 0
+        self.done = False
+        self.error = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    mirror = None  # set on the subclass created by Mirror
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head):
+        path = self.path.split("?", 1)[0]
+        prefix = self.mirror.prefix
+        if not path.startswith(prefix):
+            return self._send_simple(404, b"Not Found", head)
+        relpath = path[len(prefix):]
+        parts = unquote(relpath).split("/")
+        if ".." in parts or any("\\" in p for p in parts):
+            return self._send_simple(400, b"Bad Request", head)
+
+        try:
+            if relpath == "" or relpath.endswith("/"):
+                return self._send_listing(relpath, head)
+            fs_path = os.path.join(self.mirror.cache_dir, *parts)
+            if os.path.isdir(fs_path):
+                return self._redirect_to_directory(path, head)
+            return self._send_file(path, relpath, fs_path, head)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print(f"Mirror failed to serve {path}: {e}", file=sys.stderr)
+            self._send_simple(502, b"Bad Gateway", head)
+
+    def _send_simple(self, status, body, head, headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _redirect_to_directory(self, path, head):
+        self._send_simple(301, b"", head, [("Location", path + "/")])
+
+    def _send_listing(self, relpath, head):
+        status, body, etag = self.mirror.listing(relpath)
+        if status != 200:
+            return self._send_simple(status, b"Upstream error", head)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_file(self, path, relpath, fs_path, head):
+        mirror = self.mirror
+        if head and not mirror.is_cached(fs_path):
+            # Clients probe candidate filenames with HEAD; don't start a download for a probe
+            status, size = mirror.upstream_head(relpath)
+            if status == DIRECTORY:
+                return self._redirect_to_directory(path, head)
+            headers = [("Accept-Ranges", "bytes")] if status == 200 else []
+            self.send_response(status)
+            self.send_header("Content-Length", str(size if status == 200 else 0))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        fetch = mirror.open_file(relpath, fs_path)
+        if fetch is not None:
+            with fetch.cond:
+                while fetch.status is None and fetch.error is None:
+                    fetch.cond.wait()
+                if fetch.status == DIRECTORY:
+                    return self._redirect_to_directory(path, head)
+                if fetch.status != 200:
+                    return self._send_simple(fetch.status or 502, b"Upstream error", head)
+                # Without a Content-Length upstream the size is only known at the end
+                while fetch.size is None and not fetch.done:
+                    fetch.cond.wait()
+                size = fetch.size if fetch.size is not None else fetch.written
+        else:
+            size = os.path.getsize(fs_path)
+
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                # Suffix range: the last N bytes
+                start = max(0, size - int(match.group(2)))
+            if start >= size or start > end:
+                return self._send_simple(416, b"", head, [("Content-Range", f"bytes */{size}")])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if head:
+            return
+
+        with open(fs_path, "rb") as f:
+            pos = start
+            while pos <= end:
+                if fetch is not None:
+                    with fetch.cond:
+                        while fetch.written <= pos and not fetch.done:
+                            fetch.cond.wait()
+                        if fetch.error is not None and fetch.written <= pos:
+                            # Upstream broke off; dropping the connection tells the client to retry
+                            self.close_connection = True
+                            return
+                        available = fetch.written
+                else:
+                    available = size
+                f.seek(pos)
+                data = f.read(min(CHUNK_SIZE, available - pos, end + 1 - pos))
+                if not data:
+                    self.close_connection = True
+                    return
+                self.wfile.write(data)
+                pos += len(data)
+                mirror.count("bytes_served", len(data))
+
+
+class Mirror:
+    """
+    Serves upstream (a candidates base URL) from cache_dir on host:port. Use as a context manager
+    or call start()/stop(); serve_forever() blocks.
+    """
+
+    def __init__(self, upstream=DEFAULT_BASE_URL, cache_dir=CACHE_DIR, host="0.0.0.0", port=MIRROR_PORT):
+        self.upstream = upstream if upstream.endswith("/") else upstream + "/"
+        self.prefix = "/" + self.upstream.split("://", 1)[-1].split("/", 1)[-1]
+        self.cache_dir = cache_dir
+        self.stats = {"requests": 0, "hits": 0, "joined": 0, "upstream_fetches": 0, "bytes_from_upstream": 0,
+                      "bytes_served": 0}
+        self._fetches = {}
+        self._listings = {}
+        self._listing_locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        handler = type("Handler", (_Handler,), {"mirror": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        if host == "0.0.0.0":
+            host = "127.0.0.1"
+        return f"http://{host}:{port}{self.prefix}"
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def is_cached(self, fs_path):
+        return os.path.isfile(fs_path) and not os.path.exists(fs_path + PARTIAL_SUFFIX)
+
+    def open_file(self, relpath, fs_path):
+        """
+        Returns None when fs_path is complete on disk, otherwise the _Fetch filling it, starting
+        one unless another request already did.
+        """
+        self.count("requests")
+        with self._lock:
+            fetch = self._fetches.get(fs_path)
+            if fetch is not None:
+                self.stats["joined"] += 1
+                return fetch
+            if self.is_cached(fs_path):
+                self.stats["hits"] += 1
+                return None
+            fetch = self._fetches[fs_path] = _Fetch(fs_path)
+            self.stats["upstream_fetches"] += 1
+        threading.Thread(target=self._fetch, args=(relpath, fetch), daemon=True).start()
+        return fetch
+
+    def _fetch(self, relpath, fetch):
+        marker = fetch.path + PARTIAL_SUFFIX
+        try:
+            response = get_session().get(self.upstream + relpath, stream=True, timeout=timeout())
+            if response.status_code != 200 or _is_directory(response):
+                response.close()
+                with fetch.cond:
+                    fetch.status = DIRECTORY if response.status_code == 200 else response.status_code
+                return
+
+            os.makedirs(os.path.dirname(fetch.path), exist_ok=True)
+            open(marker, "wb").close()
+            with response, open(fetch.path, "wb") as f:
+                # Readers open the file as soon as the status is in, so publish it only now
+                with fetch.cond:
+                    fetch.status = 200
+                    length = response.headers.get("content-length")
+                    fetch.size = int(length) if length and "content-encoding" not in response.headers else None
+                    fetch.cond.notify_all()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    f.flush()
+                    with fetch.cond:
+                        fetch.written += len(chunk)
+                        fetch.cond.notify_all()
+                    self.count("bytes_from_upstream", len(chunk))
+            if fetch.size is not None and fetch.written != fetch.size:
+                raise Exception(f"Upstream sent {fetch.written} of {fetch.size} bytes")
+            os.remove(marker)
+        except Exception as e:
+            print(f"Mirror fetch of {relpath} failed: {e}", file=sys.stderr)
+            with fetch.cond:
+                fetch.error = e
+            for path in (fetch.path, marker):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._fetches.pop(fetch.path, None)
+            with fetch.cond:
+                fetch.done = True
+                fetch.cond.notify_all()
+
+    def upstream_head(self, relpath):
+        response = get_session().head(self.upstream + relpath, timeout=timeout(), allow_redirects=True)
+        if response.status_code == 200 and _is_directory(response):
+            return DIRECTORY, 0
+        return response.status_code, int(response.headers.get("content-length", 0))
+
+    def listing(self, relpath):
+        """(status, body, etag) of a directory listing, fetched at most once per LISTING_TTL."""
+        with self._lock:
+            lock = self._listing_locks.setdefault(relpath, threading.Lock())
+        # Concurrent requests for a stale listing wait for the one refreshing it
+        with lock:
+            cached = self._listings.get(relpath)
+            if cached and time.monotonic() - cached[0] < LISTING_TTL:
+                return cached[1:]
+            response = get_session().get(self.upstream + relpath, timeout=timeout())
+            body = response.content
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            result = (response.status_code, body, etag)
+            if response.status_code == 200:
+                self._listings[relpath] = (time.monotonic(),) + result
+            return result
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _is_directory(response):
+    """Whether an upstream 200 is a directory listing (reached through the slash redirect or not)."""
+    return (response.url.endswith("/")
+            or response.headers.get("content-type", "").split(";")[0].strip() == "text/html")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LAN caching mirror of the Firefox candidates archive")
+    parser.add_argument("--upstream", default=DEFAULT_BASE_URL, help=f"default {DEFAULT_BASE_URL}")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=MIRROR_PORT)
+    args = parser.parse_args(argv)
+
+    mirror = Mirror(args.upstream, args.cache_dir, args.host, args.port)
+    print(f"Mirroring {mirror.upstream} at http://{args.host}:{args.port}{mirror.prefix}", file=sys.stderr)
+    try:
+        mirror.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
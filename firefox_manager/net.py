@@ -0,0 +1,67 @@
+# net.py
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 10       # seconds to establish a connection
+READ_TIMEOUT = 30          # seconds without data before a connection counts as dropped
+POOL_SIZE = 32             # keep-alive connections kept per host
+RETRIES = 3                # retries for failed connects and 5xx responses
+BACKOFF = 0.5              # retry n waits BACKOFF * 2**(n-1) seconds
+
+DEFAULT_BASE_URL = "https://archive.mozilla.org/pub/firefox/candidates/"
+# Where the candidates tree is fetched from, e.g. a LAN mirror (see mirror.py)
+BASE_URL = os.environ.get("FFBM_BASE_URL") or DEFAULT_BASE_URL
+
+_session = None
+_lock = threading.Lock()
+
+
+def timeout():
+    return CONNECT_TIMEOUT, READ_TIMEOUT
+
+
+def base_url():
+    return BASE_URL if BASE_URL.endswith("/") else BASE_URL + "/"
+
+
+def get_session():
+    """
+    Return the process-wide requests.Session. All archive traffic goes through it, so TCP/TLS
+    connections are kept alive and reused across listing fetches, HEAD probes and downloads,
+    and failed connects or 5xx responses are retried with exponential backoff.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(total=RETRIES, backoff_factor=BACKOFF, status_forcelist=(500, 502, 503, 504),
+                          allowed_methods=("GET", "HEAD"), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def configure(connect_timeout=None, read_timeout=None, pool_size=None, retries=None, backoff=None, base_url=None):
+    """Change the network settings. The session is rebuilt on next use."""
+    global CONNECT_TIMEOUT, READ_TIMEOUT, POOL_SIZE, RETRIES, BACKOFF, BASE_URL, _session
+    with _lock:
+        if base_url is not None:
+            BASE_URL = base_url
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+        if pool_size is not None:
+            POOL_SIZE = pool_size
+        if retries is not None:
+            RETRIES = retries
+        if backoff is not None:
+            BACKOFF = backoff
+        if _session is not None:
+            _session.close()
+            _session = None
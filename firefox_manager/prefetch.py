@@ -0,0 +1,299 @@
+# prefetch.py
+"""
+Opt-in background prefetcher for newly published candidate builds.
+
+Every 'interval' seconds the candidates listing is revalidated (a conditional request, so an
+unchanged listing costs one 304) and the newest versions are checked for new buildN folders.
+For each new build, the configured architecture x language combinations are downloaded into
+the archive cache, so a later "Download & Install" extracts locally with no transfer. With
+'stage' on, they are also extracted into staging/, and installing one of them is a folder rename.
+
+Downloads are paced to 'max_rate' bytes per second, and nothing is fetched that would take the
+prefetched archives and staged builds over 'disk_budget' bytes, or leave less than MIN_FREE
+bytes free on the disk. Settings and what has been seen so far live in prefetch.json.
+"""
+import os
+import json
+import time
+import shutil
+import threading
+from manager import INSTALL_ROOT, get_install_folder
+from atomicfile import atomic_write_json
+import diskspace
+
+CONFIG_FILE = "prefetch.json"
+STAGING_DIR = "staging"            # next to builds/, so a staged build moves in with a rename
+READY_FILE = ".prefetch.json"      # written into a staged folder once its extraction is complete
+POLL_INTERVAL = 30 * 60            # seconds between checks of the archive
+FIRST_POLL_DELAY = 30              # let the application settle before the first check
+RECENT_VERSIONS = 3                # newest versions checked for respins (a new buildN folder)
+DISK_BUDGET = 4 * 1024 * 1024 * 1024
+MIN_FREE = 2 * 1024 * 1024 * 1024  # never prefetch into the last bytes of the disk
+
+DEFAULT_SETTINGS = {
+    "enabled": False,
+    "arches": ["linux-x86_64"],
+    "langs": ["en-US"],
+    "interval": POLL_INTERVAL,
+    "disk_budget": DISK_BUDGET,
+    "max_rate": 0,                 # bytes per second, 0 for no limit
+    "stage": False,
+}
+
+_lock = threading.Lock()
+
+
+class Prefetcher:
+    """Runs poll() on a daemon thread every 'interval' seconds until stop()."""
+
+    def __init__(self, log=print):
+        self.log = log
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        delay = FIRST_POLL_DELAY
+        while not self._stop.wait(delay):
+            settings = load_settings()
+            if not settings["enabled"]:
+                return
+            try:
+                poll(settings, stop=self._stop, log=self.log)
+            except Exception as e:
+                self.log(f"Prefetch check failed: {e}")
+            delay = settings["interval"]
+
+
+def load_settings():
+    with _lock:
+        return _load()["settings"]
+
+
+def configure(**changes):
+    """Change and persist settings (keys of DEFAULT_SETTINGS). None values are left unchanged."""
+    with _lock:
+        state = _load()
+        state["settings"].update({k: v for k, v in changes.items() if v is not None and k in DEFAULT_SETTINGS})
+        _save(state)
+        return dict(state["settings"])
+
+
+def status():
+    with _lock:
+        state = _load()
+    sizes = [(entry, _entry_bytes(entry)) for entry in state["prefetched"]]
+    return {
+        "settings": state["settings"],
+        "known_versions": len(state["known"]),
+        "prefetched": [entry for entry, size in sizes if size],
+        "bytes_used": sum(size for _, size in sizes),
+    }
+
+
+def poll(settings=None, stop=None, log=print):
+    """
+    Check the archive once and prefetch what is new. Returns the entries prefetched.
+    The first check only records what is already published, plus the newest version, so
+    enabling the prefetcher doesn't download the whole archive.
+    """
+    from scraper import get_available_versions
+    from listing import get_links, parse_build_folders
+    from net import base_url
+
+    settings = settings or load_settings()
+    with _lock:
+        state = _load()
+    known = state["known"]
+    first_run = not known
+
+    versions = get_available_versions(max_age=0)
+    new_builds = []
+    for index, version in enumerate(versions):
+        if version in known and index >= RECENT_VERSIONS:
+            continue
+        if first_run and index >= RECENT_VERSIONS:
+            known[version] = None
+            continue
+        builds = parse_build_folders(get_links(f"{base_url()}{version}/", max_age=0))
+        build = builds[-1][1] if builds else None
+        if build and known.get(version) != build and (not first_run or index == 0):
+            new_builds.append((version, build))
+        known[version] = build
+    # Versions pulled from the archive are forgotten, so they count as new if they come back
+    published = set(versions)
+    state["known"] = {v: b for v, b in known.items() if v in published}
+    with _lock:
+        _save(state)
+
+    done = []
+    for version, build in new_builds:
+        log(f"New candidate build: {version} {build}")
+        for arch in settings["arches"]:
+            for lang in settings["langs"]:
+                if stop is not None and stop.is_set():
+                    return done
+                try:
+                    entry = prefetch_build(version, arch, lang, settings, log=log)
+                except Exception as e:
+                    log(f"Could not prefetch {version} ({arch}, {lang}): {e}")
+                    continue
+                if entry:
+                    done.append(entry)
+    return done
+
+
+def prefetch_build(version, arch, lang, settings=None, log=print):
+    """
+    Download one build into the archive cache (and extract it into staging/ if configured),
+    within the disk budget. Returns its entry, or None when it was skipped.
+    """
+    from downloader import forget_resolved, resolve_build, get_expected_checksum, download_build
+    import archive_cache
+
+    settings = settings or load_settings()
+    if os.path.isdir(get_install_folder(version, arch, lang)):
+        return None
+
+    # The listing may just have shown a new buildN folder; don't reuse the previous resolution
+    forget_resolved(version)
+    info = resolve_build(version, arch, lang)
+    expected = get_expected_checksum(info["url"])
+    stage = settings["stage"] and info["format"] in ("zip", "tar.xz", "tar.bz2")
+    staged_path = _staged_path(version, arch, lang)
+    if archive_cache.contains(info["url"], expected) and (not stage or _staged_url(staged_path) == info["url"]):
+        return None
+
+    download_bytes, extract_bytes = diskspace.estimate(info["size"])
+    needed = download_bytes + (extract_bytes if stage else 0)
+    used = status()["bytes_used"]
+    if used + needed > settings["disk_budget"]:
+        log(f"Skipping prefetch of {version} ({arch}, {lang}): over the {settings['disk_budget']} byte budget")
+        return None
+    target_dir = STAGING_DIR if stage else archive_cache.CACHE_DIR
+    os.makedirs(target_dir, exist_ok=True)
+    if shutil.disk_usage(target_dir).free - needed < MIN_FREE:
+        log(f"Skipping prefetch of {version} ({arch}, {lang}): not enough free disk space")
+        return None
+
+    archive_path = download_build(version, arch, lang, max_rate=settings["max_rate"] or None)
+    entry = {"version": version, "arch": arch, "lang": lang, "build": info["build"], "url": info["url"],
+             "archive": archive_path, "staged": None, "prefetched_at": time.time()}
+    if stage:
+        _stage(archive_path, info, staged_path)
+        entry["staged"] = staged_path
+    log(f"Prefetched {version} ({arch}, {lang}){' and staged it' if stage else ''}")
+
+    with _lock:
+        state = _load()
+        state["prefetched"] = [e for e in state["prefetched"]
+                               if (e["version"], e["arch"], e["lang"]) != (version, arch, lang) and _entry_bytes(e)]
+        state["prefetched"].append(entry)
+        _save(state)
+    return entry
+
+
+def is_staged(version, arch, lang, url):
+    """Whether a staged build of exactly this archive is ready to be taken."""
+    return _staged_url(_staged_path(version, arch, lang)) == url
+
+
+def take_staged(version, arch, lang, install_path):
+    """
+    Move a staged build into install_path if one is ready and is still the latest build.
+    Returns True when the build is now installed there. A stale staged build is deleted.
+    """
+    staged_path = _staged_path(version, arch, lang)
+    staged_url = _staged_url(staged_path)
+    if staged_url is None or os.path.exists(install_path):
+        return False
+
+    from downloader import resolve_build
+
+    if resolve_build(version, arch, lang)["url"] != staged_url:
+        shutil.rmtree(staged_path, ignore_errors=True)
+        return False
+    try:
+        os.remove(os.path.join(staged_path, READY_FILE))
+        os.makedirs(os.path.dirname(install_path) or ".", exist_ok=True)
+        os.replace(staged_path, install_path)
+    except OSError as e:
+        # e.g. staging/ and builds/ ended up on different filesystems
+        print(f"Could not use the staged build in {staged_path}: {e}")
+        shutil.rmtree(staged_path, ignore_errors=True)
+        return False
+    return True
+
+
+def _stage(archive_path, info, staged_path):
+    from manager import extract_zip, extract_tar_stream
+
+    # Extract beside the final name and rename it in, so a half-extracted build is never taken
+    tmp_path = staged_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        if info["format"] == "zip":
+            extract_zip(archive_path, tmp_path)
+        else:
+            with open(archive_path, "rb") as f:
+                extract_tar_stream(f, tmp_path, info["format"][len("tar."):])
+        with open(os.path.join(tmp_path, READY_FILE), "w", encoding="utf-8") as f:
+            json.dump({"url": info["url"], "build": info["build"]}, f)
+        shutil.rmtree(staged_path, ignore_errors=True)
+        os.replace(tmp_path, staged_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def _staged_path(version, arch, lang):
+    # Same folder name as the install, so the rename needs no further bookkeeping
+    return os.path.join(STAGING_DIR, os.path.relpath(get_install_folder(version, arch, lang), INSTALL_ROOT))
+
+
+def _staged_url(staged_path):
+    try:
+        with open(os.path.join(staged_path, READY_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["url"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _entry_bytes(entry):
+    """Bytes an entry still holds on disk: its archive, if still cached, and its staged folder."""
+    total = 0
+    try:
+        total += os.path.getsize(entry["archive"])
+    except OSError:
+        pass
+    if entry.get("staged") and _staged_url(entry["staged"]) == entry["url"]:
+        for root, _, files in os.walk(entry["staged"]):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+    return total
+
+
+def _load():
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state["settings"] = {**DEFAULT_SETTINGS, **state.get("settings", {})}
+    state.setdefault("known", {})
+    state.setdefault("prefetched", [])
+    return state
+
+
+def _save(state):
+    atomic_write_json(CONFIG_FILE, state, indent=2)
@@ -0,0 +1,188 @@
+# profiles.py
+"""
+Managed Firefox profiles, one per installed build, cloned from a prepared template.
+
+Without this every build launches with the user's default profile: builds trample each other's
+profile, and a clean profile means paying Firefox's first-run profile creation every time.
+Instead each build gets profiles/<install folder name>, launched with -profile and -no-remote,
+and created by cloning profiles/template. The template is prepared once by starting a build
+headless on an empty profile seeded with TEMPLATE_PREFS (no first-run pages, no default browser
+check), so databases, certificates and the startup cache already exist in every clone.
+
+Files are cloned with reflinks (copy-on-write) where the filesystem supports them and copied
+otherwise. They are never hardlinked: Firefox rewrites its SQLite databases in place, which
+would write through to the template and every other clone.
+"""
+import os
+import time
+import shutil
+import threading
+import subprocess
+import dedup
+import manager
+import trash
+
+PROFILE_ROOT = "profiles"
+TEMPLATE_NAME = "template"
+READY_TIMEOUT = 60          # seconds to wait for a headless Firefox to finish starting
+WARM_UP = 3                 # seconds a template build keeps running after startup to fill its caches
+LOCK_FILES = ("lock", ".parentlock", "parent.lock")
+
+# Written to user.js of every new profile, so a launch lands on a usable window straight away
+TEMPLATE_PREFS = {
+    "browser.shell.checkDefaultBrowser": False,
+    "browser.startup.homepage_override.mstone": "ignore",
+    "browser.aboutwelcome.enabled": False,
+    "browser.aboutConfig.showWarning": False,
+    "datareporting.policy.dataSubmissionPolicyBypassNotification": True,
+    "toolkit.telemetry.reportingpolicy.firstRun": False,
+    "app.normandy.first_run": False,
+    "startup.homepage_welcome_url": "",
+    "startup.homepage_welcome_url.additional": "",
+}
+
+
+def profile_path(install_path):
+    return os.path.join(PROFILE_ROOT, os.path.relpath(os.path.normpath(install_path), manager.INSTALL_ROOT))
+
+
+def template_path():
+    return os.path.join(PROFILE_ROOT, TEMPLATE_NAME)
+
+
+def has_template():
+    return os.path.isdir(template_path())
+
+
+def launch_command(firefox_path, install_path):
+    """Command line that runs a build on its own managed profile, creating the profile if needed."""
+    return [firefox_path, "-profile", os.path.abspath(ensure_profile(install_path)), "-no-remote"]
+
+
+def ensure_profile(install_path):
+    path = profile_path(install_path)
+    if not os.path.isdir(path):
+        _create(path)
+    return path
+
+
+def reset_profile(install_path):
+    """Throw away a build's profile and start again from the template."""
+    path = profile_path(install_path)
+    _discard(path)
+    _create(path)
+    return path
+
+
+def remove_profile(install_path):
+    _discard(profile_path(install_path))
+
+
+def move_profile(old_install_path, new_install_path):
+    """Follow an install folder that was renamed (e.g. a build that updated itself)."""
+    old_path, new_path = profile_path(old_install_path), profile_path(new_install_path)
+    if os.path.isdir(old_path) and not os.path.exists(new_path):
+        os.replace(old_path, new_path)
+
+
+def prepare_template(firefox_path, timeout=READY_TIMEOUT):
+    """
+    (Re)build the template profile by starting firefox_path headless on a seeded empty profile,
+    letting it warm up for WARM_UP seconds and shutting it down. Returns the template path.
+    """
+    path = template_path()
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    _seed(tmp_path)
+    process, _ = start_headless(firefox_path, tmp_path, timeout)
+    try:
+        time.sleep(WARM_UP)
+    finally:
+        stop(process)
+    # A profile that was just used keeps its lock files; clones must not inherit them
+    for name in LOCK_FILES:
+        try:
+            os.remove(os.path.join(tmp_path, name))
+        except OSError:
+            pass
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def start_headless(firefox_path, profile, timeout=READY_TIMEOUT):
+    """
+    Start a build headless on profile and wait until its remote agent is listening, i.e. startup
+    has finished. Returns (process, seconds from spawn to ready).
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [firefox_path, "-headless", "-no-remote", "-profile", os.path.abspath(profile), "--remote-debugging-port", "0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    # A build that hangs without printing anything is killed, which ends the loop below
+    watchdog = threading.Timer(timeout, process.kill)
+    watchdog.start()
+    try:
+        for line in process.stderr:
+            # "WebDriver BiDi listening on ws://..." (older builds: "DevTools listening on ...")
+            if "listening on" in line:
+                ready = time.perf_counter() - start
+                # Keep draining stderr, or Firefox blocks once the pipe is full
+                threading.Thread(target=lambda: all(process.stderr), daemon=True).start()
+                return process, ready
+    finally:
+        watchdog.cancel()
+    stop(process)
+    raise Exception(f"Firefox did not finish starting within {timeout}s: {firefox_path}")
+
+
+def stop(process, timeout=10):
+    """Ask Firefox to quit (it writes out its profile on SIGTERM) and kill it if it doesn't."""
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def clone_tree(src, dst):
+    """Copy a profile folder, using reflinks where the filesystem supports them."""
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            if name in LOCK_FILES:
+                continue
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                continue
+            try:
+                dedup.reflink(source, os.path.join(target, name))
+            except OSError:
+                shutil.copy2(source, os.path.join(target, name))
+
+
+def _create(path):
+    if has_template():
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        clone_tree(template_path(), tmp_path)
+        os.replace(tmp_path, path)
+    else:
+        # No template yet: Firefox creates the rest of the profile on first launch
+        _seed(path)
+
+
+def _discard(path):
+    # Profiles can grow large (caches, session history); delete them in the background
+    if os.path.isdir(path):
+        trash.move_to_trash(path)
+
+
+def _seed(path):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "user.js"), "w", encoding="utf-8") as f:
+        for name, value in TEMPLATE_PREFS.items():
+            literal = ("true" if value else "false") if isinstance(value, bool) else f'"{value}"'
+            f.write(f'user_pref("{name}", {literal});\n')
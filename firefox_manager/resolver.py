@@ -0,0 +1,74 @@
+# resolver.py
+"""
+Concurrent resolution of many builds at once, e.g. the planning stage of a batch install.
+
+Resolving one build is a chain of round trips: the version's listing (for the latest buildN),
+then a HEAD per candidate archive name. resolve_many runs the chains of every requested build
+concurrently on an asyncio event loop:
+
+* builds of the same version share one listing fetch;
+* HEAD probes run concurrently, at most 'limit' requests in flight, and a linux build probes
+  .tar.xz and .tar.bz2 together instead of one after the other;
+* builds already resolved within downloader.RESOLVE_TTL cost nothing.
+
+The requests themselves go through the shared keep-alive session (net.py) on a thread pool,
+so no async HTTP client is needed. Every result lands in the downloader's resolution cache,
+so downloading or installing the planned builds afterwards starts without any lookups.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import downloader
+from tracing import span
+
+CONCURRENCY = 16   # requests in flight at once
+
+
+def resolve_many(builds, limit=CONCURRENCY):
+    """
+    Resolve every (version, arch, lang) in builds. Returns {(version, arch, lang): result}, where
+    result is what downloader.resolve_build returns, or the exception that resolving it raised.
+    """
+    builds = list(dict.fromkeys(builds))
+    with span("resolve_many", builds=len(builds), limit=limit) as s:
+        results = asyncio.run(resolve_many_async(builds, limit))
+        s.set(failed=sum(1 for r in results.values() if isinstance(r, Exception)))
+    return results
+
+
+async def resolve_many_async(builds, limit=CONCURRENCY):
+    """Coroutine form of resolve_many, for callers already running an event loop."""
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(limit)
+    folders = {}        # version -> task fetching its latest build folder
+
+    with ThreadPoolExecutor(max_workers=limit) as pool:
+        async def call(fn, *args):
+            async with slots:
+                return await loop.run_in_executor(pool, fn, *args)
+
+        def build_folder(version):
+            if version not in folders:
+                folders[version] = asyncio.ensure_future(call(downloader.get_latest_build, version))
+            return folders[version]
+
+        async def resolve(version, arch, lang):
+            cached = downloader.cached_resolution(version, arch, lang)
+            if cached:
+                return cached
+            candidates = downloader.candidate_filenames(version, arch)
+            build = await build_folder(version)
+            if not build:
+                raise Exception("No build folder found")
+            folder_url = downloader.build_folder_url(version, build, arch, lang)
+            probes = await asyncio.gather(*(call(downloader.probe_file, folder_url + name) for name in candidates))
+            # The first candidate that exists wins, as in resolve_build; if none does, the last is
+            # kept so the download reports the server's error
+            filename, size = candidates[-1], None
+            for name, (status, length) in zip(candidates, probes):
+                if status == 200:
+                    filename, size = name, length
+                    break
+            return downloader.remember_resolution(version, arch, lang, build, folder_url, filename, size)
+
+        results = await asyncio.gather(*(resolve(*build) for build in builds), return_exceptions=True)
+    return dict(zip(builds, results))
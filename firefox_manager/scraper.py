@@ -1,28 +1,18 @@
 # scraper.py
-import requests
-from bs4 import BeautifulSoup
+from listing import get_links, link_names, parse_build_folders
+from catalog import version_key
+from net import base_url
 
-BASE_URL = "https://archive.mozilla.org/pub/firefox/candidates/"
 
-
-def get_available_versions():
-    response = requests.get(BASE_URL)
-    soup = BeautifulSoup(response.text, "html.parser")
-    versions = []
-
-    for a in soup.find_all("a"):
-        href = a.get("href")
-        if href and href.endswith("-candidates/"):
-            versions.append(href.rstrip("/"))
-
-    return sorted(versions, reverse=True)
+def get_available_versions(max_age=None):
+    """Every '<version>-candidates' folder on the archive, newest version first."""
+    versions = [name for name in link_names(get_links(base_url(), max_age=max_age)) if name.endswith("-candidates")]
+    return sorted(versions, key=version_key, reverse=True)
 
 
 def get_latest_build_folder(version):
-    url = f"{BASE_URL}{version}/"
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
-    builds = [a.text.strip("/") for a in soup.find_all("a") if a.text.startswith("build")]
+    url = f"{base_url()}{version}/"
+    builds = parse_build_folders(get_links(url))
     if builds:
-        return builds[-1]  # get the latest (highest number)
+        return builds[-1][1]  # get the latest (highest number)
     return None
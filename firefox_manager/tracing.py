@@ -0,0 +1,230 @@
+# tracing.py
+"""
+Lightweight per-phase timing. Wrap work in span("name") and nested spans become children of the
+enclosing one on the same thread. When an outermost span (an operation such as an install or a
+refresh) finishes, it is kept in a rolling in-memory history, appended to TRACE_LOG as one JSON
+line, and folded into per-phase totals written to METRICS_FILE in Prometheus textfile format.
+Trivial operations (no phases, a few milliseconds, no error, e.g. a resolve cache hit) only count
+towards the totals, TRACE_LOG is rotated once it reaches TRACE_LOG_MAX_BYTES, and METRICS_FILE is
+rewritten at most every METRICS_INTERVAL seconds (and once more at exit).
+
+    with span("install", version=version):
+        with span("transfer") as s:
+            ...
+            s.add("bytes", len(chunk))
+
+    @traced("extract")
+    def extract(...):
+        ...
+        current_span().set(files=count)
+"""
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from atomicfile import atomic_write_text
+
+TRACE_LOG = "traces.jsonl"      # set to None to disable the JSON-lines log
+TRACE_LOG_MAX_BYTES = 5 * 1024 * 1024  # then it is moved to TRACE_LOG + ".1" and a new log started
+METRICS_FILE = "metrics.prom"   # set to None to disable the Prometheus textfile
+METRICS_INTERVAL = 10           # seconds between rewrites of METRICS_FILE
+TRIVIAL_SECONDS = 0.005         # childless operations quicker than this aren't logged to TRACE_LOG
+HISTORY_SIZE = 100              # finished operations kept in memory
+
+_local = threading.local()
+_lock = threading.Lock()
+_history = deque(maxlen=HISTORY_SIZE)
+_totals = {}                    # span name -> {"count", "errors", "seconds", "bytes", "files", "last_seconds"}
+_metrics_written = 0.0          # time.monotonic() of the last METRICS_FILE write
+_metrics_dirty = False          # _totals changed since then
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.children = []
+        self.started_at = datetime.now().isoformat()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount):
+        """Accumulate a counter such as bytes or files."""
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "seconds": round(self.duration, 6) if self.duration is not None else None,
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class _NullSpan:
+    """Returned by current_span() outside any span, so callers never need a None check."""
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount):
+        pass
+
+
+def current_span():
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else _NullSpan()
+
+
+@contextmanager
+def span(name, **attrs):
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    s = Span(name, attrs)
+    if stack:
+        stack[-1].children.append(s)
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.duration = time.perf_counter() - s.start
+        stack.pop()
+        if not stack:
+            _record(s)
+
+
+def traced(name, **attrs):
+    """Decorator form of span(); the function can reach its span through current_span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def last_operation():
+    with _lock:
+        return _history[-1] if _history else None
+
+
+def history():
+    with _lock:
+        return list(_history)
+
+
+def format_breakdown(root):
+    """Indented, human readable breakdown of an operation and its phases."""
+    if isinstance(root, Span):
+        root = root.to_dict()
+    lines = []
+
+    def walk(node, depth):
+        total = root["seconds"] or 0
+        share = f"{node['seconds'] / total * 100:5.1f}%" if total else "     -"
+        extras = []
+        for key, value in node["attrs"].items():
+            if key == "bytes":
+                value = f"{value / (1024 * 1024):.1f} MB"
+            extras.append(f"{key}={value}")
+        label = f"{'  ' * depth}{node['name']}"
+        lines.append(f"{label:<32} {node['seconds']:9.3f}s {share}  {' '.join(extras)}".rstrip())
+        for child in node["children"]:
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+
+def flush():
+    """Write METRICS_FILE now if the totals changed since it was last written."""
+    global _metrics_written, _metrics_dirty
+    with _lock:
+        if not (METRICS_FILE and _metrics_dirty):
+            return
+        try:
+            _write_metrics()
+        except OSError as e:
+            print(f"Could not write trace output: {e}")
+            return
+        _metrics_written, _metrics_dirty = time.monotonic(), False
+
+
+atexit.register(flush)
+
+
+def _is_trivial(root):
+    return not root.children and "error" not in root.attrs and root.duration < TRIVIAL_SECONDS
+
+
+def _record(root):
+    global _metrics_written, _metrics_dirty
+    with _lock:
+        _history.append(root)
+        _accumulate(root)
+        _metrics_dirty = True
+        try:
+            if TRACE_LOG and not _is_trivial(root):
+                with open(TRACE_LOG, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(root.to_dict()) + "\n")
+                    size = f.tell()
+                if size >= TRACE_LOG_MAX_BYTES:
+                    os.replace(TRACE_LOG, TRACE_LOG + ".1")
+            now = time.monotonic()
+            if METRICS_FILE and now - _metrics_written >= METRICS_INTERVAL:
+                _write_metrics()
+                _metrics_written, _metrics_dirty = now, False
+        except OSError as e:
+            # Tracing must never break the operation it measures
+            print(f"Could not write trace output: {e}")
+
+
+def _accumulate(node):
+    totals = _totals.setdefault(node.name, {"count": 0, "errors": 0, "seconds": 0.0, "bytes": 0, "files": 0,
+                                            "last_seconds": 0.0})
+    totals["count"] += 1
+    totals["seconds"] += node.duration
+    totals["last_seconds"] = node.duration
+    if "error" in node.attrs:
+        totals["errors"] += 1
+    for key in ("bytes", "files"):
+        if isinstance(node.attrs.get(key), (int, float)):
+            totals[key] += node.attrs[key]
+    for child in node.children:
+        _accumulate(child)
+
+
+def _write_metrics():
+    # Counts and bytes are exact integers; durations keep full float precision
+    metrics = [
+        ("ffbm_span_count_total", "counter", "Completed spans per phase.", "count"),
+        ("ffbm_span_errors_total", "counter", "Spans per phase that ended with an error.", "errors"),
+        ("ffbm_span_seconds_total", "counter", "Total seconds spent per phase.", "seconds"),
+        ("ffbm_span_bytes_total", "counter", "Bytes processed per phase.", "bytes"),
+        ("ffbm_span_files_total", "counter", "Files processed per phase.", "files"),
+        ("ffbm_span_last_seconds", "gauge", "Duration of the most recent span per phase.", "last_seconds"),
+    ]
+    lines = []
+    for metric, kind, help_text, key in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name in sorted(_totals):
+            value = _totals[name][key]
+            value = repr(float(value)) if key.endswith("seconds") else int(value)
+            lines.append(f'{metric}{{span="{name}"}} {value}')
+    # node_exporter may read the file at any moment
+    atomic_write_text(METRICS_FILE, "\n".join(lines) + "\n")
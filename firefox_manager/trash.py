@@ -0,0 +1,81 @@
+# trash.py
+"""
+Instant removal of large folders: the folder is renamed into a .trash folder beside it, which is
+atomic and immediate because it never leaves the filesystem, and the actual deletion happens on a
+background thread. A removal therefore either happened completely or not at all as far as the rest
+of the program can see; the trash holds only folders nobody refers to any more. Whatever is left
+in a trash folder when the program exits is deleted by purge() on the next start.
+"""
+import os
+import time
+import queue
+import shutil
+import threading
+
+TRASH_NAME = ".trash"
+
+_queue = queue.Queue()
+_worker = None
+_lock = threading.Lock()
+_idle = threading.Condition(_lock)
+_pending = 0
+
+
+def move_to_trash(path, root=None):
+    """
+    Rename path into the trash beside it (or in root's trash, which must be on the same
+    filesystem) and schedule its deletion. Returns the trashed path.
+    """
+    path = os.path.normpath(path)
+    trash_dir = os.path.join(root if root is not None else os.path.dirname(path), TRASH_NAME)
+    os.makedirs(trash_dir, exist_ok=True)
+    # Unique, so removing a build, reinstalling it and removing it again never collides
+    trashed = os.path.join(trash_dir, f"{os.path.basename(path)}-{time.time_ns()}")
+    os.replace(path, trashed)
+    _schedule(trashed)
+    return trashed
+
+
+def purge(root):
+    """Schedule deletion of anything left in root's trash by an earlier run."""
+    trash_dir = os.path.join(root, TRASH_NAME)
+    try:
+        names = os.listdir(trash_dir)
+    except OSError:
+        return 0
+    for name in names:
+        _schedule(os.path.join(trash_dir, name))
+    return len(names)
+
+
+def wait(timeout=None):
+    """Block until every scheduled deletion is done (e.g. before exiting a CLI command)."""
+    with _idle:
+        return _idle.wait_for(lambda: _pending == 0, timeout)
+
+
+def _schedule(path):
+    global _worker, _pending
+    with _lock:
+        _pending += 1
+        if _worker is None:
+            _worker = threading.Thread(target=_run, daemon=True)
+            _worker.start()
+    _queue.put(path)
+
+
+def _run():
+    global _pending
+    while True:
+        path = _queue.get()
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            # Left for purge() on the next start
+            print(f"Could not delete {path}: {e}")
+        with _idle:
+            _pending -= 1
+            _idle.notify_all()
@@ -1,31 +1,26 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
-from downloader import download_build
-from manager import (extract_zip, extract_tar_bz2, extract_tar_xz, install_dmg,
-                   add_install_record, get_install_folder, load_db, save_db)
+from manager import (INSTALL_ROOT, get_install_folder, get_exec_path, load_db, find_install_record,
+                     remove_install_record, verify_installs, list_install_status, sync_install, reconcile_installs)
+from jobs import JobScheduler, DEFAULT_CONCURRENCY
+from build_index import BuildIndex, row_id
+import dedup
+import profiles
+import manifest
+import trash
+from watcher import BuildWatcher
+import catalog
+from tracing import span, traced, history, format_breakdown
 import os
 import subprocess
-import shutil
+import threading
 import webbrowser
-import re
-import platform
+from concurrent.futures import ThreadPoolExecutor
 
 ARCHITECTURES = ["win64", "win32", "mac", "linux-x86_64"]
-
-
-def get_actual_firefox_version(firefox_path):
-    try:
-        # Ensure the executable exists before trying to run it
-        if not os.path.isfile(firefox_path):
-            return None
-        result = subprocess.run([firefox_path, "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
-                                timeout=5, creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
-        match = re.search(r"Mozilla Firefox (\S+)", result.stdout)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        print(f"Could not get Firefox version from {firefox_path}: {e}")
-    return None
+JOB_POLL_MS = 100
+TRACE_VIEW_COUNT = 10   # operations shown by "Last Operations"
+AUTOCOMPLETE_LIMIT = 30
 
 
 class FirefoxManagerApp(tk.Tk):
@@ -34,9 +29,9 @@ class FirefoxManagerApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Firefox Build Manager")
-        self.geometry("720x450")
+        self.geometry("760x500")
         self.resizable(True, True)
-        self.minsize(720, 400)
+        self.minsize(760, 450)
 
         # Configure ttk styles to add a border to the Treeview header
         style = ttk.Style(self)
@@ -47,17 +42,64 @@ class FirefoxManagerApp(tk.Tk):
         self.selected_arch = tk.StringVar(value=ARCHITECTURES[0])
         self.language_code = tk.StringVar(value="en-US")
         self.no_update = tk.BooleanVar(value=False)
+        self.concurrency = tk.StringVar(value=str(DEFAULT_CONCURRENCY))
+        self.scheduler = JobScheduler(DEFAULT_CONCURRENCY)
+        self.search_text = tk.StringVar()
+
+        # Installed builds as last seen on disk, newest first. The Treeview only ever receives diffs.
+        self.index = BuildIndex()
+        self.build_order = []
+        self._status_pool = ThreadPoolExecutor(max_workers=1)
+        self._status_future = None
+        self._refresh_again = False
+        self._background = []           # (future, callback) of status-worker tasks _poll_jobs finishes
+        self._disk_changed = threading.Event()
+
+        self.watcher = BuildWatcher(INSTALL_ROOT, self._on_disk_change)
+        self.prefetcher = None
 
         self.create_widgets()
         self.create_installed_builds_section()
-        self.verify_and_clean_installs(silent=True)
+        # First paint comes straight from the recorded state in the database, without touching the
+        # disk or the network. Watching and reconciling with the disk start once the window is up.
+        self._apply_statuses(list_install_status())
+        self.after_idle(self._start_background_work)
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.after(JOB_POLL_MS, self._poll_jobs)
+
+    def _start_background_work(self):
+        # Finish deleting whatever an earlier session removed but didn't get to delete
+        trash.purge(INSTALL_ROOT)
+        trash.purge(profiles.PROFILE_ROOT)
+        trash.purge(dedup.OBJECT_DIR)
+        self.watcher.start()
+        self._status_pool.submit(self._reconcile_and_watch)
+        self._refresh_catalog()
+        # Opt-in, see "python cli.py prefetch --enable"
+        import prefetch
+        if prefetch.load_settings()["enabled"]:
+            self.prefetcher = prefetch.Prefetcher()
+            self.prefetcher.start()
+
+    def _refresh_catalog(self):
+        """Update the version catalog from the archive on a background thread."""
+        def run():
+            try:
+                catalog.refresh()
+            except Exception as e:
+                print(f"Could not refresh the version catalog: {e}")
+        threading.Thread(target=run, daemon=True).start()
 
     def create_widgets(self):
         input_frame = ttk.LabelFrame(self, text="Firefox Build Configuration")
         input_frame.pack(fill="x", padx=10, pady=10)
 
         ttk.Label(input_frame, text="Version:").grid(row=0, column=0, padx=(10, 5), pady=10, sticky="e")
-        ttk.Entry(input_frame, textvariable=self.manual_version, width=25).grid(row=0, column=1, padx=5, pady=10)
+        # Suggestions come from the local version catalog; press Down to pick one
+        self.version_box = ttk.Combobox(input_frame, textvariable=self.manual_version, width=25,
+                                        postcommand=self._update_version_suggestions)
+        self.version_box.grid(row=0, column=1, padx=5, pady=10)
+        self.version_box.bind("<KeyRelease>", lambda e: self._update_version_suggestions())
 
         ttk.Label(input_frame, text="Architecture:").grid(row=0, column=2, padx=(10, 5), pady=10, sticky="e")
         ttk.Combobox(input_frame, textvariable=self.selected_arch, values=ARCHITECTURES, state="readonly",
@@ -66,10 +108,13 @@ class FirefoxManagerApp(tk.Tk):
         ttk.Label(input_frame, text="Language:").grid(row=0, column=4, padx=(10, 5), pady=10, sticky="e")
         ttk.Entry(input_frame, textvariable=self.language_code, width=15).grid(row=0, column=5, padx=(5, 10), pady=10)
 
-        # Add the checkbox and center it by spanning all columns in its own row
-        ttk.Checkbutton(input_frame, text="Disable Updates", variable=self.no_update).grid(row=1, column=0,
-                                                                                                   columnspan=6,
-                                                                                                   pady=(0, 10))
+        # Add the checkbox and the parallel download limit, centered in their own row
+        options_frame = ttk.Frame(input_frame)
+        options_frame.grid(row=1, column=0, columnspan=6, pady=(0, 10))
+        ttk.Checkbutton(options_frame, text="Disable Updates", variable=self.no_update).pack(side="left", padx=10)
+        ttk.Label(options_frame, text="Parallel downloads:").pack(side="left", padx=(10, 5))
+        ttk.Spinbox(options_frame, from_=1, to=16, width=4, textvariable=self.concurrency).pack(side="left")
+        self.concurrency.trace_add("write", lambda *_: self._on_concurrency_change())
         input_frame.grid_columnconfigure(1, weight=1)
         input_frame.grid_columnconfigure(3, weight=1)
         input_frame.grid_columnconfigure(5, weight=1)
@@ -85,72 +130,112 @@ class FirefoxManagerApp(tk.Tk):
             messagebox.showwarning("Missing Version", "Please enter a version (e.g. 128.0b3)")
             return
 
+        # Reject typos locally instead of with a failed request; an empty catalog (never fetched) checks nothing
+        if catalog.versions() and not catalog.contains(version):
+            suggestions = catalog.complete(version.split(".")[0], limit=5)
+            hint = f"\n\nDid you mean: {', '.join(suggestions)}?" if suggestions else ""
+            messagebox.showwarning("Unknown Version",
+                                   f"{version} is not in the list of candidate builds.{hint}")
+            # It may have been published since the catalog was last refreshed
+            self._refresh_catalog()
+            return
+
         if not version.endswith("-candidates"):
             version += "-candidates"
 
-        # Check if this exact build is already installed
-        for entry in load_db():
-            if (entry["version"] == version and entry["arch"] == arch and entry["language"] == lang):
-                install_path = get_install_folder(entry["version"], entry["arch"], entry["language"])
-                if os.path.isdir(install_path):
-                    messagebox.showinfo("Already Installed", f"This build ({version}) is already installed.")
-                    return
+        # Check if this exact build is already installed (queued duplicates are merged by the scheduler)
+        if find_install_record(version, arch, lang) and os.path.isdir(get_install_folder(version, arch, lang)):
+            messagebox.showinfo("Already Installed", f"This build ({version}) is already installed.")
+            return
 
-        try:
-            self.title(f"Downloading {version}...")
-            self.progress_frame.pack(pady=5, padx=10, fill="x")
-            self.progress["value"] = 0
-            self.update_idletasks()
-
-            zip_path = download_build(version, arch, lang, dest_folder="downloads",
-                                      progress_callback=self.update_progress)
-
-            install_path = get_install_folder(version, arch, lang)
-            extracted = False
-
-            if zip_path.endswith(".zip"):
-                os.makedirs(install_path, exist_ok=True)
-                extract_zip(zip_path, install_path)
-                extracted = True
-            elif zip_path.endswith(".tar.bz2"):
-                os.makedirs(install_path, exist_ok=True)
-                extract_tar_bz2(zip_path, install_path)
-                extracted = True
-            elif zip_path.endswith(".tar.xz"):
-                os.makedirs(install_path, exist_ok=True)
-                extract_tar_xz(zip_path, install_path)
-                extracted = True
-            elif zip_path.endswith(".dmg") and platform.system() == "Darwin":
-                os.makedirs(install_path, exist_ok=True)
-                install_dmg(zip_path, install_path)
-                extracted = True
-
-            if extracted:
-                # If "Disable Updates" is checked, modify the channel preferences
-                if self.no_update.get():
-                    self._apply_update_channel_modification(install_path, arch)
-
-                add_install_record(version, arch, lang, install_path)
-                messagebox.showinfo("Done", f"Successfully installed to:\n{install_path}")
-            else:
-                messagebox.showinfo("Downloaded",
-                                    f"Build downloaded but not installed (unsupported format).\nSaved to:\n{zip_path}")
+        job = self.scheduler.submit(version, arch, lang, no_update=self.no_update.get())
+        if not self.installed_tree.exists(self._job_row(job)):
+            self.installed_tree.insert("", 0, iid=self._job_row(job), tags=("job",),
+                                       values=(version, arch, lang, "Queued"))
 
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-        finally:
-            self.progress_frame.pack_forget()
-            self.title("Firefox Build Manager")
+    def _update_version_suggestions(self):
+        self.version_box.configure(values=catalog.complete(self.manual_version.get(), limit=AUTOCOMPLETE_LIMIT))
+
+    def _job_row(self, job):
+        return f"job-{job.job_id}"
+
+    def _poll_jobs(self):
+        """
+        Apply progress posted by the scheduler's workers and any finished status refresh.
+        Runs on the Tk main loop every JOB_POLL_MS.
+        """
+        self._apply_refresh_result()
+        self._apply_background_results()
+        if self._disk_changed.is_set():
+            self._disk_changed.clear()
             self.refresh_installed_builds()
+        finished = False
+        for event, job in self.scheduler.poll_events():
+            row = self._job_row(job)
+            if event in ("phase", "progress") and self.installed_tree.exists(row):
+                status = job.phase.capitalize()
+                if job.phase == "downloading":
+                    status += f" {int(job.percent)}%"
+                self.installed_tree.set(row, "status", status)
+            elif event in ("done", "failed", "cancelled"):
+                if self.installed_tree.exists(row):
+                    self.installed_tree.delete(row)
+                finished = True
+                if event == "done":
+                    self.watcher.track(job.result)
+                if event == "failed":
+                    messagebox.showerror("Error", f"{job.version} ({job.arch}, {job.lang}):\n{job.error}")
+        if finished:
+            self.scheduler.forget_finished()
+            self.refresh_installed_builds()
+        self.after(JOB_POLL_MS, self._poll_jobs)
+
+    def cancel_selected_job(self):
+        selection = self.installed_tree.selection()
+        if not selection or not selection[0].startswith("job-"):
+            messagebox.showwarning("No Job Selected", "Please select a queued or running download from the list.")
+            return
+        if self.scheduler.cancel(int(selection[0][len("job-"):])):
+            self.installed_tree.set(selection[0], "status", "Cancelling...")
+
+    def _on_concurrency_change(self):
+        try:
+            self.scheduler.set_concurrency(int(self.concurrency.get()))
+        except (ValueError, tk.TclError):
+            pass
+
+    def _on_disk_change(self, install_path):
+        """Called on the watcher's thread when something happened to a build folder."""
+        if sync_install(install_path):
+            self._disk_changed.set()
+
+    def _reconcile_and_watch(self):
+        """Startup pass on the status worker: catch changes made while the app was closed."""
+        if reconcile_installs():
+            self._disk_changed.set()
+        for entry in load_db():
+            self.watcher.track(entry["install_path"])
 
-    def update_progress(self, percent):
-        self.progress["value"] = percent
-        self.update_idletasks()
+    def _on_close(self):
+        self.scheduler.shutdown()
+        self.watcher.stop()
+        if self.prefetcher:
+            self.prefetcher.stop()
+        self._status_pool.shutdown(wait=False)
+        self.destroy()
 
     def create_installed_builds_section(self):
         section = ttk.LabelFrame(self, text="Installed Builds")
         section.pack(fill="both", expand=True, padx=10, pady=(0, 10))
 
+        filter_frame = ttk.Frame(section)
+        filter_frame.pack(side="top", fill="x", padx=5, pady=(5, 0))
+        ttk.Label(filter_frame, text="Filter:").pack(side="left")
+        ttk.Entry(filter_frame, textvariable=self.search_text, width=30).pack(side="left", padx=5)
+        self.match_label = ttk.Label(filter_frame, text="")
+        self.match_label.pack(side="right")
+        self.search_text.trace_add("write", lambda *_: self._apply_filter())
+
         self.installed_tree = ttk.Treeview(section, columns=self.COLUMNS, show="headings", height=5)
         for col in self.COLUMNS:
             heading_text = col.replace("_", " ").capitalize()
@@ -168,51 +253,93 @@ class FirefoxManagerApp(tk.Tk):
 
         ttk.Button(self.btn_frame, text="Launch", command=self.launch_selected).pack(side="left", padx=5)
         ttk.Button(self.btn_frame, text="Open Folder", command=self.open_selected_folder).pack(side="left", padx=5)
+        ttk.Button(self.btn_frame, text="Reset Profile", command=self.reset_selected_profile).pack(side="left", padx=5)
+        ttk.Button(self.btn_frame, text="Cancel Download", command=self.cancel_selected_job).pack(side="left", padx=5)
+        ttk.Button(self.btn_frame, text="Last Operations", command=self.show_last_operations).pack(side="left", padx=5)
 
         ttk.Button(self.btn_frame, text="Remove", command=self.remove_selected).pack(side="right", padx=5)
         ttk.Button(self.btn_frame, text="Refresh List", command=self.verify_and_clean_installs).pack(side="right",
                                                                                                      padx=5)
 
-        self.progress_frame = ttk.Frame(self)
-        self.progress = ttk.Progressbar(self.progress_frame, orient="horizontal", mode="determinate")
-        self.progress.pack(fill="x", expand=True, padx=5, pady=(0, 5))
-
     def refresh_installed_builds(self):
-        # Clear the treeview
-        for row in self.installed_tree.get_children():
-            self.installed_tree.delete(row)
+        """
+        Re-read the database and check every install folder on a worker thread. The result is
+        applied by _poll_jobs. Requests made while a check is running are coalesced into one more.
+        """
+        if self._status_future and not self._status_future.done():
+            self._refresh_again = True
+            return
+        self._status_future = self._status_pool.submit(list_install_status)
 
-        # Repopulate from the database, reversing the list so newest appears first
-        for entry in reversed(load_db()):
-            install_path = get_install_folder(entry["version"], entry["arch"], entry["language"])
-            status = "Installed ✔️" if os.path.isdir(install_path) else "Missing"
-            self.installed_tree.insert("", "end", values=(entry["version"], entry["arch"], entry["language"], status))
+    def _apply_refresh_result(self):
+        future = self._status_future
+        if future is None or not future.done():
+            return
+        self._status_future = None
+        if self._refresh_again:
+            self._refresh_again = False
+            self.refresh_installed_builds()
+        try:
+            statuses = future.result()
+        except Exception as e:
+            print(f"Could not refresh the installed builds: {e}")
+            return
+        self._apply_statuses(statuses)
+
+    def _run_in_background(self, fn, callback):
+        """Run fn on the status worker; _poll_jobs hands its future to callback on the Tk thread."""
+        self._background.append((self._status_pool.submit(fn), callback))
+
+    def _apply_background_results(self):
+        done = [(future, callback) for future, callback in self._background if future.done()]
+        for item in done:
+            self._background.remove(item)
+        for future, callback in done:
+            callback(future)
+
+    def _apply_statuses(self, statuses):
+        # Diff against the index: only rows that appeared, vanished or changed status touch the Treeview
+        order = []
+        for version, arch, lang, present in reversed(statuses):
+            rid = row_id(version, arch, lang)
+            order.append(rid)
+            values = (version, arch, lang, "Installed ✔️" if present else "Missing")
+            if self.index.put(rid, values) and self.installed_tree.exists(rid):
+                self.installed_tree.item(rid, values=values)
+        for rid in set(self.index.rows).difference(order):
+            self._drop_row(rid)
+        self.build_order = order
+        self._apply_filter()
+
+    def _apply_filter(self):
+        """Show the job rows, then the builds matching the filter, newest first."""
+        tree = self.installed_tree
+        matches = self.index.search(self.search_text.get())
+        jobs = [row for row in tree.get_children() if row.startswith("job-")]
+        wanted = jobs + [rid for rid in self.build_order if rid in matches]
+        for rid in wanted[len(jobs):]:
+            if not tree.exists(rid):
+                tree.insert("", "end", iid=rid, values=self.index.rows[rid])
+        # One call reorders the visible rows and detaches (but keeps) the filtered out ones
+        if tree.get_children() != tuple(wanted):
+            tree.set_children("", *wanted)
+        self.match_label.configure(text=f"{len(wanted) - len(jobs)} of {len(self.index)} builds")
+
+    def _drop_row(self, rid):
+        self.index.remove(rid)
+        if self.installed_tree.exists(rid):
+            self.installed_tree.delete(rid)
 
     def _get_selected_build_info(self):
         selection = self.installed_tree.selection()
         if not selection:
             messagebox.showwarning("No Selection", "Please select a build from the list.")
             return None
+        if selection[0].startswith("job-"):
+            messagebox.showinfo("Still Installing", "This build is still being downloaded.")
+            return None
         return self.installed_tree.item(selection[0], "values")
 
-    def _get_exec_path(self, install_path, arch):
-        """Helper to get the platform-specific executable path."""
-        if "win" in arch:
-            return os.path.join(install_path, "firefox", "firefox.exe")
-        elif "mac" in arch:
-            return os.path.join(install_path, "Firefox.app", "Contents", "MacOS", "firefox")
-        else:  # linux
-            return os.path.join(install_path, "firefox", "firefox")
-
-    def _get_channel_prefs_path(self, install_path, arch):
-        """Helper to get the platform-specific channel-prefs.js path."""
-        if "win" in arch or "linux" in arch:
-            return os.path.join(install_path, "firefox", "defaults", "pref", "channel-prefs.js")
-        elif "mac" in arch:
-            # On macOS, prefs are inside the app bundle's Resources directory
-            return os.path.join(install_path, "Firefox.app", "Contents", "Resources", "defaults", "pref", "channel-prefs.js")
-        return None
-
     def launch_selected(self):
         values = self._get_selected_build_info()
         if not values:
@@ -229,7 +356,7 @@ class FirefoxManagerApp(tk.Tk):
             return
 
         install_path = get_install_folder(version, arch, lang)
-        firefox_path = self._get_exec_path(install_path, arch)
+        firefox_path = get_exec_path(install_path, arch)
 
         if not os.path.isfile(firefox_path):
             messagebox.showinfo("Auto-Removing Corrupt Build",
@@ -240,7 +367,60 @@ class FirefoxManagerApp(tk.Tk):
                 messagebox.showerror("Error", f"Failed to auto-remove the build: {e}")
             return
 
-        subprocess.Popen([firefox_path])
+        # Each build runs on its own profile, cloned from the template on first launch; cloning copies
+        # a whole profile, so it happens on the status worker and Firefox starts from the callback
+        def prepare():
+            with span("launch", version=version, arch=arch, lang=lang):
+                return profiles.launch_command(firefox_path, install_path)
+        self._run_in_background(prepare, self._start_firefox)
+
+    def _start_firefox(self, future):
+        try:
+            subprocess.Popen(future.result())
+        except Exception as e:
+            messagebox.showerror("Launch Failed", str(e))
+
+    def reset_selected_profile(self):
+        values = self._get_selected_build_info()
+        if not values:
+            return
+        version, arch, lang, _ = values
+        install_path = get_install_folder(version, arch, lang)
+
+        prepare = False
+        if not profiles.has_template():
+            firefox_path = get_exec_path(install_path, arch)
+            prepare = os.path.isfile(firefox_path) and messagebox.askyesno(
+                "No Profile Template",
+                "There is no profile template yet. Prepare one from this build now?\n"
+                "It starts the build in the background for a few seconds.")
+        elif not messagebox.askyesno("Reset Profile",
+                                     f"Replace the profile of {version} ({arch}, {lang}) with a fresh copy "
+                                     "of the template? Its history, bookmarks and settings will be lost."):
+            return
+
+        # Preparing a template takes seconds, so it runs off the Tk thread, which polls for the outcome
+        outcome = {}
+
+        def run():
+            try:
+                if prepare:
+                    profiles.prepare_template(firefox_path)
+                profiles.reset_profile(install_path)
+                outcome["error"] = None
+            except Exception as e:
+                outcome["error"] = str(e)
+
+        def report():
+            if "error" not in outcome:
+                self.after(JOB_POLL_MS, report)
+            elif outcome["error"]:
+                messagebox.showerror("Error", f"Failed to reset the profile: {outcome['error']}")
+            else:
+                messagebox.showinfo("Profile Reset", f"{version} ({arch}, {lang}) will start on a fresh profile.")
+
+        threading.Thread(target=run, daemon=True).start()
+        self.after(JOB_POLL_MS, report)
 
     def open_selected_folder(self):
         values = self._get_selected_build_info()
@@ -254,52 +434,6 @@ class FirefoxManagerApp(tk.Tk):
             return
         webbrowser.open(folder)
 
-    def _apply_update_channel_modification(self, install_path, arch):
-        """
-        Modifies the channel preference in channel-prefs.js for a new installation.
-        This is triggered when 'Disable Updates' is checked. It inserts '333'
-        into the channel name to effectively break the update URL.
-        e.g., "release" becomes "releas333e", "beta" becomes "bet333a".
-        """
-        prefs_file = self._get_channel_prefs_path(install_path, arch)
-
-        if not prefs_file or not os.path.exists(prefs_file):
-            print(f"Warning: Could not find channel-prefs.js for modification at {prefs_file}")
-            return
-
-        try:
-            with open(prefs_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            new_lines = []
-            modified = False
-            pattern = re.compile(r'(pref\("app\.update\.channel", ")([^"]+)("\);)')
-
-            for line in lines:
-                match = pattern.search(line)
-                if match:
-                    channel = match.group(2)
-                    # This check is a safeguard, but unlikely to be needed on a fresh install
-                    if '333' in channel:
-                        new_lines.append(line)
-                        continue
-
-                    new_channel = f"{channel[:-1]}333{channel[-1]}" if len(channel) > 1 else f"{channel}333"
-                    new_lines.append(pattern.sub(rf'\g<1>{new_channel}\g<3>', line))
-                    modified = True
-                else:
-                    new_lines.append(line)
-
-            if modified:
-                with open(prefs_file, 'w', encoding='utf-8') as f:
-                    f.writelines(new_lines)
-                print(f"Successfully modified update channel in {os.path.basename(prefs_file)}.")
-            else:
-                print(f"Warning: Could not find channel preference line to modify in {prefs_file}.")
-        except Exception as e:
-            # Using print instead of messagebox to avoid disrupting the install flow
-            print(f"An error occurred during channel modification: {e}")
-
     def remove_selected(self):
         values = self._get_selected_build_info()
         if not values:
@@ -313,72 +447,102 @@ class FirefoxManagerApp(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to remove the build: {e}")
 
-    def verify_and_clean_installs(self, silent=False):
-        db_entries = load_db()
-        if not db_entries and silent:
-            self.refresh_installed_builds()
-            return
+    def verify_and_clean_installs(self):
+        """Refresh List: check every build and its files on the status worker, never the Tk thread."""
+        self._run_in_background(self._verify_all, self._show_verify_result)
 
-        updated_db = []
-        removed_count = 0
-        updated_count = 0
-
-        for entry in db_entries:
-            current_install_path = get_install_folder(entry["version"], entry["arch"], entry["language"])
-
-            if not os.path.isdir(current_install_path):
-                removed_count += 1
-                continue  # Skip to next entry, it will be removed from the DB
-
-            # Folder exists, check for version updates
-            firefox_exec = self._get_exec_path(current_install_path, entry["arch"])
-            actual_version = get_actual_firefox_version(firefox_exec)
-
-            if actual_version and actual_version != entry["version"]:
-                # Version has changed, we need to rename the folder and update the DB
-                new_install_path = get_install_folder(actual_version, entry["arch"], entry["language"])
-                try:
-                    print(f"Updating version for {entry['version']} -> {actual_version}")
-                    # Rename the folder to match the new version
-                    os.rename(current_install_path, new_install_path)
-
-                    # Update the entry's version to the new one
-                    entry["version"] = actual_version
-                    entry["install_path"] = new_install_path
-                    updated_count += 1
-                except OSError as e:
-                    print(f"Error renaming folder for {entry['version']}: {e}. Skipping update for this entry.")
-
-            updated_db.append(entry)
-
-        # Save the database if any changes were made
-        if removed_count > 0 or updated_count > 0:
-            save_db(updated_db)
-
-        # Show a summary message if not in silent mode
-        if not silent:
-            messages = []
-            if removed_count > 0:
-                messages.append(f"Removed {removed_count} missing build(s).")
-            if updated_count > 0:
-                messages.append(f"Updated {updated_count} build(s) to their current version.")
-
-            if messages:
-                messagebox.showinfo("Refresh Complete", "\n".join(messages))
-            else:
-                messagebox.showinfo("Refresh Complete", "All build installations are verified.")
+    def _verify_all(self):
+        db_entries = load_db()
+        with span("refresh", builds=len(db_entries)):
+            removed_count, updated_count = verify_installs(db_entries)
+            # Only files whose stat data changed since install are hashed
+            reports = manifest.verify([entry["install_path"] for entry in load_db()])
+        return removed_count, updated_count, reports
 
+    def _show_verify_result(self, future):
+        try:
+            removed_count, updated_count, reports = future.result()
+        except Exception as e:
+            messagebox.showerror("Refresh Failed", str(e))
+            return
         self.refresh_installed_builds()
 
+        damaged = {path: report for path, report in reports.items() if report and not report["ok"]}
+        if damaged:
+            lines = [f"{os.path.basename(path)}: {len(r['missing'])} missing, {len(r['damaged'])} damaged file(s)"
+                     for path, r in damaged.items()]
+            if messagebox.askyesno("Damaged Builds", "\n".join(lines) + "\n\nRepair them from their archives?"):
+                self._repair_builds(damaged)
+
+        messages = []
+        if removed_count > 0:
+            messages.append(f"Removed {removed_count} missing build(s).")
+        if updated_count > 0:
+            messages.append(f"Updated {updated_count} build(s) to their current version.")
+
+        if messages:
+            messagebox.showinfo("Refresh Complete", "\n".join(messages))
+        else:
+            messagebox.showinfo("Refresh Complete", "All build installations are verified.")
+
+    def _repair_builds(self, reports):
+        # Repairing may download archives; keep it off the Tk thread too
+        self._run_in_background(lambda: self._repair_all(reports),
+                                lambda future: self._show_repair_result(len(reports), future.result()))
+
+    def _repair_all(self, reports):
+        failed = []
+        for install_path, report in reports.items():
+            try:
+                result = manifest.repair(install_path, report)
+                failed += [f"{os.path.basename(install_path)}: {relpath}" for relpath in result["failed"]]
+            except Exception as e:
+                failed.append(f"{os.path.basename(install_path)}: {e}")
+        return failed
+
+    def _show_repair_result(self, count, failed):
+        if failed:
+            messagebox.showerror("Repair Incomplete", "Could not repair:\n" + "\n".join(failed[:20]))
+        else:
+            messagebox.showinfo("Repair Complete", f"Repaired {count} build(s).")
+
+    def show_last_operations(self):
+        """Timing breakdown of the most recent operations, newest first."""
+        operations = history()[-TRACE_VIEW_COUNT:]
+        window = tk.Toplevel(self)
+        window.title("Last Operations")
+        window.geometry("720x400")
+        text = tk.Text(window, wrap="none", font="TkFixedFont")
+        scrollbar = ttk.Scrollbar(window, orient="vertical", command=text.yview)
+        text.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        text.pack(fill="both", expand=True)
+        if not operations:
+            text.insert("end", "No operations recorded yet.")
+        for op in reversed(operations):
+            text.insert("end", f"{op.started_at}\n{format_breakdown(op)}\n\n")
+        text.configure(state="disabled")
+
+    @traced("remove")
     def _remove_entry(self, version, arch, lang):
         folder = get_install_folder(version, arch, lang)
         if os.path.isdir(folder):
-            shutil.rmtree(folder)
-
-        # Create a new list excluding the entry to be removed
-        db = [e for e in load_db() if not (e["version"] == version and e["arch"] == arch and e["language"] == lang)]
-        save_db(db)
-        self.refresh_installed_builds()
+            # The rename is instant; the files are deleted on a background thread
+            with span("move_to_trash"):
+                trash.move_to_trash(folder)
+
+        remove_install_record(version, arch, lang)
+        profiles.remove_profile(folder)
+        manifest.remove(folder)
+        # Objects still linked from other builds stay; the rest of this build's objects go to the
+        # trash as well
+        with span("release_objects"):
+            dedup.release_install(folder)
+        rid = row_id(version, arch, lang)
+        self._drop_row(rid)
+        if rid in self.build_order:
+            self.build_order.remove(rid)
+        self._apply_filter()
 
 
 if __name__ == "__main__":
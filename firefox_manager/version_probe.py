@@ -0,0 +1,118 @@
+# version_probe.py
+import os
+import re
+import json
+import threading
+import subprocess
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+from atomicfile import atomic_write_json
+
+CACHE_FILE = "version_cache.json"
+PROBE_WORKERS = 8         # concurrent 'firefox --version' processes
+PROBE_TIMEOUT = 5
+
+_cache = None
+_lock = threading.Lock()
+
+
+def get_actual_firefox_version(firefox_path):
+    """Return the version of the Firefox executable at firefox_path, or None if it can't be determined."""
+    return probe_versions([firefox_path])[firefox_path]
+
+
+def probe_versions(firefox_paths, max_workers=PROBE_WORKERS, refresh=False):
+    """
+    Return {firefox_path: version or None} for many executables at once.
+    An executable whose (inode, size, mtime) is unchanged since the last probe costs one stat,
+    unless refresh is set (e.g. application.ini changed but the executable did not).
+    Otherwise the version is read from application.ini/platform.ini next to the build, and only
+    builds without those files fall back to running 'firefox --version', on a bounded pool.
+    """
+    results = {}
+    to_run = []
+    updates = {}
+
+    for path in firefox_paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            results[path] = None
+            continue
+        key = [st.st_ino, st.st_size, st.st_mtime_ns]
+        with _lock:
+            cached = _load_cache().get(path)
+        if cached and cached["key"] == key and not refresh:
+            results[path] = cached["version"]
+            continue
+
+        version = read_ini_version(path)
+        if version:
+            results[path] = version
+            updates[path] = {"key": key, "version": version}
+        else:
+            to_run.append((path, key))
+
+    if to_run:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(to_run))) as pool:
+            for (path, key), version in zip(to_run, pool.map(lambda item: _run_version(item[0]), to_run)):
+                results[path] = version
+                if version:
+                    updates[path] = {"key": key, "version": version}
+
+    if updates:
+        _store(updates)
+    return results
+
+
+def read_ini_version(firefox_path):
+    """Read the version from the application.ini (or platform.ini) shipped with the build."""
+    exec_dir = os.path.dirname(firefox_path)
+    # On macOS the executable is in Contents/MacOS and the ini files in Contents/Resources
+    candidates = [exec_dir, os.path.join(os.path.dirname(exec_dir), "Resources")]
+    for folder in candidates:
+        for filename, section, option in (("application.ini", "App", "Version"),
+                                          ("platform.ini", "Build", "Milestone")):
+            ini_path = os.path.join(folder, filename)
+            if not os.path.isfile(ini_path):
+                continue
+            parser = configparser.ConfigParser(interpolation=None, strict=False)
+            try:
+                parser.read(ini_path, encoding="utf-8")
+                version = parser.get(section, option, fallback=None)
+            except configparser.Error:
+                version = None
+            if version:
+                return version.strip()
+    return None
+
+
+def _run_version(firefox_path):
+    try:
+        result = subprocess.run([firefox_path, "--version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                timeout=PROBE_TIMEOUT,
+                                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+        match = re.search(r"Mozilla Firefox (\S+)", result.stdout)
+        if match:
+            return match.group(1)
+    except Exception as e:
+        print(f"Could not get Firefox version from {firefox_path}: {e}")
+    return None
+
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_FILE, "r", encoding="utf-8") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _store(updates):
+    with _lock:
+        cache = _load_cache()
+        cache.update(updates)
+        atomic_write_json(CACHE_FILE, cache)
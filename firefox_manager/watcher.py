@@ -0,0 +1,225 @@
+# watcher.py
+"""
+Watches the install root so the database and the view follow what happens on disk without
+rescanning every build.
+
+On Linux the watcher uses inotify (through ctypes, no extra dependency). It watches the install
+root for build folders that are deleted, renamed or created, and each tracked build's
+application folder for changes to application.ini or the executable, e.g. when Firefox updates
+itself. Elsewhere, or when inotify is unavailable, it falls back to polling the same files
+every POLL_INTERVAL seconds.
+
+The watcher only reports *which* build folder changed, through on_change(install_path) on its
+own thread, once events for that folder have been quiet for DEBOUNCE seconds; working out what
+changed is left to the caller (see manager.sync_install).
+"""
+import os
+import sys
+import time
+import queue
+import struct
+import select
+import threading
+
+POLL_INTERVAL = 5.0     # seconds between scans when falling back to polling
+DEBOUNCE = 1.0          # an update touches many files; report the folder once they settle
+WAKE_INTERVAL = 0.5     # how often the watcher thread checks for new folders to track or a stop
+
+# Where the files that identify a build live, relative to its install folder
+APP_DIRS = ("firefox", os.path.join("Firefox.app", "Contents", "MacOS"),
+            os.path.join("Firefox.app", "Contents", "Resources"))
+WATCHED_FILES = {"application.ini", "platform.ini", "firefox", "firefox.exe"}
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")
+
+
+class BuildWatcher:
+    def __init__(self, root, on_change, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.backend = None
+        self._requests = queue.Queue()
+        self._pending = {}              # install_path -> time its events settle
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            self.backend = _InotifyBackend(self.root)
+        except OSError as e:
+            print(f"inotify unavailable ({e}), polling {self.root} every {self.poll_interval}s instead")
+            self.backend = _PollingBackend(self.root, self.poll_interval)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def track(self, install_path):
+        """Start watching the application files of one build folder. Safe to call from any thread."""
+        self._requests.put(install_path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+        if self.backend:
+            self.backend.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            while True:
+                try:
+                    self.backend.track(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            settle_at = time.monotonic() + DEBOUNCE
+            for path in self.backend.wait(WAKE_INTERVAL):
+                self._pending[path] = settle_at
+
+            now = time.monotonic()
+            for path in [p for p, due in self._pending.items() if due <= now]:
+                del self._pending[path]
+                if os.path.isdir(path):
+                    # Renamed or recreated folders need their application files watched again
+                    self.backend.track(path)
+                try:
+                    self.on_change(path)
+                except Exception as e:
+                    print(f"Could not sync {path}: {e}")
+
+
+class _InotifyBackend:
+    ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+    APP_MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+    def __init__(self, root):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is Linux only")
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.root_wd = self._add(root, self.ROOT_MASK)
+        self.watches = {}           # wd -> install_path
+
+    def _add(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(self._ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def track(self, install_path):
+        for app_dir in APP_DIRS:
+            folder = os.path.join(install_path, app_dir)
+            if os.path.isdir(folder):
+                try:
+                    # Adding an existing watch again returns the same wd
+                    self.watches[self._add(folder, self.APP_MASK)] = install_path
+                except OSError as e:
+                    print(f"Could not watch {folder}: {e}")
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + name_len].rstrip(b"\0"))
+            offset += _EVENT.size + name_len
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; every build might have changed
+                changed.update(self.watches.values())
+                changed.update(os.path.join(self.root, n) for n in os.listdir(self.root) if not _hidden(n))
+            elif mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd == self.root_wd:
+                if mask & IN_ISDIR and not _hidden(name):
+                    changed.add(os.path.join(self.root, name))
+            elif wd in self.watches and name in WATCHED_FILES:
+                changed.add(self.watches[wd])
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _PollingBackend:
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self.folders = self._list_root()
+        self.signatures = {}        # install_path -> signature of its application files
+        self.next_scan = time.monotonic() + interval
+
+    def track(self, install_path):
+        self.signatures[install_path] = _signature(install_path)
+
+    def wait(self, timeout):
+        delay = self.next_scan - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            return set()
+        self.next_scan = time.monotonic() + self.interval
+
+        folders = self._list_root()
+        changed = {os.path.join(self.root, name) for name in folders ^ self.folders}
+        self.folders = folders
+        for path, old in self.signatures.items():
+            new = _signature(path)
+            if new != old:
+                self.signatures[path] = new
+                changed.add(path)
+        return changed
+
+    def _list_root(self):
+        try:
+            return {entry.name for entry in os.scandir(self.root) if entry.is_dir() and not _hidden(entry.name)}
+        except OSError:
+            return set()
+
+    def close(self):
+        pass
+
+
+def _hidden(name):
+    # e.g. the .trash folder removed builds are moved into; never a build
+    return name.startswith(".")
+
+
+def _signature(install_path):
+    """(name, inode, size, mtime) of every watched file of a build, or None if the folder is gone."""
+    if not os.path.isdir(install_path):
+        return None
+    signature = []
+    for app_dir in APP_DIRS:
+        for name in sorted(WATCHED_FILES):
+            try:
+                st = os.stat(os.path.join(install_path, app_dir, name))
+            except OSError:
+                continue
+            signature.append((app_dir, name, st.st_ino, st.st_size, st.st_mtime_ns))
+    return tuple(signature)